@@ -0,0 +1,12 @@
+# 后端 HTTP 接口：挂载在 reflex 应用之外的自定义路由（服务商回调、运行指标、调试接口等）
+from starlette.applications import Starlette
+from starlette.routing import Route
+
+from image_gen_page.tool import heap_profile, metrics, webhook, ws_stats
+
+api = Starlette(routes=[
+    Route('/webhook/{kind}/{key}', webhook.receive, methods=['POST']),
+    Route('/metrics', metrics.endpoint, methods=['GET']),
+    Route('/debug/ws', ws_stats.endpoint, methods=['GET']),
+    Route('/debug/heap', heap_profile.endpoint, methods=['GET']),
+])
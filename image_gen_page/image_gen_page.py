@@ -3,8 +3,17 @@ import os
 import dotenv
 import reflex as rx
 
+from image_gen_page.api import api
 from image_gen_page.pages import jimeng, gpt4o, cover, kontext, aichart, geminiImage, grokImage, grokVideo, mondo, \
     text2image
+from image_gen_page.tool.cancellation import watch_disconnects
+from image_gen_page.tool.config import watch_config
+from image_gen_page.tool.heap_profile import trace_heap
+from image_gen_page.tool.job_queue import get_job_queue
+from image_gen_page.tool.loop_monitor import watch_event_loop
+from image_gen_page.tool.session_reaper import reap_sessions
+from image_gen_page.tool.tracing import export_spans
+from image_gen_page.tool.ws_stats import report_ws_stats
 
 # 初始化配置
 dotenv.load_dotenv()
@@ -12,16 +21,34 @@ dotenv.load_dotenv()
 # 设置环境变量以禁用代理
 os.environ["no_proxy"] = "localhost,127.0.0.1,::1"
 
-# 创建reflex示例并添加路由页面
-app = rx.App()
+# 创建reflex示例并添加路由页面，自定义接口（服务商回调等）通过 api_transformer 挂载
+app = rx.App(api_transformer=api)
+# 进程启动后立即运行任务队列 worker，恢复上次中断的生成任务
+app.register_lifespan_task(get_job_queue().serve)
+# 监听 SIGHUP 与 .env 文件修改，热更新配置
+app.register_lifespan_task(watch_config)
+# 会话断开超过宽限期后取消其进行中的生成
+app.register_lifespan_task(watch_disconnects)
+# 回收空闲会话的页面状态，限制会话状态占用的内存
+app.register_lifespan_task(reap_sessions)
+# 定期导出追踪数据到 JSONL 文件或 OTLP 收集端
+app.register_lifespan_task(export_spans)
+# 检测阻塞事件循环的同步调用（LOOP_MONITOR=1 时开启）
+app.register_lifespan_task(watch_event_loop)
+# 统计 websocket 事件与状态增量流量并定期打印报告（WS_STATS=1 时开启）
+app.register_lifespan_task(report_ws_stats)
+# 启动即开始堆内存追踪（HEAP_TRACE_FRAMES>0 时），供 /debug/heap 对比
+app.register_lifespan_task(trace_heap)
 app.add_page(jimeng.index, route='/', title="智能提示词图片生成器")
 app.add_page(gpt4o.index, route='/gpt4oimage', title="智能提示词图片生成器")
 app.add_page(cover.index, route='/cover', title="在线制作文章封面图")
-app.add_page(kontext.index, route='/kontext', title="基于 flux-pro/kontext 模型的智能图片编辑器")
+app.add_page(kontext.index, route='/kontext', title="基于 flux-pro/kontext 模型的智能图片编辑器",
+             on_load=kontext.KontextState.reattach_job)
 app.add_page(geminiImage.index, route='/geminiImage',
              title="基于 google/gemini-3-pro-image-preview 模型的智能图片编辑器")
 app.add_page(grokImage.index, route='/grokImage', title="基于 grok imagine 模型的智能图片生成器")
-app.add_page(grokVideo.index, route='/grokVideo', title="基于 grok imagine 模型的智能视频生成器")
+app.add_page(grokVideo.index, route='/grokVideo', title="基于 grok imagine 模型的智能视频生成器",
+             on_load=grokVideo.GrokVideoState.reattach_job)
 app.add_page(mondo.index, route='/mondo', title="基于 Nano Banana 模型的大师级海报生成器")
 app.add_page(aichart.index, route='/aichart', title="AI 统计图表生成器")
 app.add_page(text2image.index, route='/text2image', title="通用文生图生成器",
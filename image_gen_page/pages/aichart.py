@@ -1,10 +1,20 @@
 # 加载配置
+import asyncio
+import base64
 import json
-import os
+from typing import Callable
 
-import aiohttp
 import reflex as rx
 
+from image_gen_page.tool.admission import admission_ticket
+from image_gen_page.tool.cancellation import cancellable
+from image_gen_page.tool.chart_render import chart_kind, parse_spec, render_chart, spec_prompt
+from image_gen_page.tool.chat_stream import stream_chat
+from image_gen_page.tool.components import prompt_area
+from image_gen_page.tool.config import get_config
+from image_gen_page.tool.metrics import client_session
+from image_gen_page.tool.tracing import error_alert
+
 
 class AichartState(rx.State):
     """The app state."""
@@ -13,6 +23,7 @@ class AichartState(rx.State):
     image_urls = []
     processing = False
     complete = False
+    queue_status = ""  # 排队提示
     uploading = False  # 新增上传状态变量
 
     upload_img: str = ''
@@ -21,7 +32,6 @@ class AichartState(rx.State):
     def set_prompt(self, prompt: str):
         self.prompt = prompt
 
-    chart_type = "条形图-展示不同类别之间的数值比较"  # 默认尺寸
     chart_type_options = [
         '条形图-展示不同类别之间的数值比较',
         '柱状图-适合比较分类数据',
@@ -40,63 +50,92 @@ class AichartState(rx.State):
         '双轴图-结合两种不同图表类型',
     ]
 
-    def set_chart_type(self, chart_type: str):
-        self.chart_type = chart_type
+    # 可一次选择多种图表类型，并发生成，默认选中条形图
+    chart_types = ["条形图-展示不同类别之间的数值比较"]
+    image_captions = []  # 每张图对应的图表类型
+
+    def toggle_chart_type(self, chart_type: str):
+        if chart_type in self.chart_types:
+            self.chart_types = [item for item in self.chart_types if item != chart_type]
+        else:
+            self.chart_types = self.chart_types + [chart_type]
 
     @rx.event(background=True)
+    @cancellable('aichart', processing=False, complete=True, queue_status="")
     async def get_image(self):
         """调用大模型生成图片."""
         if self.prompt == "":
             yield rx.window_alert("提示词不能为空！")
             return
+        chart_types = [item for item in self.chart_type_options if item in self.chart_types]
+        if not chart_types:
+            yield rx.window_alert("请至少选择一种图表类型！")
+            return
 
         async with self:
             self.processing = True
-            self.complete = False
+            # 每完成一张就展示一张
+            self.complete = True
             self.image_urls = []
-        try:
-            yield
-            prompt = f"""您是一个统计图表设计生成器，必须根据用户的提示词画出”{self.chart_type.split('-')[0]}“，用户的提示词内容如下：
-```
-{self.prompt}
-```
-"""
-            print(prompt)
-            param = {
-                'question': prompt,
-            }
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                        os.getenv('AICHART_FLOWISE_URL'),
-                        json=param,
-                        headers={
-                            'Content-Type': 'application/json',
-                        }
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        image_urls = []
-                        for item in data['usedTools']:
-                            if item['toolOutput'] != '':
-                                outputs = json.loads(item['toolOutput'])  # 将JSON字符串转为数组
-                                for output in outputs:
-                                    image_urls.append(output['text'])
-
-                        if len(image_urls) == 0:
-                            error_text = await response.text()
-                            yield rx.window_alert("图片生成失败！异常原因：" + error_text)
+            self.image_captions = []
+            self.queue_status = f"生成中 0/{len(chart_types)}" if len(chart_types) > 1 else ""
+        yield
+        tenant = self.router.session.client_token
+        # 各图表在服务商准入队列中的排队提示，随生成进度一起展示
+        waiting: dict[str, str] = {}
+        changed = asyncio.Event()
+
+        def report(chart_type: str, status: str):
+            if status:
+                waiting[chart_type] = status
+            else:
+                waiting.pop(chart_type, None)
+            changed.set()
+
+        def progress_text(finished: int) -> str:
+            parts = [f"生成中 {finished}/{len(chart_types)}"] if len(chart_types) > 1 else []
+            parts += [f"{chart_type.split('-')[0]}：{status}" if len(chart_types) > 1 else status
+                      for chart_type, status in waiting.items()]
+            return '；'.join(parts)
+
+        # 同一次提交内同时生成的图表数有上限，另外各自仍受服务商准入限制
+        semaphore = asyncio.Semaphore(get_config().aichart_concurrency)
+        async with client_session() as session:
+            tasks = [asyncio.create_task(generate_chart(session, semaphore, chart_type, self.prompt, tenant, report))
+                     for chart_type in chart_types]
+            pending, finished = set(tasks), 0
+            try:
+                while pending:
+                    # 有图表完成或排队提示变化时刷新进度
+                    status_changed = asyncio.create_task(changed.wait())
+                    try:
+                        done, _ = await asyncio.wait(pending | {status_changed}, return_when=asyncio.FIRST_COMPLETED)
+                    finally:
+                        status_changed.cancel()
+                    changed.clear()
+                    for task in done & pending:
+                        pending.discard(task)
+                        finished += 1
+                        try:
+                            chart_type, image_urls = task.result()
+                        except Exception as e:
+                            yield error_alert("图片生成失败！异常原因：" + str(e))
                         else:
                             async with self:
-                                self.image_urls = image_urls
-                    else:
-                        error_text = await response.text()
-                        yield rx.window_alert(f"图片生成失败！异常原因：{response.status}-{error_text}")
-        except Exception as e:
-            yield rx.window_alert("图片生成失败！异常原因：" + str(e))
+                                self.image_urls = self.image_urls + image_urls
+                                self.image_captions = self.image_captions + [chart_type.split('-')[0]] * len(image_urls)
+                    if pending:
+                        async with self:
+                            self.queue_status = progress_text(finished)
+            finally:
+                # 被取消（重新提交、断开连接）时一并取消未完成的图表
+                for task in tasks:
+                    task.cancel()
         # 延迟状态更新
         async with self:
             self.processing = False
             self.complete = True
+            self.queue_status = ""
 
     def download_image(self, url: str):
         """下载指定URL的图片"""
@@ -107,7 +146,7 @@ class AichartState(rx.State):
                       const blob = await res.blob();
                       const a = document.createElement('a');
                       a.href = URL.createObjectURL(blob);
-                      a.download = 'image.png';
+                      a.download = blob.type.includes('svg') ? 'image.svg' : 'image.png';
                       a.click();
                       URL.revokeObjectURL(a.href);
                   }} catch (err) {{
@@ -117,6 +156,88 @@ class AichartState(rx.State):
           """)
 
 
+async def generate_chart(session, semaphore: asyncio.Semaphore, chart_type: str, prompt: str, tenant: str,
+                         report: Callable[[str, str], None]) -> tuple[str, list[str]]:
+    """生成一种图表，返回 (图表类型, 图片地址列表)；本地引擎失败且配置了 Flowise 时改用 Flowise。
+    report(图表类型, 排队提示) 用于转发准入排队状态，准入后以空字符串调用"""
+    config = get_config()
+    async with semaphore:
+        try:
+            if config.aichart_engine == 'local':
+                try:
+                    return chart_type, [await local_chart(session, chart_type, prompt, tenant, report)]
+                except Exception as e:
+                    if not config.aichart_flowise_url:
+                        raise
+                    print(f"[图表] 本地渲染失败，改用 Flowise：{e}")
+            return chart_type, await flowise_chart(session, chart_type, prompt, tenant, report)
+        except Exception as e:
+            raise Exception(f"{chart_type.split('-')[0]}：{e}")
+
+
+async def local_chart(session, chart_type: str, prompt: str, tenant: str,
+                      report: Callable[[str, str], None]) -> str:
+    """本地引擎：大模型只返回图表描述，渲染在本地进程池完成，返回 SVG 的 data URL"""
+    async with admission_ticket('aichart', tenant) as ticket:
+        async for status in ticket.waiting():
+            report(chart_type, status)
+        report(chart_type, '')
+        spec = await fetch_chart_spec(session, chart_type, prompt)
+    svg = await render_chart(spec, get_config().chart_render_workers)
+    return "data:image/svg+xml;base64," + base64.b64encode(svg.encode('utf-8')).decode('utf-8')
+
+
+async def flowise_chart(session, chart_type: str, prompt: str, tenant: str,
+                        report: Callable[[str, str], None]) -> list[str]:
+    """Flowise 智能体生成图表，从工具输出中取出图片地址"""
+    question = f"""您是一个统计图表设计生成器，必须根据用户的提示词画出”{chart_type.split('-')[0]}“，用户的提示词内容如下：
+```
+{prompt}
+```
+"""
+    print(question)
+    param = {
+        'question': question,
+    }
+    async with admission_ticket('flowise', tenant) as ticket:
+        async for status in ticket.waiting():
+            report(chart_type, status)
+        report(chart_type, '')
+        async with session.post(
+                get_config().aichart_flowise_url,
+                json=param,
+                headers={
+                    'Content-Type': 'application/json',
+                }
+        ) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                raise Exception(f"{response.status}-{error_text}")
+            data = await response.json()
+            image_urls = []
+            for item in data['usedTools']:
+                if item['toolOutput'] != '':
+                    outputs = json.loads(item['toolOutput'])  # 将JSON字符串转为数组
+                    for output in outputs:
+                        image_urls.append(output['text'])
+            if len(image_urls) == 0:
+                raise Exception(await response.text())
+            return image_urls
+
+
+async def fetch_chart_spec(session, chart_type: str, prompt: str) -> dict:
+    """让大模型返回结构化的图表描述"""
+    kind = chart_kind(chart_type)
+    if kind is None:
+        raise Exception(f"不支持的图表类型：{chart_type}")
+    config = get_config()
+    text = ''
+    async for delta in stream_chat(session, config.aichart.base_url, config.aichart.api_key, config.aichart_model,
+                                   [{"role": "user", "content": spec_prompt(chart_type, prompt)}], temperature=0.2):
+        text += delta.content
+    return parse_spec(text, kind)
+
+
 def image_modal(image_url):
     return rx.dialog.root(
         rx.dialog.trigger(
@@ -163,7 +284,7 @@ def index():
                     width="100%"
                 ),
                 rx.text(AichartState.error_msg, color="red"),
-                rx.text_area(
+                prompt_area(
                     value=AichartState.prompt,
                     placeholder="请输入提示词",
                     on_change=AichartState.set_prompt,
@@ -171,12 +292,21 @@ def index():
                     rows='5',
                     resize='vertical',
                 ),
-                rx.select(
-                    AichartState.chart_type_options,
-                    value=AichartState.chart_type,
-                    on_change=AichartState.set_chart_type,
+                rx.text("选择统计图类型（可多选，同时生成）", font_size="0.85em", color="gray",
+                        width=["23em", "28.5em"]),
+                rx.flex(
+                    rx.foreach(
+                        AichartState.chart_type_options,
+                        lambda chart_type: rx.checkbox(
+                            chart_type,
+                            checked=AichartState.chart_types.contains(chart_type),
+                            on_change=lambda _: AichartState.toggle_chart_type(chart_type),
+                            size="1",
+                        ),
+                    ),
+                    direction="column",
+                    gap="0.4em",
                     width=["23em", "28.5em"],
-                    placeholder="选择统计图类型",
                 ),
                 rx.button(
                     "生成图片",
@@ -184,14 +314,19 @@ def index():
                     width=["23em", "28.5em"],
                     loading=AichartState.processing
                 ),
+                rx.cond(
+                    AichartState.queue_status != "",
+                    rx.text(AichartState.queue_status, color="gray", font_size="0.85em"),
+                ),
 
                 rx.cond(
                     AichartState.complete,
                     rx.flex(
                         rx.foreach(
                             AichartState.image_urls,
-                            lambda url: rx.vstack(
+                            lambda url, index: rx.vstack(
                                 image_modal(url),
+                                rx.text(AichartState.image_captions[index], color="gray", font_size="0.85em"),
                                 rx.button(
                                     "下载图片",
                                     width=["23em", "28.5em"],
@@ -1,36 +1,109 @@
 # 加载配置
 import asyncio
 import base64
-import os
+import contextlib
 import re
 
-import aiohttp  # 替换 requests 为 aiohttp
 import reflex as rx
 
+from image_gen_page.tool.admission import Ticket, admission_ticket
+from image_gen_page.tool.cancellation import cancellable
+from image_gen_page.tool.chat_stream import stream_chat
+from image_gen_page.tool.common_tool import get_data_dir
+from image_gen_page.tool.components import prompt_area
+from image_gen_page.tool.config import get_config
+from image_gen_page.tool.disk_cache import DiskCache, cache_key
+from image_gen_page.tool.metrics import client_session
+from image_gen_page.tool.tracing import error_alert, span
+
+# 封面 HTML 缓存（按模型、主题、风格、尺寸、序号）与截图缓存（按 HTML 与截图参数），进程内单例
+_html_cache: DiskCache | None = None
+_png_cache: DiskCache | None = None
+
+
+def get_html_cache() -> DiskCache:
+    global _html_cache
+    if _html_cache is None:
+        _html_cache = DiskCache(get_data_dir() / 'cover_cache' / 'html', get_config().cover.html_cache_bytes, '.html',
+                                'cover_html')
+    return _html_cache
+
+
+def get_png_cache() -> DiskCache:
+    global _png_cache
+    if _png_cache is None:
+        _png_cache = DiskCache(get_data_dir() / 'cover_cache' / 'png', get_config().cover.png_cache_bytes, '.png',
+                               'cover_png')
+    return _png_cache
+
+
+# 固定尺寸设计在足够大的视口中截取 #maincover
+DEFAULT_VIEWPORT = (1920, 1600)
+
+RESPONSIVE_SIZE_REQUIREMENT = (
+    "响应式设计，#maincover 宽高为 100vw×100vh 铺满视口，body 无边距且不出现滚动条；"
+    "需要在 1:1、16:9、9:16、4:3、3:4、2:3、3:2 等不同比例的视口下都完整美观地显示，"
+    "尺寸、间距和字号使用 vw、vh、vmin 等相对单位，必要时用媒体查询（orientation、aspect-ratio）调整横竖版布局"
+)
+
+
+def parse_size(size: str) -> tuple[int, int]:
+    """解析 "1024x576x(16:9)" 形式的尺寸选项"""
+    width, height = size.split('x')[:2]
+    return int(width), int(height)
+
+
+def cover_prompt(topic: str, style: str, size_requirement: str) -> str:
+    return f"""
+# 请使用HTML、JS和CSS设计一个视觉吸引力强的封面图，确保设计既美观又专业，能够有效吸引受众的注意力
+
+## 具有以下特点
+- 尺寸规格：{size_requirement}
+- 文字限制：只需要包含主题内容的文字，可以拆分关键词优化显示
+- 主题内容："{topic}"
+
+## 设计风格
+{style}
+- 配色方案自动根据风格生成，确保视觉效果和谐
+
+## 排版要求：
+- 主标题字体大小合适，确保清晰可辨，最好居中显示
+- 自动定位关键词，可特别突出，可考虑使用醒目颜色或特殊设计元素
+- 整体布局平衡，视觉层次分明
+
+## 额外元素：
+- 可以根据主题内容，简单适配一些标签、图标或相关图形
+- 考虑添加简约的装饰元素增强视觉吸引力
+
+## 实用性考虑：
+- 设计应适合截图分享到社交媒体
+- 确保边缘有足够留白以适应不同平台的显示需求
+- 文字对比度要高，确保在小尺寸下仍清晰可读
+
+## 交付要求
+- 只需要返回一个设计后的html代码，里面包含完整HTML、JS、CSS代码内容，页面元素不要交互和动画效果，浏览器打开页面渲染完就是最终的静态效果
+- 封面图应该放在id=maincover的标签中，以便于我后续截图这个标签的内容作为封面图
+                """
+
 
 class PageState(rx.State):
     """The app state."""
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        cover_model = os.getenv('COVER_MODEL', '')
-        cover_count = os.getenv('COVER_COUNT', '1')
-        cover_models = cover_model.split(',') if cover_model else []
-        cover_counts = cover_count.split(',')
-        for index, model in enumerate(cover_models):
-            count = int(cover_counts[index]) if index < len(cover_counts) else 1
-            self.cover_counts_dict[model] = count
-
+        # 模型列表与生成数量来自启动时解析好的配置快照
+        cover_models = get_config().cover.models
         if cover_models:
             self.model = cover_models[0]
-            self.model_options = cover_models
+            self.model_options = list(cover_models)
 
     prompt = ""
     image_urls = []
+    image_captions = []  # 多尺寸模式下每张图对应的尺寸
     processing = False
     complete = False
+    queue_status = ""  # 排队提示
 
-    cover_counts_dict = {}
     model = ""  # 默认尺寸
     model_options = []
 
@@ -51,6 +124,19 @@ class PageState(rx.State):
     def set_size(self, size: str):
         self.size = size
 
+    # 多尺寸模式：只生成一份自适应设计，再按所选尺寸分别截图
+    responsive = False
+    responsive_sizes = list(size_options)
+
+    def set_responsive(self, enabled: bool):
+        self.responsive = enabled
+
+    def toggle_responsive_size(self, size: str):
+        if size in self.responsive_sizes:
+            self.responsive_sizes = [item for item in self.responsive_sizes if item != size]
+        else:
+            self.responsive_sizes = self.responsive_sizes + [size]
+
     style = "现代简约风格，干净利落的线条和留白设计"  # 默认尺寸
     style_options = [
         "现代简约风格，干净利落的线条和留白设计",
@@ -73,7 +159,19 @@ class PageState(rx.State):
         self.prompt = prompt
 
     @rx.event(background=True)
+    @cancellable('cover', processing=False, complete=True, queue_status="")
     async def get_image(self):
+        async for event in self._generate(fresh=False):
+            yield event
+
+    @rx.event(background=True)
+    @cancellable('cover', processing=False, complete=True, queue_status="")
+    async def regenerate(self):
+        """换一批：不使用已缓存的 HTML，重新调用大模型生成"""
+        async for event in self._generate(fresh=True):
+            yield event
+
+    async def _generate(self, fresh: bool):
         if self.prompt == "":
             yield rx.window_alert("提示词不能为空！")
             return
@@ -81,72 +179,75 @@ class PageState(rx.State):
             self.processing = True
             self.complete = False
             self.image_urls = []
+            self.image_captions = []
 
-        async with aiohttp.ClientSession() as session:
+        async with client_session() as session:
             try:
-                size = self.size.split('x')
-                width = int(size[0])
-                height = int(size[1])
-                content = f"""
-# 请使用HTML、JS和CSS设计一个视觉吸引力强的封面图，确保设计既美观又专业，能够有效吸引受众的注意力
-
-## 具有以下特点
-- 尺寸规格：固定宽高为{width}px×{height}px
-- 文字限制：只需要包含主题内容的文字，可以拆分关键词优化显示
-- 主题内容："{self.prompt}"
-
-## 设计风格
-{self.style}
-- 配色方案自动根据风格生成，确保视觉效果和谐
-
-## 排版要求：
-- 主标题字体大小合适，确保清晰可辨，最好居中显示
-- 自动定位关键词，可特别突出，可考虑使用醒目颜色或特殊设计元素
-- 整体布局平衡，视觉层次分明
-
-## 额外元素：
-- 可以根据主题内容，简单适配一些标签、图标或相关图形
-- 考虑添加简约的装饰元素增强视觉吸引力
-
-## 实用性考虑：
-- 设计应适合截图分享到社交媒体
-- 确保边缘有足够留白以适应不同平台的显示需求
-- 文字对比度要高，确保在小尺寸下仍清晰可读
-
-## 交付要求
-- 只需要返回一个设计后的html代码，里面包含完整HTML、JS、CSS代码内容，页面元素不要交互和动画效果，浏览器打开页面渲染完就是最终的静态效果
-- 封面图应该放在id=maincover的标签中，以便于我后续截图这个标签的内容作为封面图
-                """
+                responsive = self.responsive
+                if responsive:
+                    sizes = [size for size in self.size_options if size in self.responsive_sizes]
+                    if not sizes:
+                        raise Exception('请至少选择一个尺寸')
+                    viewports = tuple(parse_size(size) for size in sizes)
+                    content = cover_prompt(self.prompt, self.style, RESPONSIVE_SIZE_REQUIREMENT)
+                else:
+                    sizes = [""]
+                    viewports = (DEFAULT_VIEWPORT,)
+                    width, height = parse_size(self.size)
+                    content = cover_prompt(self.prompt, self.style, f"固定宽高为{width}px×{height}px")
                 # 模型校验
                 if self.model not in self.model_options:
                     raise Exception('模型不存在')
-                count = self.cover_counts_dict[self.model]
-                # 并发执行多次请求
-                tasks = [fetch_image(session, self.model, content) for _ in range(count)]
-                results = await asyncio.gather(*tasks, return_exceptions=True)
+                # 多尺寸模式只需一份设计
+                count = 1 if responsive else get_config().cover.model_counts[self.model]
+                tenant = self.router.session.client_token
+                # 相同参数生成过的 HTML 直接复用，只对未命中的序号调用大模型
+                size_key = 'responsive' if responsive else self.size
+                keys = [cache_key(self.model, self.prompt, self.style, size_key, index) for index in range(count)]
+                if fresh:
+                    cached = [None] * count
+                else:
+                    cached = [await get_html_cache().aget(key) for key in keys]
+                async with contextlib.AsyncExitStack() as stack:
+                    # 未命中的请求各领取一个准入凭证，页面展示第一个请求的排队位置
+                    tickets = {index: await stack.enter_async_context(admission_ticket('cover', tenant))
+                               for index in range(count) if cached[index] is None}
+                    if tickets:
+                        async for status in next(iter(tickets.values())).waiting():
+                            async with self:
+                                self.queue_status = status
+                        async with self:
+                            self.queue_status = ""
+                    # 并发执行多次请求，每份 HTML 生成完立即截图，不必等其他请求
+                    tasks = [render_cover(session, self.model, content, tickets.get(index), tenant, keys[index],
+                                          cached[index].decode('utf-8') if cached[index] is not None else None,
+                                          viewports)
+                             for index in range(count)]
+                    results = await asyncio.gather(*tasks, return_exceptions=True)
 
                 image_urls = []
+                image_captions = []
                 for result in results:
                     if isinstance(result, Exception):
-                        yield rx.window_alert(f"图片生成失败！异常原因1：{str(result)}")
-                        continue
-                    first_html_block = extract_first_html_code_block(result)
-                    # 截图处理 - 改为异步
-                    try:
-                        image_base64 = await take_screenshot(session, first_html_block)
-                        image_urls.append(f"data:image/png;base64,{image_base64}")
-                    except Exception as e:
-                        yield rx.window_alert(f"截图失败：{str(e)}")
+                        yield error_alert(f"图片生成失败！异常原因1：{str(result)}")
                         continue
+                    for caption, shot in zip(sizes, result):
+                        if isinstance(shot, Exception):
+                            yield error_alert(f"图片生成失败！异常原因1：{str(shot)}")
+                            continue
+                        image_urls.append(f"data:image/png;base64,{shot}")
+                        image_captions.append(caption)
 
                 async with self:
                     self.image_urls = image_urls
+                    self.image_captions = image_captions
             except Exception as e:
-                yield rx.window_alert("图片生成失败！异常原因2：" + str(e))
+                yield error_alert("图片生成失败！异常原因2：" + str(e))
 
         async with self:
             self.processing = False
             self.complete = True
+            self.queue_status = ""
 
     def download_image(self, url: str):
         """下载指定URL的图片"""
@@ -167,48 +268,114 @@ class PageState(rx.State):
           """)
 
 
-async def fetch_image(session, model, content):
-    async with session.post(
-            os.getenv('COVER_OPENAI_BASE_URL', os.getenv('OPENAI_BASE_URL')) + '/chat/completions',
-            json={
-                "model": model,
-                "messages": [{"role": "user", "content": content}],
-                "stream": False
-            },
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': 'Bearer ' + os.getenv('COVER_OPENAI_API_KEY', os.getenv('OPENAI_API_KEY'))
-            }
-    ) as response:
-        if response.status == 200:
-            data = await response.json()
-            return data['choices'][0]['message']['content']
-        else:
-            error_text = await response.text()
-            raise Exception(f"Request failed: {response.status}-{error_text}")
-
-
-async def take_screenshot(session, html_content):
+async def render_cover(session, model, content, ticket: Ticket | None = None, tenant: str = '',
+                       html_key: str = '', html: str | None = None,
+                       viewports: tuple[tuple[int, int], ...] = (DEFAULT_VIEWPORT,)) -> list:
+    """生成封面 HTML 并按每个视口并发截图，返回各视口 PNG 的 base64（截图失败的位置为异常）；
+    传入已缓存的 html 时跳过大模型调用"""
+    if html is None:
+        html = await fetch_image(session, model, content, ticket)
+        if html_key:
+            await get_html_cache().aput(html_key, html.encode('utf-8'))
+
+    async def shot(viewport):
+        try:
+            return await take_screenshot(session, html, tenant, viewport)
+        except Exception as e:
+            raise Exception(f"截图失败：{str(e)}")
+
+    return await asyncio.gather(*(shot(viewport) for viewport in viewports), return_exceptions=True)
+
+
+async def fetch_image(session, model, content, ticket: Ticket | None = None) -> str:
+    """流式生成封面 HTML，读到第一个完整的 HTML 文档后立即断开，不再等待模型后续的说明文字"""
+    endpoint = get_config().cover.endpoint
+    if ticket is not None:
+        # 等待准入后再请求，完成后立即释放名额，不必等截图结束
+        await ticket.admitted()
+    try:
+        detector = HtmlBoundaryDetector()
+        text = ''
+        async with contextlib.aclosing(stream_chat(session, endpoint.base_url, endpoint.api_key, model,
+                                                   [{"role": "user", "content": content}])) as stream:
+            async for delta in stream:
+                text += delta.content
+                html = detector.feed(delta.content)
+                if html is not None:
+                    return html
+        html = extract_first_html_code_block(text)
+        if html is None:
+            raise Exception(f"未能从模型返回内容中提取到HTML代码：{text[:200]}")
+        return html
+    finally:
+        if ticket is not None:
+            ticket.release()
+
+
+async def take_screenshot(session, html_content, tenant: str = '', viewport: tuple[int, int] = DEFAULT_VIEWPORT):
     """异步截图函数"""
     screenshot_data = {
         "url": html_content,
-        "viewport_width": 1920,
-        "viewport_height": 1600,
+        "viewport_width": viewport[0],
+        "viewport_height": viewport[1],
         "element_selector": "#maincover",
         "wait_second": 3,
         "use_proxy": 1,
     }
-
-    async with session.post(
-            os.getenv('SCREEN_BASE_URL', 'http://10.8.0.2:14140') + '/screenshot',
-            json=screenshot_data  # 使用 json 参数而不是 data
-    ) as response:
-        if response.status == 200:
-            content = await response.read()
-            return base64.b64encode(content).decode('utf-8')
-        else:
-            error_text = await response.text()
-            raise Exception(f"Screenshot failed: {response.status}-{error_text}")
+    # 同一份 HTML 在相同截图参数下结果一致，直接复用
+    png_key = cache_key(screenshot_data)
+    with span('screenshot', viewport=f"{viewport[0]}x{viewport[1]}") as current:
+        cached = await get_png_cache().aget(png_key)
+        current.set(cached=cached is not None)
+        if cached is not None:
+            return base64.b64encode(cached).decode('utf-8')
+
+        async with admission_ticket('screenshot', tenant) as ticket:
+            await ticket.admitted()
+            async with session.post(
+                    get_config().cover.screen_base_url + '/screenshot',
+                    json=screenshot_data  # 使用 json 参数而不是 data
+            ) as response:
+                if response.status == 200:
+                    content = await response.read()
+                    await get_png_cache().aput(png_key, content)
+                    return base64.b64encode(content).decode('utf-8')
+                else:
+                    error_text = await response.text()
+                    raise Exception(f"Screenshot failed: {response.status}-{error_text}")
+
+
+class HtmlBoundaryDetector:
+    """增量检测流式文本中第一个完整的 HTML 文档（<!DOCTYPE html> 或 <html 开始，到 </html> 结束）"""
+
+    def __init__(self):
+        self.buffer = ''
+        self.lower = ''  # buffer 的小写形式，随 buffer 增量追加
+        self.start = -1  # 文档起始位置
+        self.doctype = -1  # <!DOCTYPE html> 的位置
+        self.scanned = 0  # 已扫描过的位置，新数据只需从这里（减去标签长度的重叠）开始查找
+
+    def feed(self, chunk: str) -> str | None:
+        """追加一段文本，文档完整时返回文档内容，否则返回 None"""
+        self.buffer += chunk
+        self.lower += chunk.lower()
+        lower = self.lower
+        if self.start < 0:
+            # 与正则提取一致：先找 <!doctype html，其后须有 <html
+            search_from = max(self.scanned - len('<!doctype html'), 0)
+            if self.doctype < 0:
+                self.doctype = lower.find('<!doctype html', search_from)
+            html = lower.find('<html', max(self.doctype, search_from))
+            if html < 0:
+                self.scanned = len(self.buffer)
+                return None
+            self.start = self.doctype if self.doctype >= 0 else html
+            self.scanned = html + len('<html')
+        end = lower.find('</html>', max(self.scanned - len('</html>'), self.start))
+        self.scanned = len(self.buffer)
+        if end < 0:
+            return None
+        return self.buffer[self.start:end + len('</html>')]
 
 
 def extract_first_html_code_block(text):
@@ -275,7 +442,7 @@ def index():
                     text_align="center",
                     width="100%"
                 ),
-                rx.text_area(
+                prompt_area(
                     value=PageState.prompt,
                     placeholder="请输入文章标题或主题内容",
                     on_change=PageState.set_prompt,
@@ -283,12 +450,39 @@ def index():
                     rows='5',
                     resize='vertical',
                 ),
-                rx.select(
-                    PageState.size_options,
-                    value=PageState.size,
-                    on_change=PageState.set_size,
+                rx.hstack(
+                    rx.switch(
+                        checked=PageState.responsive,
+                        on_change=PageState.set_responsive,
+                        size="1",
+                    ),
+                    rx.text("多尺寸：一次生成自适应设计，按所选尺寸分别渲染", font_size="0.8em", color="gray"),
+                    align="center",
                     width=["23em", "28.5em"],
-                    placeholder="选择图片尺寸",
+                ),
+                rx.cond(
+                    PageState.responsive,
+                    rx.flex(
+                        rx.foreach(
+                            PageState.size_options,
+                            lambda size: rx.checkbox(
+                                size,
+                                checked=PageState.responsive_sizes.contains(size),
+                                on_change=lambda _: PageState.toggle_responsive_size(size),
+                                size="1",
+                            ),
+                        ),
+                        wrap="wrap",
+                        gap="0.5em 1em",
+                        width=["23em", "28.5em"],
+                    ),
+                    rx.select(
+                        PageState.size_options,
+                        value=PageState.size,
+                        on_change=PageState.set_size,
+                        width=["23em", "28.5em"],
+                        placeholder="选择图片尺寸",
+                    ),
                 ),
                 rx.select(
                     PageState.style_options,
@@ -310,13 +504,31 @@ def index():
                     width=["23em", "28.5em"],
                     loading=PageState.processing
                 ),
+                rx.cond(
+                    PageState.complete,
+                    rx.button(
+                        "换一批",
+                        on_click=PageState.regenerate,
+                        width=["23em", "28.5em"],
+                        variant="soft",
+                        loading=PageState.processing
+                    ),
+                ),
+                rx.cond(
+                    PageState.queue_status != "",
+                    rx.text(PageState.queue_status, color="gray", font_size="0.85em"),
+                ),
                 rx.cond(
                     PageState.complete,
                     rx.flex(
                         rx.foreach(
                             PageState.image_urls,
-                            lambda url: rx.vstack(
+                            lambda url, index: rx.vstack(
                                 image_modal(url),
+                                rx.cond(
+                                    PageState.image_captions[index] != "",
+                                    rx.text(PageState.image_captions[index], color="gray", font_size="0.85em"),
+                                ),
                                 rx.button(
                                     "下载图片",
                                     width="20em",
@@ -1,12 +1,16 @@
 # 加载配置
 import hashlib
-import os
 import re
 
-import aiohttp
 import reflex as rx
 
+from image_gen_page.tool.admission import admission_ticket
+from image_gen_page.tool.cancellation import cancellable
+from image_gen_page.tool.components import prompt_area
+from image_gen_page.tool.config import get_config
 from image_gen_page.tool.common_tool import image_to_base64
+from image_gen_page.tool.metrics import client_session
+from image_gen_page.tool.tracing import error_alert
 
 
 class GeminiImageState(rx.State):
@@ -18,6 +22,7 @@ class GeminiImageState(rx.State):
     img2img_urls = []  # 图片编辑生成的图片
     processing = False
     uploading = False  # 新增上传状态变量
+    queue_status = ""  # 排队提示
 
     upload_imgs = []
     error_msg: str = ''
@@ -59,6 +64,7 @@ class GeminiImageState(rx.State):
         self.current_mode = mode
 
     @rx.event(background=True)
+    @cancellable('geminiImage', processing=False, queue_status="")
     async def get_image(self):
         """调用大模型生成图片."""
         # 根据模式获取对应的提示词
@@ -115,7 +121,7 @@ class GeminiImageState(rx.State):
                 ]
 
             param = {
-                'model': os.getenv('GEMINI_IMAGE_COVER_MODEL'),
+                'model': get_config().gemini_model,
                 'messages': [
                     {
                         "role": "user",
@@ -124,51 +130,58 @@ class GeminiImageState(rx.State):
                 ],
                 "stream": False
             }
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                        os.getenv('GEMINI_IMAGE_OPENAI_BASE_URL') + '/chat/completions',
-                        json=param,
-                        headers={
-                            'Content-Type': 'application/json',
-                            'Authorization': 'Bearer ' + os.getenv('GEMINI_IMAGE_OPENAI_API_KEY')
-                        }
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        async with self:
-                            images = []
-                            if 'images' in data['choices'][0]['message']:
-                                # 兼容第一种格式
-                                images = [data['choices'][0]['message']['images'][0]['image_url']['url']]
-                            elif isinstance(data['choices'][0]['message']['content'], list):
-                                # 兼容第二种格式
-                                for content in data['choices'][0]['message']['content']:
-                                    if content.get('type', '').startswith('image/'):
-                                        if content['image_url'].startswith('data:') or content['image_url'].startswith(
-                                                'http'):
-                                            images.append(content['image_url'])
-                                        else:
-                                            images.append(f"data:{content.get('type')};base64,{content['image_url']}")
-                            else:  # content包含markdown格式图片
-                                match = re.search(
-                                    r'!\[[^\]]*\]\(([^)]*)\)',
-                                    data['choices'][0]['message']['content']
-                                )
-                                if match:
-                                    images.append(match.group(1))
-                            # 根据模式存储到不同的变量
-                            if self.current_mode == "text2img":
-                                self.text2img_urls = images
-                            else:
-                                self.img2img_urls = images
-                    else:
-                        error_text = await response.text()
-                        yield rx.window_alert(f"图片生成失败！异常原因：{response.status}-{error_text}")
+            async with admission_ticket('gemini', self.router.session.client_token) as ticket:
+                async for status in ticket.waiting():
+                    async with self:
+                        self.queue_status = status
+                async with self:
+                    self.queue_status = ""
+                async with client_session() as session:
+                    async with session.post(
+                            get_config().gemini.base_url + '/chat/completions',
+                            json=param,
+                            headers={
+                                'Content-Type': 'application/json',
+                                'Authorization': 'Bearer ' + get_config().gemini.api_key
+                            }
+                    ) as response:
+                        if response.status == 200:
+                            data = await response.json()
+                            async with self:
+                                images = []
+                                if 'images' in data['choices'][0]['message']:
+                                    # 兼容第一种格式
+                                    images = [data['choices'][0]['message']['images'][0]['image_url']['url']]
+                                elif isinstance(data['choices'][0]['message']['content'], list):
+                                    # 兼容第二种格式
+                                    for content in data['choices'][0]['message']['content']:
+                                        if content.get('type', '').startswith('image/'):
+                                            if content['image_url'].startswith('data:') or content['image_url'].startswith(
+                                                    'http'):
+                                                images.append(content['image_url'])
+                                            else:
+                                                images.append(f"data:{content.get('type')};base64,{content['image_url']}")
+                                else:  # content包含markdown格式图片
+                                    match = re.search(
+                                        r'!\[[^\]]*\]\(([^)]*)\)',
+                                        data['choices'][0]['message']['content']
+                                    )
+                                    if match:
+                                        images.append(match.group(1))
+                                # 根据模式存储到不同的变量
+                                if self.current_mode == "text2img":
+                                    self.text2img_urls = images
+                                else:
+                                    self.img2img_urls = images
+                        else:
+                            error_text = await response.text()
+                            yield error_alert(f"图片生成失败！异常原因：{response.status}-{error_text}")
         except Exception as e:
-            yield rx.window_alert("图片生成失败！异常原因：" + str(e))
+            yield error_alert("图片生成失败！异常原因：" + str(e))
         # 延迟状态更新
         async with self:
             self.processing = False
+            self.queue_status = ""
 
     def download_image(self, index_num: int, mode: str):
         """下载指定URL的图片"""
@@ -260,7 +273,7 @@ def index():
                     # 文生图 Tab 内容
                     rx.tabs.content(
                         rx.vstack(
-                            rx.text_area(
+                            prompt_area(
                                 value=GeminiImageState.text2img_prompt,
                                 placeholder="请输入提示词描述你想生成的图片",
                                 on_change=GeminiImageState.set_text2img_prompt,
@@ -274,6 +287,10 @@ def index():
                                 width=["23em", "28.5em"],
                                 loading=GeminiImageState.processing
                             ),
+                            rx.cond(
+                                GeminiImageState.queue_status != "",
+                                rx.text(GeminiImageState.queue_status, color="gray", font_size="0.85em"),
+                            ),
                             rx.cond(
                                 GeminiImageState.text2img_urls.length() > 0,
                                 rx.flex(
@@ -367,7 +384,7 @@ def index():
                                 on_drop=GeminiImageState.handle_upload(rx.upload_files(upload_id="upload")),
                             ),
                             rx.text(GeminiImageState.error_msg, color="red"),
-                            rx.text_area(
+                            prompt_area(
                                 value=GeminiImageState.img2img_prompt,
                                 placeholder="请输入编辑提示词",
                                 on_change=GeminiImageState.set_img2img_prompt,
@@ -381,6 +398,10 @@ def index():
                                 width=["23em", "28.5em"],
                                 loading=GeminiImageState.processing
                             ),
+                            rx.cond(
+                                GeminiImageState.queue_status != "",
+                                rx.text(GeminiImageState.queue_status, color="gray", font_size="0.85em"),
+                            ),
                             rx.cond(
                                 GeminiImageState.img2img_urls.length() > 0,
                                 rx.flex(
@@ -1,9 +1,14 @@
 # 加载配置
-import os
 
-import aiohttp  # 替换 requests 为 aiohttp
 import reflex as rx
 
+from image_gen_page.tool.admission import admission_ticket
+from image_gen_page.tool.cancellation import cancellable
+from image_gen_page.tool.components import prompt_area
+from image_gen_page.tool.config import get_config
+from image_gen_page.tool.metrics import client_session
+from image_gen_page.tool.tracing import error_alert
+
 
 class Gpt4oState(rx.State):
     """The app state."""
@@ -12,6 +17,7 @@ class Gpt4oState(rx.State):
     image_urls = []
     processing = False
     complete = False
+    queue_status = ""  # 排队提示
 
     size = "1024x1024x(1:1)"  # 默认尺寸
     size_options = [
@@ -27,6 +33,7 @@ class Gpt4oState(rx.State):
         self.prompt = prompt
 
     @rx.event(background=True)
+    @cancellable('gpt4o', processing=False, complete=True, queue_status="")
     async def get_image(self):
         if self.prompt == "":
             yield rx.window_alert("提示词不能为空！")
@@ -36,37 +43,45 @@ class Gpt4oState(rx.State):
             self.complete = False
             self.image_urls = []
 
-        async with aiohttp.ClientSession() as session:
+        async with client_session() as session:
             try:
+                config = get_config()
                 size = self.size.split('x')
                 width = int(size[0])
                 height = int(size[1])
-                async with session.post(
-                        os.getenv('OPENAI_BASE_URL') + '/images/generations',
-                        json={
-                            "model": os.getenv('GPT4O_MODEL', 'gpt-4o-image'),
-                            'prompt': self.prompt,
-                            'size': f"{width}x{height}",
-                            'n': 1,
-                        },
-                        headers={
-                            'Content-Type': 'application/json',
-                            'Authorization': 'Bearer ' + os.getenv('OPENAI_API_KEY')
-                        }
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
+                async with admission_ticket('openai', self.router.session.client_token) as ticket:
+                    async for status in ticket.waiting():
                         async with self:
-                            self.image_urls = [item["url"] for item in data["data"]]
-                    else:
-                        error_text = await response.text()
-                        yield rx.window_alert(f"图片生成失败！异常原因：{response.status}-{error_text}")
+                            self.queue_status = status
+                    async with self:
+                        self.queue_status = ""
+                    async with session.post(
+                            config.openai.base_url + '/images/generations',
+                            json={
+                                "model": config.gpt4o_model,
+                                'prompt': self.prompt,
+                                'size': f"{width}x{height}",
+                                'n': 1,
+                            },
+                            headers={
+                                'Content-Type': 'application/json',
+                                'Authorization': 'Bearer ' + config.openai.api_key
+                            }
+                    ) as response:
+                        if response.status == 200:
+                            data = await response.json()
+                            async with self:
+                                self.image_urls = [item["url"] for item in data["data"]]
+                        else:
+                            error_text = await response.text()
+                            yield error_alert(f"图片生成失败！异常原因：{response.status}-{error_text}")
             except Exception as e:
-                yield rx.window_alert("图片生成失败！异常原因：" + str(e))
+                yield error_alert("图片生成失败！异常原因：" + str(e))
 
         async with self:
             self.processing = False
             self.complete = True
+            self.queue_status = ""
 
     def download_image(self, url: str):
         """下载指定URL的图片"""
@@ -132,7 +147,7 @@ def index():
                     text_align="center",
                     width="100%"
                 ),
-                rx.text_area(
+                prompt_area(
                     value=Gpt4oState.prompt,
                     placeholder="请输入提示词",
                     on_change=Gpt4oState.set_prompt,
@@ -153,6 +168,10 @@ def index():
                     width=["23em", "28.5em"],
                     loading=Gpt4oState.processing
                 ),
+                rx.cond(
+                    Gpt4oState.queue_status != "",
+                    rx.text(Gpt4oState.queue_status, color="gray", font_size="0.85em"),
+                ),
                 rx.cond(
                     Gpt4oState.complete,
                     rx.flex(
@@ -1,11 +1,17 @@
 # 加载配置
 import base64
 import hashlib
-import os
 
 import aiohttp
 import reflex as rx
 
+from image_gen_page.tool.admission import admission_ticket
+from image_gen_page.tool.cancellation import cancellable
+from image_gen_page.tool.components import prompt_area
+from image_gen_page.tool.config import get_config
+from image_gen_page.tool.metrics import client_session
+from image_gen_page.tool.tracing import error_alert
+
 
 class GrokImageState(rx.State):
     """The app state."""
@@ -16,6 +22,7 @@ class GrokImageState(rx.State):
     img2img_urls = []  # 图片编辑生成的图片
     processing = False
     uploading = False  # 新增上传状态变量
+    queue_status = ""  # 排队提示
 
     upload_imgs = []
     error_msg: str = ''
@@ -70,6 +77,7 @@ class GrokImageState(rx.State):
         self.current_mode = mode
 
     @rx.event(background=True)
+    @cancellable('grokImage', processing=False, queue_status="")
     async def get_image(self):
         """调用大模型生成图片."""
         # 根据模式获取对应的提示词
@@ -90,9 +98,10 @@ class GrokImageState(rx.State):
             else:
                 self.img2img_urls = []
         try:
+            config = get_config()
             # 根据模式构建不同的 content
             if self.current_mode == "text2img":
-                image_model = os.getenv('GROK_IMAGE_IMAGE_MODEL')
+                image_model = config.grok_image_model
                 image_url = '/images/generations'
                 # 文生图模式：只传提示词，不传图片
                 param = {
@@ -107,7 +116,7 @@ class GrokImageState(rx.State):
                 size_parts = self.text2img_size.split('x')
                 param['size'] = f"{size_parts[0]}x{size_parts[1]}"
             else:
-                image_model = os.getenv('GROK_IMAGE_IMAGE_EDIT_MODEL')
+                image_model = config.grok_image_edit_model
                 image_url = '/images/edits'
                 # 图片编辑模式：使用 multipart/form-data 格式
                 # 只支持单张图片，取第一张
@@ -118,58 +127,65 @@ class GrokImageState(rx.State):
                     'n': 1,
                 }
 
-            async with aiohttp.ClientSession() as session:
-                if self.current_mode == "text2img":
-                    # 文生图：JSON 格式
-                    async with session.post(
-                            os.getenv('GROK_IMAGE_OPENAI_BASE_URL') + image_url,
-                            json=param,
-                            headers={
-                                'Content-Type': 'application/json',
-                                'Authorization': 'Bearer ' + os.getenv('GROK_IMAGE_OPENAI_API_KEY')
-                            }
-                    ) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            async with self:
-                                images = [data['data'][0]['url']]
-                                self.text2img_urls = images
-                        else:
-                            error_text = await response.text()
-                            yield rx.window_alert(f"图片生成失败！异常原因：{response.status}-{error_text}")
-                else:
-                    # 图片编辑：multipart/form-data 格式
-                    with open(image_path, 'rb') as f:
-                        image_data = f.read()
-
-                    # 构建 multipart/form-data
-                    form = aiohttp.FormData()
-                    form.add_field('model', param['model'])
-                    form.add_field('prompt', param['prompt'])
-                    form.add_field('n', str(param['n']))
-                    # form.add_field('size', param['size'])
-                    form.add_field('image', image_data, filename=self.upload_imgs[0], content_type='image/png')
-
-                    async with session.post(
-                            os.getenv('GROK_IMAGE_OPENAI_BASE_URL') + image_url,
-                            data=form,
-                            headers={
-                                'Authorization': 'Bearer ' + os.getenv('GROK_IMAGE_OPENAI_API_KEY')
-                            }
-                    ) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            async with self:
-                                images = [data['data'][0]['url']]
-                                self.img2img_urls = images
-                        else:
-                            error_text = await response.text()
-                            yield rx.window_alert(f"图片编辑失败！异常原因：{response.status}-{error_text}")
+            async with admission_ticket('grok', self.router.session.client_token) as ticket:
+                async for status in ticket.waiting():
+                    async with self:
+                        self.queue_status = status
+                async with self:
+                    self.queue_status = ""
+                async with client_session() as session:
+                    if self.current_mode == "text2img":
+                        # 文生图：JSON 格式
+                        async with session.post(
+                                config.grok_image.base_url + image_url,
+                                json=param,
+                                headers={
+                                    'Content-Type': 'application/json',
+                                    'Authorization': 'Bearer ' + config.grok_image.api_key
+                                }
+                        ) as response:
+                            if response.status == 200:
+                                data = await response.json()
+                                async with self:
+                                    images = [data['data'][0]['url']]
+                                    self.text2img_urls = images
+                            else:
+                                error_text = await response.text()
+                                yield error_alert(f"图片生成失败！异常原因：{response.status}-{error_text}")
+                    else:
+                        # 图片编辑：multipart/form-data 格式
+                        with open(image_path, 'rb') as f:
+                            image_data = f.read()
+
+                        # 构建 multipart/form-data
+                        form = aiohttp.FormData()
+                        form.add_field('model', param['model'])
+                        form.add_field('prompt', param['prompt'])
+                        form.add_field('n', str(param['n']))
+                        # form.add_field('size', param['size'])
+                        form.add_field('image', image_data, filename=self.upload_imgs[0], content_type='image/png')
+
+                        async with session.post(
+                                config.grok_image.base_url + image_url,
+                                data=form,
+                                headers={
+                                    'Authorization': 'Bearer ' + config.grok_image.api_key
+                                }
+                        ) as response:
+                            if response.status == 200:
+                                data = await response.json()
+                                async with self:
+                                    images = [data['data'][0]['url']]
+                                    self.img2img_urls = images
+                            else:
+                                error_text = await response.text()
+                                yield error_alert(f"图片编辑失败！异常原因：{response.status}-{error_text}")
         except Exception as e:
-            yield rx.window_alert("图片生成失败！异常原因：" + str(e))
+            yield error_alert("图片生成失败！异常原因：" + str(e))
         # 延迟状态更新
         async with self:
             self.processing = False
+            self.queue_status = ""
 
     @rx.event
     async def download_image(self, index_num: int, mode: str):
@@ -178,7 +194,7 @@ class GrokImageState(rx.State):
 
         try:
             # 通过后端获取图片，绕过 CORS 限制
-            async with aiohttp.ClientSession() as session:
+            async with client_session() as session:
                 async with session.get(image_url) as response:
                     if response.status == 200:
                         image_data = await response.read()
@@ -196,9 +212,9 @@ class GrokImageState(rx.State):
                             }})();
                         """)
                     else:
-                        return rx.window_alert(f"下载失败：HTTP {response.status}")
+                        return error_alert(f"下载失败：HTTP {response.status}")
         except Exception as e:
-            return rx.window_alert(f"下载失败：{str(e)}")
+            return error_alert(f"下载失败：{str(e)}")
 
 
 def image_modal(image_url):
@@ -271,7 +287,7 @@ def index():
                     # 文生图 Tab 内容
                     rx.tabs.content(
                         rx.vstack(
-                            rx.text_area(
+                            prompt_area(
                                 value=GrokImageState.text2img_prompt,
                                 placeholder="请输入提示词描述你想生成的图片",
                                 on_change=GrokImageState.set_text2img_prompt,
@@ -292,6 +308,10 @@ def index():
                                 width=["23em", "28.5em"],
                                 loading=GrokImageState.processing
                             ),
+                            rx.cond(
+                                GrokImageState.queue_status != "",
+                                rx.text(GrokImageState.queue_status, color="gray", font_size="0.85em"),
+                            ),
                             rx.cond(
                                 GrokImageState.text2img_urls.length() > 0,
                                 rx.flex(
@@ -385,7 +405,7 @@ def index():
                                 on_drop=GrokImageState.handle_upload(rx.upload_files(upload_id="upload")),
                             ),
                             rx.text(GrokImageState.error_msg, color="red"),
-                            rx.text_area(
+                            prompt_area(
                                 value=GrokImageState.img2img_prompt,
                                 placeholder="请输入编辑提示词",
                                 on_change=GrokImageState.set_img2img_prompt,
@@ -399,6 +419,10 @@ def index():
                                 width=["23em", "28.5em"],
                                 loading=GrokImageState.processing
                             ),
+                            rx.cond(
+                                GrokImageState.queue_status != "",
+                                rx.text(GrokImageState.queue_status, color="gray", font_size="0.85em"),
+                            ),
                             rx.cond(
                                 GrokImageState.img2img_urls.length() > 0,
                                 rx.flex(
@@ -1,11 +1,21 @@
 # 加载配置
+import asyncio
 import base64
 import hashlib
-import os
 
 import aiohttp
 import reflex as rx
 
+from image_gen_page.tool import webhook
+from image_gen_page.tool.admission import admission_ticket
+from image_gen_page.tool.cancellation import cancellable
+from image_gen_page.tool.components import prompt_area
+from image_gen_page.tool.config import get_config
+from image_gen_page.tool.job_queue import Job, get_job_queue, register_job_handler
+from image_gen_page.tool.metrics import client_session
+from image_gen_page.tool.tracing import error_alert
+from image_gen_page.tool.video_tracker import delete_video_task, track_video_task
+
 # 尺寸选项列表（常量）
 SIZE_OPTIONS = [
     "1280x720",
@@ -37,6 +47,11 @@ class GrokVideoState(rx.State):
     video_seconds: str = "10"  # 视频时长（秒）
     video_quality: str = "standard"  # 视频质量
 
+    # 当前生成任务ID，保存在浏览器本地，刷新页面后可重新订阅
+    job_id: str = rx.LocalStorage(name="grok_video_job_id")
+    job_message: str = ''
+    job_progress: int = 0
+
     @rx.event
     async def handle_upload(self, files: list[rx.UploadFile]):
         """处理参考图上传."""
@@ -81,35 +96,8 @@ class GrokVideoState(rx.State):
         """清除参考图."""
         self.upload_imgs = []
 
-    async def _fetch_video_result(self, session, base_url: str, video_url: str, headers: dict, task_id: str):
-        """获取视频生成结果."""
-        async with session.get(
-                base_url + video_url + '/' + task_id,
-                headers=headers
-        ) as get_response:
-            if get_response.status == 200:
-                result = await get_response.json()
-                # 尝试从不同字段获取视频URL
-                video_url_found = None
-                if 'url' in result:
-                    video_url_found = result['url']
-                elif 'video_url' in result:
-                    video_url_found = result['video_url']
-                elif 'data' in result:
-                    data = result.get('data', [])
-                    if data and 'url' in data[0]:
-                        video_url_found = data[0]['url']
-
-                if video_url_found:
-                    async with self:
-                        self.video_urls = [video_url_found]
-                else:
-                    yield rx.window_alert(f"视频生成完成，但未找到视频URL：{result}")
-            else:
-                error_text = await get_response.text()
-                yield rx.window_alert(f"获取视频失败！异常原因：{get_response.status}-{error_text}")
-
     @rx.event(background=True)
+    @cancellable('grok_video', durable=True, processing=False, job_message="", job_progress=0)
     async def generate_video(self):
         """调用Grok视频生成API."""
         if self.prompt == "":
@@ -121,101 +109,82 @@ class GrokVideoState(rx.State):
             self.video_urls = []
 
         try:
-            video_model = os.getenv('GROK_VIDEO_MODEL', 'grok-imagine-1.0-video')
-            video_url = '/videos'
-
-            param = {
-                'model': video_model,
-                'prompt': self.prompt,
-                'size': self.video_size,
-                'seconds': str(self.video_seconds),  # API需要字符串类型
-                'quality': self.video_quality,
-            }
-
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': 'Bearer ' + os.getenv('GROK_VIDEO_API_KEY', os.getenv('GROK_IMAGE_OPENAI_API_KEY', ''))
-            }
-
-            base_url = os.getenv('GROK_VIDEO_BASE_URL', os.getenv('GROK_IMAGE_OPENAI_BASE_URL', ''))
-
-            async with aiohttp.ClientSession() as session:
-                # 如果有参考图，使用multipart/form-data
-                if len(self.upload_imgs) > 0:
-                    image_path = rx.get_upload_dir() / self.upload_imgs[0]
-                    with open(image_path, 'rb') as f:
-                        image_data = f.read()
-
-                    # 根据文件扩展名确定content_type
-                    ext = self.upload_imgs[0].split('.')[-1].lower()
-                    content_type_map = {
-                        'png': 'image/png',
-                        'jpg': 'image/jpeg',
-                        'jpeg': 'image/jpeg',
-                        'webp': 'image/webp',
-                    }
-                    content_type = content_type_map.get(ext, 'image/png')
-
-                    form = aiohttp.FormData()
-                    form.add_field('model', param['model'])
-                    form.add_field('prompt', param['prompt'])
-                    form.add_field('size', param['size'])
-                    form.add_field('seconds', param['seconds'])  # 已经是字符串
-                    form.add_field('quality', param['quality'])
-                    form.add_field('input_reference', image_data, filename=self.upload_imgs[0],
-                                   content_type=content_type)
-
-                    post_headers = {k: v for k, v in headers.items() if k != 'Content-Type'}
-
-                    async with session.post(
-                            base_url + video_url,
-                            data=form,
-                            headers=post_headers
-                    ) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            task_id = data.get('task_id') or data.get('id')
-                            if task_id:
-                                async for result in self._fetch_video_result(session, base_url, video_url, headers,
-                                                                             task_id):
-                                    yield result
-                            else:
-                                yield rx.window_alert(f"视频创建失败：未返回task_id")
-                        else:
-                            error_text = await response.text()
-                            yield rx.window_alert(f"视频生成失败！异常原因：{response.status}-{error_text}")
-                else:
-                    # 无参考图，使用JSON格式
-                    async with session.post(
-                            base_url + video_url,
-                            json=param,
-                            headers=headers
-                    ) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            task_id = data.get('task_id') or data.get('id')
-                            if task_id:
-                                async for result in self._fetch_video_result(session, base_url, video_url, headers,
-                                                                             task_id):
-                                    yield result
-                            else:
-                                yield rx.window_alert(f"视频创建失败：未返回task_id")
-                        else:
-                            error_text = await response.text()
-                            yield rx.window_alert(f"视频生成失败！异常原因：{response.status}-{error_text}")
+            # 视频生成耗时较长，交给持久化队列执行，页面断线刷新后可重新订阅
+            # 重新提交时取消上一次仍在执行的任务（含远端任务）
+            if self.job_id:
+                await get_job_queue().cancel(self.job_id, owner=self.router.session.client_token)
+            job_id = await get_job_queue().submit(
+                'grok_video',
+                {
+                    'prompt': self.prompt,
+                    'size': self.video_size,
+                    'seconds': str(self.video_seconds),  # API需要字符串类型
+                    'quality': self.video_quality,
+                    'upload_img': self.upload_imgs[0] if len(self.upload_imgs) > 0 else '',
+                },
+                owner=self.router.session.client_token,
+            )
+            async with self:
+                self.job_id = job_id
+            async for event in self._follow_job(job_id):
+                yield event
         except Exception as e:
-            yield rx.window_alert("视频生成失败！异常原因：" + str(e))
+            yield error_alert("视频生成失败！异常原因：" + str(e))
 
         async with self:
             self.processing = False
 
+    @rx.event(background=True)
+    @cancellable('grok_video', durable=True, processing=False, job_message="", job_progress=0)
+    async def reattach_job(self):
+        """页面加载时重新订阅上次提交的任务."""
+        if not self.job_id or self.video_urls:
+            return
+        async with self:
+            self.processing = True
+        try:
+            async for event in self._follow_job(self.job_id):
+                yield event
+        finally:
+            async with self:
+                self.processing = False
+
+    async def _on_abandon(self):
+        """会话断开过久，取消仍在执行的任务"""
+        if self.job_id:
+            await get_job_queue().cancel(self.job_id, owner=self.router.session.client_token)
+
+    async def _follow_job(self, job_id: str):
+        """订阅任务进度，任务结束后写入结果."""
+        job = None
+        async for job in get_job_queue().watch(job_id, owner=self.router.session.client_token):
+            async with self:
+                self.job_message = job['message']
+                self.job_progress = int(job['progress'])
+        async with self:
+            self.job_message = ''
+            self.job_progress = 0
+        if job is None:
+            return
+        if job['status'] == 'done':
+            async with self:
+                self.video_urls = [job['result']['url']]
+        elif job['status'] == 'failed':
+            yield error_alert("视频生成失败！异常原因：" + job['error'])
+
+    @rx.event
+    async def cancel_job(self):
+        """取消正在生成的视频任务."""
+        if self.job_id:
+            await get_job_queue().cancel(self.job_id, owner=self.router.session.client_token)
+
     @rx.event
     async def download_video(self, index_num: int):
         """下载指定URL的视频."""
         video_url = self.video_urls[index_num]
 
         try:
-            async with aiohttp.ClientSession() as session:
+            async with client_session() as session:
                 async with session.get(video_url) as response:
                     if response.status == 200:
                         video_data = await response.read()
@@ -231,9 +200,106 @@ class GrokVideoState(rx.State):
                             }})();
                         """)
                     else:
-                        return rx.window_alert(f"下载失败：HTTP {response.status}")
+                        return error_alert(f"下载失败：HTTP {response.status}")
         except Exception as e:
-            return rx.window_alert(f"下载失败：{str(e)}")
+            return error_alert(f"下载失败：{str(e)}")
+
+
+@register_job_handler('grok_video')
+async def run_grok_video_job(job: Job) -> dict:
+    """后台任务：创建视频任务并获取结果."""
+    payload = job.payload
+    config = get_config()
+    video_model = config.grok_video_model
+    video_url = '/videos'
+
+    param = {
+        'model': video_model,
+        'prompt': payload['prompt'],
+        'size': payload['size'],
+        'seconds': payload['seconds'],
+        'quality': payload['quality'],
+    }
+
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': 'Bearer ' + config.grok_video.api_key
+    }
+
+    base_url = config.grok_video.base_url
+
+    # 视频服务支持完成回调时（GROK_VIDEO_CALLBACK_FIELD 指定回调地址的参数名），由服务端推送结果
+    callback_url = webhook.webhook_url('grok_video', job.id) if config.grok_video_callback_field else ''
+    if callback_url:
+        param[config.grok_video_callback_field] = callback_url
+
+    # 视频服务的并发名额在整个生成过程中占用（创建 + 获取结果）
+    async with admission_ticket('grok_video', job.owner) as ticket:
+        async for status in ticket.waiting():
+            await job.progress(message=status)
+        # 创建任务前就开始等待完成回调，避免回调先于创建返回到达
+        with webhook.expect('grok_video', job.id, enabled=bool(callback_url)) as push:
+            async with client_session() as session:
+                # 已创建过的远端任务（worker 重启后重新执行）直接获取结果，避免重复付费
+                task_id = job.checkpoint.get('task_id')
+                if not task_id:
+                    # 如果有参考图，使用multipart/form-data
+                    if payload['upload_img']:
+                        image_path = rx.get_upload_dir() / payload['upload_img']
+                        with open(image_path, 'rb') as f:
+                            image_data = f.read()
+
+                        # 根据文件扩展名确定content_type
+                        ext = payload['upload_img'].split('.')[-1].lower()
+                        content_type_map = {
+                            'png': 'image/png',
+                            'jpg': 'image/jpeg',
+                            'jpeg': 'image/jpeg',
+                            'webp': 'image/webp',
+                        }
+                        content_type = content_type_map.get(ext, 'image/png')
+
+                        form = aiohttp.FormData()
+                        form.add_field('model', param['model'])
+                        form.add_field('prompt', param['prompt'])
+                        form.add_field('size', param['size'])
+                        form.add_field('seconds', param['seconds'])  # 已经是字符串
+                        form.add_field('quality', param['quality'])
+                        if config.grok_video_callback_field in param:
+                            form.add_field(config.grok_video_callback_field, param[config.grok_video_callback_field])
+                        form.add_field('input_reference', image_data, filename=payload['upload_img'],
+                                       content_type=content_type)
+
+                        post_headers = {k: v for k, v in headers.items() if k != 'Content-Type'}
+                        request_kwargs = {'data': form, 'headers': post_headers}
+                    else:
+                        # 无参考图，使用JSON格式
+                        request_kwargs = {'json': param, 'headers': headers}
+
+                    async with session.post(base_url + video_url, **request_kwargs) as response:
+                        if response.status != 200:
+                            error_text = await response.text()
+                            raise Exception(f"{response.status}-{error_text}")
+                        data = await response.json()
+                        task_id = data.get('task_id') or data.get('id')
+                        if not task_id:
+                            raise Exception("视频创建失败：未返回task_id")
+                    await job.progress(5, '视频生成中', task_id=task_id)
+
+                # 按退避间隔跟踪任务进度，直到视频生成完成
+                task_url = base_url + video_url + '/' + task_id
+                try:
+                    async for status in track_video_task(session, task_url, headers, push=push):
+                        if status.url:
+                            return {'url': status.url}
+                        # 进度 0-100 映射到任务进度 5-99
+                        await job.progress(5 + status.progress * 0.94, status.message())
+                except asyncio.CancelledError:
+                    # 用户取消时一并删除远端任务释放生成资源；进程退出导致的中断保留远端任务，由新的 worker 继续跟踪
+                    if await job.is_cancelled():
+                        await delete_video_task(session, task_url, headers)
+                    raise
+                raise Exception("视频生成失败：任务状态跟踪意外结束")
 
 
 def video_modal(video_url):
@@ -286,7 +352,7 @@ def index():
                 ),
 
                 # 提示词输入
-                rx.text_area(
+                prompt_area(
                     value=GrokVideoState.prompt,
                     placeholder="请输入提示词描述你想生成的视频，例如：霓虹雨夜街头，慢镜头追拍",
                     on_change=GrokVideoState.set_prompt,
@@ -422,6 +488,25 @@ def index():
                     width=["23em", "28.5em"],
                     loading=GrokVideoState.processing
                 ),
+                rx.cond(
+                    GrokVideoState.job_message != "",
+                    rx.vstack(
+                        rx.cond(
+                            GrokVideoState.job_progress > 0,
+                            rx.progress(value=GrokVideoState.job_progress, width="100%"),
+                        ),
+                        rx.text(GrokVideoState.job_message, color="gray", font_size="0.85em"),
+                        rx.button(
+                            "取消生成",
+                            on_click=GrokVideoState.cancel_job,
+                            size="1",
+                            variant="soft",
+                            color_scheme="gray",
+                        ),
+                        align="center",
+                        width=["20em", "25em"],
+                    ),
+                ),
 
                 # 视频结果展示
                 rx.cond(
@@ -1,9 +1,14 @@
 # 加载配置
-import os
 
-import aiohttp
 import reflex as rx
 
+from image_gen_page.tool.admission import admission_ticket
+from image_gen_page.tool.cancellation import cancellable
+from image_gen_page.tool.components import prompt_area
+from image_gen_page.tool.config import get_config
+from image_gen_page.tool.metrics import client_session
+from image_gen_page.tool.tracing import error_alert
+
 
 class JimengState(rx.State):
     """The app state."""
@@ -12,6 +17,7 @@ class JimengState(rx.State):
     image_urls = []
     processing = False
     complete = False
+    queue_status = ""  # 排队提示
 
     size = "2048x2048x(1:1)"  # 默认尺寸
     size_options = [
@@ -32,6 +38,7 @@ class JimengState(rx.State):
         self.prompt = prompt
 
     @rx.event(background=True)
+    @cancellable('jimeng', processing=False, complete=True, queue_status="")
     async def get_image(self):
         """调用大模型生成图片."""
         if self.prompt == "":
@@ -44,33 +51,41 @@ class JimengState(rx.State):
         try:
             size = self.size.split('x')
             ratio = size[2][1:-1]  # 移除两边的括号
-            url = os.getenv('OPENAI_BASE_URL') + '/images/generations'
+            config = get_config()
+            url = config.openai.base_url + '/images/generations'
             payload = {
-                "model": os.getenv('JIMENG_MODEL', 'jimeng'),
+                "model": config.jimeng_model,
                 "prompt": self.prompt,
                 "ratio": ratio,
                 "resolution": "2k",
             }
             headers = {
                 'Content-Type': 'application/json',
-                'Authorization': 'Bearer ' + os.getenv('OPENAI_API_KEY')
+                'Authorization': 'Bearer ' + config.openai.api_key
             }
-            async with aiohttp.ClientSession() as session:
-                # 发起 POST 请求
-                async with session.post(url, json=payload, headers=headers) as response:
-                    # 检查 HTTP 错误状态码 (例如 4xx 或 5xx)
-                    response.raise_for_status()
-                    # 获取 JSON 响应体
-                    data = await response.json()
+            async with client_session() as session:
+                async with admission_ticket('openai', self.router.session.client_token) as ticket:
+                    async for status in ticket.waiting():
+                        async with self:
+                            self.queue_status = status
+                    async with self:
+                        self.queue_status = ""
+                    # 发起 POST 请求
+                    async with session.post(url, json=payload, headers=headers) as response:
+                        # 检查 HTTP 错误状态码 (例如 4xx 或 5xx)
+                        response.raise_for_status()
+                        # 获取 JSON 响应体
+                        data = await response.json()
 
             async with self:
                 self.image_urls = [item["url"] for item in data["data"]]
         except Exception as e:
-            yield rx.window_alert("图片生成失败！异常原因：" + str(e))
+            yield error_alert("图片生成失败！异常原因：" + str(e))
         # 延迟状态更新
         async with self:
             self.processing = False
             self.complete = True
+            self.queue_status = ""
 
     def download_image(self, url: str):
         """下载指定URL的图片"""
@@ -135,7 +150,7 @@ def index():
                 text_align="center",
                 width="100%"
             ),
-            rx.text_area(
+            prompt_area(
                 value=JimengState.prompt,
                 placeholder="请输入提示词",
                 on_change=JimengState.set_prompt,
@@ -156,6 +171,10 @@ def index():
                 width=["23em", "28.5em"],
                 loading=JimengState.processing
             ),
+            rx.cond(
+                JimengState.queue_status != "",
+                rx.text(JimengState.queue_status, color="gray", font_size="0.85em"),
+            ),
             rx.cond(
                 JimengState.complete,
                 rx.flex(
@@ -1,12 +1,21 @@
 # 加载配置
 import asyncio
 import hashlib
-import os
 
 import aiohttp
 import reflex as rx
 
-from image_gen_page.tool.common_tool import translate, image_to_base64
+from image_gen_page.tool import webhook
+from image_gen_page.tool.admission import admission_ticket
+from image_gen_page.tool.cancellation import cancellable
+from image_gen_page.tool.common_tool import image_to_base64
+from image_gen_page.tool.components import prompt_area
+from image_gen_page.tool.config import get_config
+from image_gen_page.tool.fal_poller import get_fal_poller
+from image_gen_page.tool.job_queue import Job, get_job_queue, register_job_handler
+from image_gen_page.tool.metrics import client_session
+from image_gen_page.tool.tracing import error_alert
+from image_gen_page.tool.translation import translate
 
 
 class KontextState(rx.State):
@@ -21,6 +30,10 @@ class KontextState(rx.State):
     upload_img: str = ''
     error_msg: str = ''
 
+    # 当前生成任务ID，保存在浏览器本地，刷新页面后可重新订阅
+    job_id: str = rx.LocalStorage(name="kontext_job_id")
+    job_message: str = ''
+
     @rx.event
     async def handle_upload(self, files: list[rx.UploadFile]):
         self.uploading = True  # 开始上传时设置状态
@@ -45,6 +58,7 @@ class KontextState(rx.State):
         self.prompt = prompt
 
     @rx.event(background=True)
+    @cancellable('kontext', durable=True, processing=False, job_message="")
     async def get_image(self):
         """调用大模型生成图片."""
         if self.prompt == "":
@@ -58,66 +72,63 @@ class KontextState(rx.State):
             self.complete = False
             self.image_urls = []
         try:
-            prompt = translate(self.prompt)
-            print(self.prompt + ' => ' + prompt)
-            param = {
-                'prompt': prompt,
-                'image_url': image_to_base64(rx.get_upload_dir(), self.upload_img),
-            }
-            async with aiohttp.ClientSession() as session:
-                # 发起初始请求
-                async with session.post(
-                        'https://queue.fal.run/fal-ai/flux-pro/kontext/max',
-                        json=param,
-                        headers={
-                            'Content-Type': 'application/json',
-                            'Authorization': 'Key ' + os.getenv('FAL_KEY')
-                        }
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        response_url = data['response_url']
-
-                        # 轮询获取结果
-                        url = await self._poll_for_result(session, response_url)
-
-                        async with self:
-                            self.image_urls = [url]
-                    else:
-                        error_text = await response.text()
-                        yield rx.window_alert(f"图片生成失败！异常原因：{response.status}-{error_text}")
-
+            # 生成任务交给持久化队列执行，页面只负责订阅进度，断线刷新后可重新订阅
+            # 重新提交时取消上一次仍在执行的任务（含远端任务）
+            if self.job_id:
+                await get_job_queue().cancel(self.job_id, owner=self.router.session.client_token)
+            job_id = await get_job_queue().submit(
+                'kontext',
+                {'prompt': self.prompt, 'upload_img': self.upload_img},
+                owner=self.router.session.client_token,
+            )
+            async with self:
+                self.job_id = job_id
+            async for event in self._follow_job(job_id):
+                yield event
         except Exception as e:
-            yield rx.window_alert("图片生成失败！异常原因：" + str(e))
+            yield error_alert("图片生成失败！异常原因：" + str(e))
         # 延迟状态更新
         async with self:
             self.processing = False
             self.complete = True
 
-    async def _poll_for_result(self, session: aiohttp.ClientSession, response_url: str) -> str:
-        """轮询获取生成结果"""
-        max_wait_time = 60  # 最大等待时间（60秒）
-        retry_interval = 2  # 每次请求间隔2秒
-        start_time = asyncio.get_event_loop().time()
+    @rx.event(background=True)
+    @cancellable('kontext', durable=True, processing=False, job_message="")
+    async def reattach_job(self):
+        """页面加载时重新订阅上次提交的任务"""
+        if not self.job_id or self.image_urls:
+            return
+        async with self:
+            self.processing = True
+            self.complete = False
+        try:
+            async for event in self._follow_job(self.job_id):
+                yield event
+        finally:
+            async with self:
+                self.processing = False
+                self.complete = len(self.image_urls) > 0
 
-        while True:
-            # 检查是否超时
-            if asyncio.get_event_loop().time() - start_time > max_wait_time:
-                raise Exception("等待超时，未能获取到图像数据")
+    async def _on_abandon(self):
+        """会话断开过久，取消仍在执行的任务"""
+        if self.job_id:
+            await get_job_queue().cancel(self.job_id, owner=self.router.session.client_token)
 
-            async with session.get(
-                    response_url,
-                    headers={
-                        'Content-Type': 'application/json',
-                        'Authorization': 'Key ' + os.getenv('FAL_KEY')
-                    }
-            ) as response:
-                data = await response.json()
-                if 'images' in data and data['images']:
-                    return data['images'][0]['url']
-
-            # 等待一段时间后重试
-            await asyncio.sleep(retry_interval)
+    async def _follow_job(self, job_id: str):
+        """订阅任务进度，任务结束后写入结果"""
+        job = None
+        async for job in get_job_queue().watch(job_id, owner=self.router.session.client_token):
+            async with self:
+                self.job_message = job['message']
+        async with self:
+            self.job_message = ''
+        if job is None:
+            return
+        if job['status'] == 'done':
+            async with self:
+                self.image_urls = [job['result']['url']]
+        elif job['status'] == 'failed':
+            yield error_alert("图片生成失败！异常原因：" + job['error'])
 
     def download_image(self, url: str):
         """下载指定URL的图片"""
@@ -138,6 +149,81 @@ class KontextState(rx.State):
           """)
 
 
+@register_job_handler('kontext')
+async def run_kontext_job(job: Job) -> dict:
+    """后台任务：翻译提示词后提交 fal 队列并等待结果"""
+    # fal 的并发名额在整个生成过程中占用（提交 + 等待结果）
+    async with admission_ticket('fal', job.owner) as ticket:
+        async for status in ticket.waiting():
+            await job.progress(message=status)
+        # 提交前就开始等待回调，避免回调先于提交返回到达
+        with webhook.expect('fal', job.id) as push:
+            # 已提交过的远端任务（worker 重启后重新执行）直接继续等待结果，避免重复付费
+            response_url = job.checkpoint.get('response_url')
+            if not response_url:
+                await job.progress(5, '翻译提示词')
+                prompt = await translate(job.payload['prompt'])
+                print(job.payload['prompt'] + ' => ' + prompt)
+                param = {
+                    'prompt': prompt,
+                    'image_url': image_to_base64(rx.get_upload_dir(), job.payload['upload_img']),
+                }
+                # 配置了回调地址时，fal 在任务完成后主动推送结果
+                callback_url = webhook.webhook_url('fal', job.id)
+                async with client_session() as session:
+                    async with session.post(
+                            get_config().fal_queue_url + '/fal-ai/flux-pro/kontext/max',
+                            params={'fal_webhook': callback_url} if callback_url else None,
+                            json=param,
+                            headers={
+                                'Content-Type': 'application/json',
+                                'Authorization': 'Key ' + get_config().fal_key
+                            }
+                    ) as response:
+                        if response.status != 200:
+                            error_text = await response.text()
+                            raise Exception(f"{response.status}-{error_text}")
+                        data = await response.json()
+                        response_url = data['response_url']
+                        status_url = data.get('status_url', '')
+                        cancel_url = data.get('cancel_url', '')
+                await job.progress(20, '图片生成中', response_url=response_url, status_url=status_url,
+                                   cancel_url=cancel_url)
+
+            # 回调与共享轮询服务同时等待结果，回调先到时立即完成，轮询作为兜底
+            poll = asyncio.ensure_future(
+                get_fal_poller().wait(response_url, job.checkpoint.get('status_url', ''), fallback=push is not None))
+            try:
+                data = await webhook.first_result(push, poll)
+            except asyncio.CancelledError:
+                # 用户取消时一并取消 fal 队列中的任务；进程退出导致的中断保留远端任务，由新的 worker 继续等待
+                if await job.is_cancelled():
+                    await cancel_fal_request(response_url, job.checkpoint.get('cancel_url', ''))
+                raise
+
+    if 'payload' in data and 'request_id' in data:
+        # 回调数据：结果在 payload 中
+        if data.get('status') == 'ERROR':
+            raise Exception(f"图片生成失败：{data.get('error') or data.get('payload')}")
+        data = data.get('payload') or {}
+    if not data.get('images'):
+        raise Exception("未能获取到图像数据")
+    return {'url': data['images'][0]['url']}
+
+
+async def cancel_fal_request(response_url: str, cancel_url: str = ''):
+    """尽力取消 fal 队列中的任务，已开始生成的任务可能无法取消"""
+    try:
+        async with client_session() as session:
+            async with session.put(
+                    cancel_url or response_url.rstrip('/') + '/cancel',
+                    headers={'Authorization': 'Key ' + get_config().fal_key}
+            ) as response:
+                return response.status < 400
+    except aiohttp.ClientError:
+        return False
+
+
 def image_modal(image_url):
     return rx.dialog.root(
         rx.dialog.trigger(
@@ -238,7 +324,7 @@ def index():
                 on_drop=KontextState.handle_upload(rx.upload_files(upload_id="upload")),
             ),
             rx.text(KontextState.error_msg, color="red"),
-            rx.text_area(
+            prompt_area(
                 value=KontextState.prompt,
                 placeholder="请输入提示词",
                 on_change=KontextState.set_prompt,
@@ -252,6 +338,10 @@ def index():
                 width=["23em", "28.5em"],
                 loading=KontextState.processing
             ),
+            rx.cond(
+                KontextState.job_message != "",
+                rx.text(KontextState.job_message, color="gray", font_size="0.85em"),
+            ),
 
             rx.cond(
                 KontextState.complete,
@@ -1,10 +1,19 @@
 # Mondo风格海报生成器 - 增强版
+import asyncio
 import base64
-import os
+import traceback
+from collections import OrderedDict
 
-import aiohttp
 import reflex as rx
 
+from image_gen_page.tool.admission import admission_ticket
+from image_gen_page.tool.cancellation import cancel, cancellable, running
+from image_gen_page.tool.chat_stream import Throttle, stream_chat
+from image_gen_page.tool.components import prompt_area, prompt_input
+from image_gen_page.tool.config import get_config
+from image_gen_page.tool.metrics import cache_result, client_session
+from image_gen_page.tool.tracing import error_alert
+
 # 30+设计风格（英文描述，用于提示词生成）
 ARTIST_STYLES = {
     "auto": "let AI choose best style",
@@ -116,6 +125,23 @@ ASPECT_RATIOS = {
 }
 
 
+# 自动预生成提示词：输入停止变化多少秒后开始
+SPECULATIVE_DEBOUNCE_SECONDS = 1.5
+# 点击生成时等待进行中的提示词增强完成的最长时间（秒），超时后取消增强并使用模板提示词
+ENHANCE_WAIT_SECONDS = 60
+
+# 增强提示词缓存：(主题, 设计类型, 风格, 宽高比, 颜色) -> 增强后的提示词
+ENHANCE_CACHE_SIZE = 256
+_enhance_cache: OrderedDict[tuple, str] = OrderedDict()
+
+
+def _cache_enhanced(key: tuple, enhanced: str):
+    _enhance_cache[key] = enhanced
+    _enhance_cache.move_to_end(key)
+    while len(_enhance_cache) > ENHANCE_CACHE_SIZE:
+        _enhance_cache.popitem(last=False)
+
+
 class MondoState(rx.State):
     """Mondo海报生成器状态"""
 
@@ -128,6 +154,9 @@ class MondoState(rx.State):
     # 状态
     processing = False
 
+    # 排队提示
+    queue_status: str = ""
+
     # 设计类型
     design_type: str = "movie"
 
@@ -146,6 +175,12 @@ class MondoState(rx.State):
     # 提示词生成中
     enhancing: bool = False
 
+    # 推理模型生成提示词时的思考过程（仅生成期间展示）
+    enhance_reasoning: str = ""
+
+    # 输入停顿后自动在后台生成提示词预览
+    auto_enhance: bool = False
+
     @rx.var(cache=True)
     def design_type_display(self) -> str:
         """获取设计类型的中文显示名"""
@@ -165,12 +200,30 @@ class MondoState(rx.State):
         return ASPECT_RATIOS.get(self.aspect_ratio, self.aspect_ratio)
 
     def set_prompt(self, prompt: str):
+        before = self._enhance_key()
         self.prompt = prompt
-        # 修改主题后清除旧的增强提示词
-        self.enhanced_prompt = ""
+        return self._inputs_changed(before)
+
+    def set_auto_enhance(self, enabled: bool):
+        """开启或关闭自动生成提示词预览"""
+        self.auto_enhance = enabled
+        return self._speculate()
+
+    def _inputs_changed(self, before: tuple):
+        """影响增强结果的输入变化后清除旧的增强提示词（预览须与当前输入一致），自动模式下触发预生成"""
+        if self._enhance_key() != before:
+            self.enhanced_prompt = ""
+        return self._speculate()
+
+    def _speculate(self):
+        """自动模式下，输入变化后（防抖）触发后台预生成"""
+        if self.auto_enhance and self.prompt.strip():
+            return MondoState.speculative_enhance
+        return None
 
     def set_design_type(self, display_name: str):
         """设置设计类型"""
+        before = self._enhance_key()
         if display_name in DESIGN_TYPES:
             self.design_type = display_name
         else:
@@ -178,16 +231,20 @@ class MondoState(rx.State):
                 if name == display_name:
                     self.design_type = key
                     break
+        return self._inputs_changed(before)
 
     def set_artist_style(self, display_name: str):
         """设置艺术家风格"""
+        before = self._enhance_key()
         if display_name in STYLE_DISPLAY_NAMES.values():
             self.artist_style = display_name
         elif display_name in STYLE_DISPLAY_NAMES:
             self.artist_style = STYLE_DISPLAY_NAMES[display_name]
+        return self._inputs_changed(before)
 
     def set_aspect_ratio(self, display_name: str):
         """设置宽高比"""
+        before = self._enhance_key()
         if display_name in ASPECT_RATIOS:
             self.aspect_ratio = display_name
         else:
@@ -195,10 +252,17 @@ class MondoState(rx.State):
                 if name == display_name or display_name.startswith(key):
                     self.aspect_ratio = key
                     break
+        return self._inputs_changed(before)
 
     def set_color_hint(self, colors: str):
         """设置颜色偏好"""
+        before = self._enhance_key()
         self.color_hint = colors
+        return self._inputs_changed(before)
+
+    def _enhance_key(self) -> tuple:
+        """增强提示词的缓存键：影响增强结果的全部输入"""
+        return self.prompt.strip(), self.design_type, self.artist_style, self.aspect_ratio, self.color_hint.strip()
 
     def get_format_description(self, aspect_ratio: str) -> str:
         """获取宽高比描述"""
@@ -234,11 +298,12 @@ class MondoState(rx.State):
 
         return prompt
 
-    async def ai_enhance_prompt(self, original_subject: str) -> str | None:
-        """使用AI增强提示词"""
-        api_key = os.getenv('MONDO_OPENAI_API_KEY')
+    async def ai_enhance_prompt(self, original_subject: str):
+        """使用AI增强提示词，流式产出 (已生成的正文, 已生成的推理内容)；未配置接口时不产出任何内容"""
+        config = get_config()
+        api_key = config.mondo.api_key
         if not api_key:
-            return None
+            return
 
         user_prefs = f"Style: {self.artist_style}, Colors: {self.color_hint}" if self.color_hint else f"Style: {self.artist_style}"
 
@@ -258,59 +323,82 @@ Create an optimized Mondo-style prompt that:
 
 Return ONLY the enhanced prompt text, no explanations."""
 
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                        os.getenv('MONDO_OPENAI_BASE_URL') + '/chat/completions',
-                        headers={
-                            'Content-Type': 'application/json',
-                            'Authorization': f'Bearer {api_key}'
-                        },
-                        json={
-                            'model': os.getenv('MONDO_TEXT_MODEL'),
-                            'messages': [{'role': 'user', 'content': enhancement_request}],
-                        },
-                        timeout=aiohttp.ClientTimeout(total=120)
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if 'choices' in result and len(result['choices']) > 0:
-                            message = result['choices'][0]['message']
-                            # 优先使用content，如果为空则使用reasoning_content（推理模型）
-                            content = message.get('content') or message.get('reasoning_content')
-                            if content:
-                                enhanced = content.strip()
-                                return enhanced
-        except Exception as e:
-            import traceback
-            print(f"[AI增强] 异常: {str(e)}")
-            traceback.print_exc()
-        return None
-
-    @rx.event(background=True)
-    async def enhance_current_prompt(self):
-        """增强当前提示词"""
-        if not self.prompt:
-            yield rx.window_alert("请先输入主题描述！")
+        content, reasoning = '', ''
+        async with admission_ticket('mondo_text', self.router.session.client_token) as ticket:
+            await ticket.admitted()
+            async with client_session() as session:
+                async for delta in stream_chat(session, config.mondo.base_url, api_key, config.mondo_text_model,
+                                               [{'role': 'user', 'content': enhancement_request}]):
+                    content += delta.content
+                    reasoning += delta.reasoning
+                    yield content, reasoning
+
+    async def _enhance(self, key: tuple):
+        """生成增强提示词并流式写入预览，AI 生成的结果按输入参数缓存"""
+        cached = _enhance_cache.get(key)
+        cache_result('mondo_enhance', bool(cached))
+        if cached:
+            async with self:
+                self.enhanced_prompt = cached
             return
 
         async with self:
             self.enhancing = True
+            self.enhanced_prompt = ""
+            self.enhance_reasoning = ""
 
         try:
-            enhanced = await self.ai_enhance_prompt(self.prompt)
+            content, reasoning = '', ''
+            # 流式写入预览，按固定间隔刷新界面，避免每个 token 都推送一次状态
+            throttle = Throttle()
+            try:
+                async for content, reasoning in self.ai_enhance_prompt(self.prompt):
+                    if throttle.ready():
+                        async with self:
+                            self.enhanced_prompt = content.strip()
+                            self.enhance_reasoning = reasoning.strip()
+            except Exception as e:
+                print(f"[AI增强] 异常: {str(e)}")
+                traceback.print_exc()
+                content, reasoning = '', ''
+            # 优先使用content，如果为空则使用reasoning_content（推理模型）
+            enhanced = (content or reasoning).strip()
             if enhanced:
                 format_desc = self.get_format_description(self.aspect_ratio)
+                enhanced += f", Mondo poster style, screen print aesthetic, {format_desc}"
+                _cache_enhanced(key, enhanced)
                 async with self:
-                    self.enhanced_prompt = enhanced + f", Mondo poster style, screen print aesthetic, {format_desc}"
+                    self.enhanced_prompt = enhanced
             else:
                 async with self:
                     self.enhanced_prompt = self.generate_prompt_from_template(self.prompt)
         finally:
             async with self:
                 self.enhancing = False
+                self.enhance_reasoning = ""
+
+    @rx.event(background=True)
+    @cancellable('mondo_enhance')
+    async def enhance_current_prompt(self):
+        """增强当前提示词"""
+        if not self.prompt:
+            yield rx.window_alert("请先输入主题描述！")
+            return
+        await self._enhance(self._enhance_key())
 
     @rx.event(background=True)
+    @cancellable('mondo_enhance')
+    async def speculative_enhance(self):
+        """输入停止变化一段时间后在后台预先生成增强提示词；期间输入再次变化时本次调用被新的调用取消"""
+        await asyncio.sleep(SPECULATIVE_DEBOUNCE_SECONDS)
+        async with self:
+            enabled = self.auto_enhance
+            key = self._enhance_key()
+        if enabled and key[0]:
+            await self._enhance(key)
+
+    @rx.event(background=True)
+    @cancellable('mondo')
     async def get_image(self):
         """调用大模型生成图片"""
         if self.prompt == "":
@@ -322,13 +410,32 @@ Return ONLY the enhanced prompt text, no explanations."""
             self.image_urls = []
 
         try:
-            # 构建最终提示词
-            if self.enhanced_prompt:
+            # 构建最终提示词：只使用与当前输入匹配且已完整生成的增强结果；
+            # enhanced_prompt 在流式生成过程中只有部分内容，不能直接使用
+            key = self._enhance_key()
+            token = self.router.session.client_token
+            enhancing = running(token, 'mondo_enhance')
+            timed_out = False
+            if key not in _enhance_cache and enhancing is not None:
+                async with self:
+                    self.queue_status = "等待提示词生成完成…"
+                await asyncio.wait([enhancing], timeout=ENHANCE_WAIT_SECONDS)
+                if not enhancing.done():
+                    cancel(token, 'mondo_enhance')
+                    timed_out = True
+                async with self:
+                    self.queue_status = ""
+            if key in _enhance_cache:
+                final_prompt = _enhance_cache[key]
+            elif self.enhanced_prompt and not timed_out and running(token, 'mondo_enhance') is None:
+                # 没有进行中的增强时，界面上的预览是已完成的结果（输入变化时会被清除，与当前输入一致），
+                # 例如 AI 增强失败后写入的模板提示词或已被淘汰出缓存的结果
                 final_prompt = self.enhanced_prompt
             else:
                 final_prompt = self.generate_prompt_from_template(self.prompt)
 
-            image_model = os.getenv('MONDO_IMAGE_MODEL')
+            config = get_config()
+            image_model = config.mondo_image_model
 
             # 解析宽高比为尺寸
             ratio_parts = self.aspect_ratio.split(':')
@@ -350,29 +457,36 @@ Return ONLY the enhanced prompt text, no explanations."""
                 'size': size,
             }
 
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                        os.getenv('MONDO_OPENAI_BASE_URL') + '/images/generations',
-                        json=param,
-                        headers={
-                            'Content-Type': 'application/json',
-                            'Authorization': 'Bearer ' + os.getenv('MONDO_OPENAI_API_KEY')
-                        }
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        async with self:
-                            self.image_urls = [data['data'][0]['url']]
-                    else:
-                        error_text = await response.text()
-                        print(f"[图片生成] 状态码: {response.status}, 返回内容: {error_text}")
-                        yield rx.window_alert(f"图片生成失败！状态码: {response.status}, 原因: {error_text}")
+            async with admission_ticket('mondo', self.router.session.client_token) as ticket:
+                async for status in ticket.waiting():
+                    async with self:
+                        self.queue_status = status
+                async with self:
+                    self.queue_status = ""
+                async with client_session() as session:
+                    async with session.post(
+                            config.mondo.base_url + '/images/generations',
+                            json=param,
+                            headers={
+                                'Content-Type': 'application/json',
+                                'Authorization': 'Bearer ' + config.mondo.api_key
+                            }
+                    ) as response:
+                        if response.status == 200:
+                            data = await response.json()
+                            async with self:
+                                self.image_urls = [data['data'][0]['url']]
+                        else:
+                            error_text = await response.text()
+                            print(f"[图片生成] 状态码: {response.status}, 返回内容: {error_text}")
+                            yield error_alert(f"图片生成失败！状态码: {response.status}, 原因: {error_text}")
         except Exception as e:
             print(f"[图片生成] 异常: {str(e)}")
-            yield rx.window_alert("图片生成失败！异常原因：" + str(e))
+            yield error_alert("图片生成失败！异常原因：" + str(e))
         finally:
             async with self:
                 self.processing = False
+                self.queue_status = ""
 
     @rx.event
     async def download_image(self, index_num: int):
@@ -380,7 +494,7 @@ Return ONLY the enhanced prompt text, no explanations."""
         image_url = self.image_urls[index_num]
 
         try:
-            async with aiohttp.ClientSession() as session:
+            async with client_session() as session:
                 async with session.get(image_url) as response:
                     if response.status == 200:
                         image_data = await response.read()
@@ -396,9 +510,9 @@ Return ONLY the enhanced prompt text, no explanations."""
                             }})();
                         """)
                     else:
-                        return rx.window_alert(f"下载失败：HTTP {response.status}")
+                        return error_alert(f"下载失败：HTTP {response.status}")
         except Exception as e:
-            return rx.window_alert(f"下载失败：{str(e)}")
+            return error_alert(f"下载失败：{str(e)}")
 
 
 def image_modal(image_url):
@@ -453,7 +567,7 @@ def index():
                 ),
 
                 # 主题输入
-                rx.text_area(
+                prompt_area(
                     value=MondoState.prompt,
                     placeholder="输入主题描述（如：银翼杀手 赛博朋克电影）",
                     on_change=MondoState.set_prompt,
@@ -510,7 +624,7 @@ def index():
                     "<style>.mondo-params-flex { } .mondo-param-item { } @media (min-width: 48em) { .mondo-params-flex { flex-direction: row !important; } .mondo-param-item { flex: 1; } }</style>"),
 
                 # 颜色偏好
-                rx.input(
+                prompt_input(
                     value=MondoState.color_hint,
                     placeholder="颜色偏好（可选，如：橙色、青色、黑色）",
                     on_change=MondoState.set_color_hint,
@@ -526,6 +640,34 @@ def index():
                     loading=MondoState.enhancing,
                     width="100%",
                 ),
+                rx.hstack(
+                    rx.switch(
+                        checked=MondoState.auto_enhance,
+                        on_change=MondoState.set_auto_enhance,
+                        size="1",
+                    ),
+                    rx.text("输入停顿后自动生成提示词预览", font_size="0.8em", color="gray"),
+                    align="center",
+                    width="100%",
+                ),
+
+                # 推理模型的思考过程
+                rx.cond(
+                    MondoState.enhance_reasoning != "",
+                    rx.box(
+                        rx.text("思考中：", font_weight="bold", font_size="0.8em", color="gray"),
+                        rx.text(
+                            MondoState.enhance_reasoning,
+                            font_size="0.75em",
+                            color="gray",
+                            overflow_wrap="break-word",
+                        ),
+                        max_height="8em",
+                        overflow_y="auto",
+                        padding="0.5em 1em",
+                        width="100%",
+                    ),
+                ),
 
                 # 增强后的提示词预览
                 rx.cond(
@@ -555,6 +697,10 @@ def index():
                     size="3",
                     color_scheme="blue",
                 ),
+                rx.cond(
+                    MondoState.queue_status != "",
+                    rx.text(MondoState.queue_status, color="gray", font_size="0.85em"),
+                ),
 
                 # 生成的图片
                 rx.cond(
@@ -1,15 +1,17 @@
-import asyncio
 import base64
 import hashlib
-import os
-from datetime import date
 from urllib.parse import parse_qs, urlparse
 
 import aiohttp
 import reflex as rx
 
-_quota_lock = asyncio.Lock()
-_quota_usage: dict[tuple[str, str], int] = {}
+from image_gen_page.tool.admission import admission_ticket, tenant_weight
+from image_gen_page.tool.cancellation import cancellable
+from image_gen_page.tool.components import prompt_area
+from image_gen_page.tool.config import get_config, normalize_size, parse_size_options
+from image_gen_page.tool.metrics import client_session
+from image_gen_page.tool.quota import get_quota_backend, today
+from image_gen_page.tool.tracing import error_alert
 
 
 def parse_quota(value: str, default: int = -1) -> int:
@@ -19,51 +21,13 @@ def parse_quota(value: str, default: int = -1) -> int:
         return default
 
 
-async def reserve_generation_quota(open_id: str, requested_count: int, daily_limit: int) -> tuple[bool, int]:
-    async with _quota_lock:
-        quota_key = (open_id, date.today().isoformat())
-        used = _quota_usage.get(quota_key, 0)
-        if used + requested_count > daily_limit:
-            return False, used
-        used += requested_count
-        _quota_usage[quota_key] = used
-        return True, used
+async def reserve_generation_quota(open_id: str, requested_count: int, daily_limit: int,
+                                   day: str = "") -> tuple[bool, int]:
+    return await get_quota_backend().reserve(open_id, requested_count, daily_limit, day)
 
 
-def normalize_size(value: str) -> str:
-    size = value.strip().split("(", 1)[0].strip().rstrip("x")
-    if not size:
-        return ""
-    if ":" in size and "x" not in size:
-        parts = size.split(":", 1)
-        try:
-            width = int(parts[0])
-            height = int(parts[1])
-        except ValueError:
-            return ""
-        if width > 0 and height > 0:
-            return f"{width}:{height}"
-        return ""
-    parts = size.split("x", 2)
-    if len(parts) < 2:
-        return ""
-    try:
-        width = int(parts[0])
-        height = int(parts[1])
-    except ValueError:
-        return ""
-    if width > 0 and height > 0:
-        return f"{width}x{height}"
-    return ""
-
-
-def parse_size_options(value: str) -> list[str]:
-    options = []
-    for item in value.split(","):
-        size = item.strip()
-        if normalize_size(size):
-            options.append(size)
-    return options
+async def refund_generation_quota(open_id: str, refund_count: int, day: str = "") -> int:
+    return await get_quota_backend().refund(open_id, refund_count, day)
 
 
 def find_size_option(options: list[str], size: str) -> str:
@@ -86,8 +50,7 @@ class Text2ImageState(rx.State):
     upload_imgs = []
     error_msg: str = ""
     max_files: int = 1
-
-    model_count_dict = {}
+    queue_status = ""  # 排队提示
 
     model = ""
     model_options = []
@@ -111,41 +74,20 @@ class Text2ImageState(rx.State):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        default_model = os.getenv("TEXT2IMAGE_MODEL", "gpt-4o-image")
-        model_options = [item.strip() for item in os.getenv("TEXT2IMAGE_MODELS", default_model).split(",") if
-                         item.strip()]
-        if not model_options:
-            model_options = [default_model]
-        if default_model not in model_options:
-            model_options.insert(0, default_model)
-
-        model_counts = [item.strip() for item in os.getenv("TEXT2IMAGE_N", self.n).split(",") if item.strip()]
-        for index, model in enumerate(model_options):
-            count_value = model_counts[index] if index < len(model_counts) else model_counts[0]
-            try:
-                parsed_count = int(count_value)
-            except ValueError:
-                parsed_count = 1
-            if parsed_count < 1:
-                parsed_count = 1
-            self.model_count_dict[model] = str(parsed_count)
-
-        size_options = parse_size_options(os.getenv("TEXT2IMAGE_SIZES", ",".join(self.size_options)))
-        if not size_options:
-            size_options = self.size_options.copy()
-
-        default_n = self.model_count_dict.get(model_options[0], self.n)
+        # 配置在启动时已解析为快照，这里只引用，不再重复解析环境变量
+        config = get_config().text2image
+        default_n = config.model_counts.get(config.models[0], self.n)
         if default_n not in self.n_options:
             default_n = self.n_options[0]
 
-        self.available_models = model_options
-        self.model_options = [model_options[0]]
-        self.model = model_options[0]
+        self.available_models = list(config.models)
+        self.model_options = [config.models[0]]
+        self.model = config.models[0]
         self.allow_edit = False
-        self.size_options = size_options
-        self.size = find_size_option(size_options, self.size) or size_options[0]
+        self.size_options = list(config.size_options)
+        self.size = find_size_option(self.size_options, self.size) or self.size_options[0]
         self.n = default_n
-        self.title = os.getenv("TEXT2IMAGE_TITLE", self.title)[:60]
+        self.title = config.title
 
     def set_prompt(self, prompt: str):
         self.prompt = prompt
@@ -155,7 +97,7 @@ class Text2ImageState(rx.State):
 
     def set_model(self, model: str):
         self.model = model
-        self.n = self.model_count_dict.get(model, self.n_options[0])
+        self.n = get_config().text2image.model_counts.get(model, self.n_options[0])
         if not self.allow_edit:
             self.upload_imgs = []
             self.error_msg = ""
@@ -192,7 +134,7 @@ class Text2ImageState(rx.State):
             else:
                 self.model = self.available_models[0]
             self.model_options = [self.model]
-            self.n = self.model_count_dict.get(self.model, self.n_options[0])
+            self.n = get_config().text2image.model_counts.get(self.model, self.n_options[0])
             self.allow_edit = edit == "1"
             if url_size_options:
                 self.size_options = url_size_options
@@ -243,6 +185,7 @@ class Text2ImageState(rx.State):
         self.error_msg = ""
 
     @rx.event(background=True)
+    @cancellable('text2image')
     async def get_image(self):
         if self.prompt == "":
             yield rx.window_alert("提示词不能为空！")
@@ -251,11 +194,17 @@ class Text2ImageState(rx.State):
         requested_count = int(self.n)
         open_id = self.open_id
         daily_limit = self.daily_limit
+        quota_day = today()
+        # 公平调度按 open_id 区分用户，没有 open_id 时按会话区分；持有配额的用户可获得更高权重
+        tenant = open_id or self.router.session.client_token
+        weight = tenant_weight(open_id, has_quota=daily_limit >= 0)
+        reserved_count = 0
         if daily_limit >= 0:
-            allowed, used = await reserve_generation_quota(open_id, requested_count, daily_limit)
+            allowed, used = await reserve_generation_quota(open_id, requested_count, daily_limit, quota_day)
             if not allowed:
                 yield rx.window_alert("请求过于频繁，请稍后再试。")
                 return
+            reserved_count = requested_count
 
         async with self:
             self.processing = True
@@ -263,8 +212,9 @@ class Text2ImageState(rx.State):
             self.image_urls = []
 
         try:
-            async with aiohttp.ClientSession() as session:
+            async with client_session() as session:
                 request_size = normalize_size(self.size)
+                endpoint_config = get_config().text2image.endpoint
                 image_urls = []
 
                 for _ in range(requested_count):
@@ -289,7 +239,7 @@ class Text2ImageState(rx.State):
                         form.add_field("image", image_data, filename=self.upload_imgs[0], content_type=content_type)
 
                         headers = {
-                            "Authorization": "Bearer " + os.getenv("TEXT2IMAGE_OPENAI_API_KEY")
+                            "Authorization": "Bearer " + endpoint_config.api_key
                         }
                         request_kwargs = {
                             "data": form,
@@ -299,7 +249,7 @@ class Text2ImageState(rx.State):
                     else:
                         headers = {
                             "Content-Type": "application/json",
-                            "Authorization": "Bearer " + os.getenv("TEXT2IMAGE_OPENAI_API_KEY")
+                            "Authorization": "Bearer " + endpoint_config.api_key
                         }
                         request_kwargs = {
                             "json": {
@@ -312,46 +262,58 @@ class Text2ImageState(rx.State):
                         }
                         endpoint = "/images/generations"
 
-                    async with session.post(
-                            os.getenv("TEXT2IMAGE_OPENAI_BASE_URL") + endpoint,
-                            **request_kwargs,
-                    ) as response:
-                        if response.status != 200:
-                            error_text = await response.text()
-                            yield rx.window_alert(f"图片生成失败！异常原因：{response.status}-{error_text}")
-                            return
-
-                        data = await response.json()
-                        current_urls = []
-                        for item in data.get("data", []):
-                            image_url = item.get("url")
-                            if image_url:
-                                current_urls.append(image_url)
-                                continue
-
-                            b64_json = item.get("b64_json")
-                            if b64_json:
-                                current_urls.append(f"data:image/png;base64,{b64_json}")
-
-                        if not current_urls:
-                            yield rx.window_alert(f"图片生成失败！未返回可用图片数据：{data}")
-                            return
-
-                        image_urls.extend(current_urls)
+                    async with admission_ticket('text2image', tenant, weight) as ticket:
+                        async for status in ticket.waiting():
+                            async with self:
+                                self.queue_status = status
+                        async with self:
+                            self.queue_status = ""
+                        async with session.post(
+                                endpoint_config.base_url + endpoint,
+                                **request_kwargs,
+                        ) as response:
+                            if response.status != 200:
+                                error_text = await response.text()
+                                yield error_alert(f"图片生成失败！异常原因：{response.status}-{error_text}")
+                                return
+
+                            data = await response.json()
+                            current_urls = []
+                            for item in data.get("data", []):
+                                image_url = item.get("url")
+                                if image_url:
+                                    current_urls.append(image_url)
+                                    continue
+
+                                b64_json = item.get("b64_json")
+                                if b64_json:
+                                    current_urls.append(f"data:image/png;base64,{b64_json}")
+
+                            if not current_urls:
+                                yield error_alert(f"图片生成失败！未返回可用图片数据：{data}")
+                                return
+
+                            image_urls.extend(current_urls)
 
                 async with self:
                     self.image_urls = image_urls
                     self.complete = True
+                # 生成成功，预留的配额全部消耗
+                reserved_count = 0
         except Exception as e:
-            yield rx.window_alert("图片生成失败！异常原因：" + str(e))
+            yield error_alert("图片生成失败！异常原因：" + str(e))
         finally:
+            # 生成失败时退还预留的配额
+            if reserved_count > 0:
+                await refund_generation_quota(open_id, reserved_count, quota_day)
             async with self:
                 self.processing = False
+                self.queue_status = ""
 
     @rx.event
     async def download_image(self, index_num: int):
         if index_num < 0 or index_num >= len(self.image_urls):
-            return rx.window_alert("下载失败：图片不存在")
+            return error_alert("下载失败：图片不存在")
 
         image_url = self.image_urls[index_num]
         if image_url.startswith("data:image/"):
@@ -367,10 +329,10 @@ class Text2ImageState(rx.State):
             """)
 
         try:
-            async with aiohttp.ClientSession() as session:
+            async with client_session() as session:
                 async with session.get(image_url) as response:
                     if response.status != 200:
-                        return rx.window_alert(f"下载失败：HTTP {response.status}")
+                        return error_alert(f"下载失败：HTTP {response.status}")
 
                     image_data = await response.read()
                     content_type = response.headers.get("Content-Type", "image/png").split(";")[0]
@@ -386,7 +348,7 @@ class Text2ImageState(rx.State):
                         }})();
                     """)
         except Exception as e:
-            return rx.window_alert(f"下载失败：{str(e)}")
+            return error_alert(f"下载失败：{str(e)}")
 
 
 def image_modal(image_url):
@@ -441,7 +403,7 @@ def index():
                     padding_x="0.5em",
                     margin_bottom="0.25em",
                 ),
-                rx.text_area(
+                prompt_area(
                     value=Text2ImageState.prompt,
                     placeholder="请输入提示词",
                     on_change=Text2ImageState.set_prompt,
@@ -537,6 +499,10 @@ def index():
                     width=["23em", "28.5em"],
                     loading=Text2ImageState.processing,
                 ),
+                rx.cond(
+                    Text2ImageState.queue_status != "",
+                    rx.text(Text2ImageState.queue_status, color="gray", font_size="0.85em"),
+                ),
                 rx.cond(
                     Text2ImageState.complete,
                     rx.flex(
@@ -0,0 +1,234 @@
+# 上游服务准入控制：按服务商限制并发数与速率（令牌桶），超出部分排队等待并给出排队位置和预计等待时间
+# 排队按租户（open_id 或会话）做加权公平调度，单个用户的大量请求不会独占所有名额
+import asyncio
+import itertools
+import math
+import time
+
+from image_gen_page.tool.config import AppConfig, get_config, on_reload
+from image_gen_page.tool.tracing import current_span, record_span
+
+# 新服务商在没有历史数据时假定的单次调用耗时（秒），用于估算等待时间
+DEFAULT_CALL_SECONDS = 20
+
+
+def tenant_weight(tenant: str, has_quota: bool = False) -> float:
+    """租户的调度权重：单独配置的权重优先，持有配额的租户使用 QUOTA_TENANT_WEIGHT，其余为 1"""
+    config = get_config()
+    if tenant in config.tenant_weights:
+        return config.tenant_weights[tenant]
+    if has_quota:
+        return config.quota_tenant_weight
+    return 1.0
+
+
+def format_queue_status(position: int, eta: float) -> str:
+    return f"排队中：当前第 {position} 位，预计等待 {math.ceil(eta)} 秒"
+
+
+class TokenBucket:
+    """令牌桶限速，rate_per_minute 为 0 表示不限速"""
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self) -> float:
+        """距离下一个令牌可用还需等待的秒数"""
+        if self.rate <= 0:
+            return 0
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        if self.rate > 0:
+            self._refill()
+            self.tokens -= 1
+
+
+class Ticket:
+    """一次上游调用的准入凭证，使用 async with 包裹调用过程，退出时自动释放"""
+
+    def __init__(self, limiter: "ProviderLimiter", tenant: str = '', weight: float = 1.0, cost: float = 1.0):
+        self.limiter = limiter
+        self.tenant = tenant
+        self.weight = max(weight, 0.01)
+        self.cost = cost
+        # 加权公平队列的虚拟开始/结束时间，结束时间越小越先被调度
+        self.start_tag = 0.0
+        self.finish_tag = 0.0
+        self.seq = 0
+        self._admitted = asyncio.Event()
+        self.admitted_at = 0.0
+        self.released = False
+        # 排队阶段记入创建凭证时所在的追踪
+        self.trace_parent = current_span()
+        self.enqueued_ns = 0
+
+    @property
+    def position(self) -> int:
+        """排队位置（从1开始），已准入时为0"""
+        if self._admitted.is_set():
+            return 0
+        return self.limiter.position_of(self)
+
+    @property
+    def eta(self) -> float:
+        return self.limiter.estimate_wait(self.position)
+
+    async def admitted(self):
+        await self._admitted.wait()
+
+    async def waiting(self, interval: float = 1.0):
+        """等待准入期间定期产出排队提示文本，准入后结束；无需排队时不产出任何内容"""
+        while not self._admitted.is_set():
+            yield format_queue_status(self.position, self.eta)
+            try:
+                await asyncio.wait_for(self._admitted.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.limiter.release(self)
+
+    async def __aenter__(self):
+        self.enqueued_ns = time.time_ns()
+        self.limiter.enqueue(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class ProviderLimiter:
+    """单个服务商的并发与速率限制，等待者按加权公平队列（WFQ）调度"""
+
+    def __init__(self, name: str, concurrency: int, rate_per_minute: float = 0):
+        self.name = name
+        self.concurrency = concurrency
+        self.rate_per_minute = rate_per_minute
+        self.bucket = TokenBucket(rate_per_minute, burst=concurrency)
+        self.active = 0
+        self.waiters: list[Ticket] = []
+        # 单次调用耗时的指数滑动平均
+        self.avg_call_seconds = DEFAULT_CALL_SECONDS
+        self._timer: asyncio.TimerHandle | None = None
+        # 虚拟时间与各租户最后一个请求的虚拟结束时间
+        self.virtual_time = 0.0
+        self.last_finish: dict[str, float] = {}
+        self._seq = itertools.count()
+
+    def reconfigure(self, concurrency: int, rate_per_minute: float):
+        """配置重载后调整并发数与速率，已准入的请求不受影响"""
+        if (concurrency, rate_per_minute) == (self.concurrency, self.rate_per_minute):
+            return
+        self.concurrency = concurrency
+        self.rate_per_minute = rate_per_minute
+        self.bucket = TokenBucket(rate_per_minute, burst=concurrency)
+        self._dispatch()
+
+    def enqueue(self, ticket: Ticket):
+        # 同一租户的请求依次排在自己上一个请求之后，权重越高虚拟时间前进越慢
+        ticket.start_tag = max(self.virtual_time, self.last_finish.get(ticket.tenant, 0.0))
+        ticket.finish_tag = ticket.start_tag + ticket.cost / ticket.weight
+        ticket.seq = next(self._seq)
+        self.last_finish[ticket.tenant] = ticket.finish_tag
+        self.waiters.append(ticket)
+        self._dispatch()
+
+    def position_of(self, ticket: Ticket) -> int:
+        if ticket not in self.waiters:
+            return 0
+        key = (ticket.finish_tag, ticket.seq)
+        return sum(1 for waiter in self.waiters if (waiter.finish_tag, waiter.seq) < key) + 1
+
+    def estimate_wait(self, position: int) -> float:
+        if position <= 0:
+            return 0
+        # 前面的请求按并发数分批完成，同时受速率限制约束
+        eta = math.ceil(position / self.concurrency) * self.avg_call_seconds
+        if self.bucket.rate > 0:
+            eta = max(eta, self.bucket.delay() + (position - 1) / self.bucket.rate)
+        return eta
+
+    def _next_waiter(self) -> Ticket:
+        ticket = min(self.waiters, key=lambda waiter: (waiter.finish_tag, waiter.seq))
+        self.virtual_time = max(self.virtual_time, ticket.start_tag)
+        # 清理已落后于虚拟时间的租户记录，避免字典无限增长
+        for tenant in [tenant for tenant, finish in self.last_finish.items() if finish <= self.virtual_time]:
+            del self.last_finish[tenant]
+        return ticket
+
+    def _dispatch(self):
+        while self.waiters and self.active < self.concurrency:
+            delay = self.bucket.delay()
+            if delay > 0:
+                # 令牌不足，等令牌补充后再调度
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+                return
+            ticket = self._next_waiter()
+            self.waiters.remove(ticket)
+            self.bucket.take()
+            self.active += 1
+            ticket.admitted_at = time.monotonic()
+            ticket._admitted.set()
+            record_span('admission.wait', ticket.enqueued_ns, time.time_ns(), ticket.trace_parent,
+                        provider=self.name, active=self.active, waiting=len(self.waiters))
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def release(self, ticket: Ticket):
+        if ticket._admitted.is_set():
+            self.active -= 1
+            duration = time.monotonic() - ticket.admitted_at
+            self.avg_call_seconds = self.avg_call_seconds * 0.8 + duration * 0.2
+        elif ticket in self.waiters:
+            self.waiters.remove(ticket)
+            record_span('admission.wait', ticket.enqueued_ns, time.time_ns(), ticket.trace_parent,
+                        provider=self.name, abandoned=True)
+        self._dispatch()
+
+
+_limiters: dict[str, ProviderLimiter] = {}
+
+
+def get_limiter(provider: str) -> ProviderLimiter:
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        config = get_config()
+        concurrency, rate_per_minute = config.provider_limits.get(provider, config.default_provider_limit)
+        limiter = ProviderLimiter(provider, concurrency, rate_per_minute)
+        _limiters[provider] = limiter
+    return limiter
+
+
+def limiters() -> dict[str, ProviderLimiter]:
+    """已创建的各服务商限流器（用于输出指标）"""
+    return dict(_limiters)
+
+
+def _apply_limits(config: AppConfig):
+    for provider, limiter in _limiters.items():
+        limiter.reconfigure(*config.provider_limits.get(provider, config.default_provider_limit))
+
+
+on_reload(_apply_limits)
+
+
+def admission_ticket(provider: str, tenant: str = '', weight: float = 1.0, cost: float = 1.0) -> Ticket:
+    """获取某服务商的准入凭证：async with admission_ticket('fal', tenant) as ticket: ..."""
+    return Ticket(get_limiter(provider), tenant, weight, cost)
@@ -0,0 +1,137 @@
+# 取消被放弃的上游调用：同一会话在同一功能上只保留最新一次生成，重新提交时取消上一次；
+# 会话断开（关闭页面）超过宽限期后取消仍在执行的生成，释放服务商名额
+import asyncio
+import functools
+import inspect
+import time
+import traceback
+
+from image_gen_page.tool.config import get_config
+from image_gen_page.tool.metrics import track_handler
+from image_gen_page.tool.tracing import record_span, span
+
+RESUBMIT = 'resubmit'
+DISCONNECT = 'disconnect'
+
+
+class _Scope:
+    def __init__(self, task: asyncio.Task, grace: float):
+        self.task = task
+        self.grace = grace
+        self.reason = ''
+        self.disconnected_at: float | None = None
+
+
+# (会话, 作用域) -> 正在执行的调用
+_scopes: dict[tuple[str, str], _Scope] = {}
+
+
+def running(token: str, scope: str) -> asyncio.Task | None:
+    """某会话某作用域正在执行的调用"""
+    entry = _scopes.get((token, scope))
+    if entry is None or entry.task.done():
+        return None
+    return entry.task
+
+
+def cancel(token: str, scope: str, reason: str = RESUBMIT) -> asyncio.Task | None:
+    """取消某会话某作用域正在执行的调用，返回被取消的 task"""
+    task = running(token, scope)
+    if task is None:
+        return None
+    _scopes[token, scope].reason = reason
+    task.cancel()
+    return task
+
+
+def cancellable(scope: str, durable: bool = False, **resets):
+    """后台事件处理函数的装饰器：进入时取消同一会话同一作用域上一次未完成的调用；
+    会话断开超过宽限期（DISCONNECT_GRACE_SECONDS，durable=True 的持久化任务为 JOB_ABANDON_SECONDS）后取消本次调用，
+    并把 resets 中的状态变量恢复为给定值。状态类可定义 async def _on_abandon(self)，在因断开而取消时清理远端任务"""
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(self, *args, **kwargs):
+            token = self.router.session.client_token
+            key = (token, scope)
+            previous = cancel(token, scope, RESUBMIT)
+            if previous is not None:
+                # 等上一次调用清理完（退还配额、重置状态）再开始，避免其清理覆盖本次的状态
+                await asyncio.wait([previous], timeout=5)
+            config = get_config()
+            entry = _Scope(asyncio.current_task(),
+                           config.job_abandon_seconds if durable else config.disconnect_grace_seconds)
+            _scopes[key] = entry
+            with track_handler(scope, handler.__name__) as record, \
+                    span(f"{scope}.{handler.__name__}", page=scope) as root:
+                try:
+                    if inspect.isasyncgenfunction(handler):
+                        async for event in handler(self, *args, **kwargs):
+                            record.saw(event)
+                            # 产出的事件推送到页面后才会继续执行，这段时间记为状态推送
+                            pushed_at = time.time_ns()
+                            yield event
+                            record_span('state.push', pushed_at, time.time_ns(), root)
+                    else:
+                        event = await handler(self, *args, **kwargs)
+                        if event is not None:
+                            record.saw(event)
+                            yield event
+                except asyncio.CancelledError:
+                    if not entry.reason:
+                        # 进程退出等其他原因导致的取消，照常向上抛出
+                        raise
+                    entry.task.uncancel()
+                    record.result = 'cancelled'
+                    root.set(cancelled=entry.reason)
+                    if entry.reason == DISCONNECT:
+                        print(f"[取消] 会话已断开，放弃 {scope} 生成")
+                        abandon = getattr(self, '_on_abandon', None)
+                        if abandon is not None:
+                            try:
+                                await abandon()
+                            except Exception:
+                                traceback.print_exc()
+                        if resets:
+                            async with self:
+                                for name, value in resets.items():
+                                    setattr(self, name, value)
+                finally:
+                    if _scopes.get(key) is entry:
+                        del _scopes[key]
+
+        return wrapper
+
+    return decorator
+
+
+def connected_tokens() -> set[str] | None:
+    """当前与本进程保持 websocket 连接的会话，无法获取时返回 None"""
+    try:
+        from reflex.utils.prerequisites import get_app
+        namespace = get_app().app.event_namespace
+        return set(namespace.token_to_sid)
+    except Exception:
+        return None
+
+
+def busy_tokens() -> set[str]:
+    """有生成正在执行的会话"""
+    return {token for (token, _), entry in _scopes.items() if not entry.task.done()}
+
+
+async def watch_disconnects(interval: float = 5.0):
+    """应用生命周期任务：定期检查会话连接，断开超过宽限期的会话取消其进行中的生成"""
+    while True:
+        await asyncio.sleep(interval)
+        connected = connected_tokens()
+        if connected is None:
+            continue
+        now = time.monotonic()
+        for (token, scope), entry in list(_scopes.items()):
+            if token in connected:
+                entry.disconnected_at = None
+            elif entry.disconnected_at is None:
+                entry.disconnected_at = now
+            elif now - entry.disconnected_at >= entry.grace:
+                cancel(token, scope, DISCONNECT)
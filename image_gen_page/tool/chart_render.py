@@ -0,0 +1,941 @@
+# 本地统计图表渲染：大模型只返回结构化的图表描述（JSON），由本模块渲染为 SVG
+# 渲染（布局计算、词云排布、力导向图迭代）在进程池中执行，不阻塞事件循环；本模块只依赖标准库，便于子进程导入
+import asyncio
+import concurrent.futures
+import html
+import json
+import math
+import multiprocessing
+import re
+
+# 页面图表类型（chart_type_options 的名称部分） -> 渲染类型
+CHART_TYPES = {
+    '条形图': 'bar',
+    '柱状图': 'column',
+    '饼图': 'pie',
+    '直方图': 'histogram',
+    '面积图': 'area',
+    '鱼骨图': 'fishbone',
+    '流程图': 'flowchart',
+    '折线图': 'line',
+    '思维导图': 'mindmap',
+    '网络图': 'network',
+    '雷达图': 'radar',
+    '散点图': 'scatter',
+    '树形图': 'tree',
+    '词云图': 'wordcloud',
+    '双轴图': 'dual_axis',
+}
+
+_CATEGORY_SCHEMA = ('{"type": "%s", "title": "标题", "x_label": "横轴名称", "y_label": "纵轴名称", '
+                    '"labels": ["类别1", "类别2"], "series": [{"name": "系列名称", "data": [12, 30]}]}')
+_TREE_SCHEMA = ('{"type": "%s", "title": "标题", '
+                '"root": {"name": "根节点", "children": [{"name": "子节点", "children": []}]}}')
+_GRAPH_SCHEMA = ('{"type": "%s", "title": "标题", "nodes": [{"id": "a", "label": "节点名称"%s}], '
+                 '"edges": [{"source": "a", "target": "b", "label": "连线说明（可为空）"}]}')
+
+# 各渲染类型要求大模型返回的 JSON 结构
+SPEC_SCHEMAS = {
+    'bar': _CATEGORY_SCHEMA % 'bar',
+    'column': _CATEGORY_SCHEMA % 'column',
+    'line': _CATEGORY_SCHEMA % 'line',
+    'area': _CATEGORY_SCHEMA % 'area',
+    'dual_axis': ('{"type": "dual_axis", "title": "标题", "x_label": "横轴名称", "y_label": "左轴名称", '
+                  '"y2_label": "右轴名称", "labels": ["类别1", "类别2"], "series": ['
+                  '{"name": "系列1", "type": "bar", "axis": "left", "data": [120, 200]}, '
+                  '{"name": "系列2", "type": "line", "axis": "right", "data": [0.3, 0.5]}]}'),
+    'pie': '{"type": "pie", "title": "标题", "labels": ["部分1", "部分2"], "series": [{"name": "系列名称", "data": [40, 60]}]}',
+    'histogram': '{"type": "histogram", "title": "标题", "x_label": "数值名称", "bins": 10, "values": [原始数据点, ...]}',
+    'scatter': ('{"type": "scatter", "title": "标题", "x_label": "横轴名称", "y_label": "纵轴名称", '
+                '"series": [{"name": "系列名称", "data": [[x1, y1], [x2, y2]]}]}'),
+    'radar': ('{"type": "radar", "title": "标题", "labels": ["维度1", "维度2", "维度3"], "max": 100, '
+              '"series": [{"name": "对象名称", "data": [80, 65, 90]}]}'),
+    'wordcloud': '{"type": "wordcloud", "title": "标题", "words": [{"text": "词语", "weight": 10}]}',
+    'tree': _TREE_SCHEMA % 'tree',
+    'mindmap': _TREE_SCHEMA % 'mindmap',
+    'fishbone': ('{"type": "fishbone", "title": "标题", "root": {"name": "问题或结果", "children": ['
+                 '{"name": "原因类别", "children": [{"name": "具体原因"}]}]}}'),
+    'flowchart': _GRAPH_SCHEMA % ('flowchart', ', "shape": "start|process|decision|end"'),
+    'network': _GRAPH_SCHEMA % ('network', ', "group": "分组名称"'),
+}
+
+PALETTE = ['#5470c6', '#91cc75', '#fac858', '#ee6666', '#73c0de', '#3ba272', '#fc8452', '#9a60b4', '#ea7ccc',
+           '#4e79a7', '#f28e2b', '#59a14f']
+FONT = "PingFang SC, Microsoft YaHei, Noto Sans CJK SC, sans-serif"
+WIDTH, HEIGHT = 800, 500
+
+
+class ChartSpecError(ValueError):
+    """图表描述缺少必要数据或格式不正确"""
+
+
+def chart_kind(chart_type: str) -> str | None:
+    """由页面的图表类型选项（如 "饼图-展示部分与整体的比例"）得到渲染类型"""
+    return CHART_TYPES.get(chart_type.split('-')[0])
+
+
+def spec_prompt(chart_type: str, prompt: str) -> str:
+    """要求大模型按指定结构返回图表描述的提示词"""
+    kind = chart_kind(chart_type)
+    return f"""你是一个统计图表设计助手，请根据用户的需求设计一张"{chart_type.split('-')[0]}"，只返回一个 JSON 对象，不要任何解释。
+JSON 结构如下（数值必须是数字，文字使用用户的语言，数据不足时合理补全示例数据）：
+{SPEC_SCHEMAS[kind]}
+
+用户的需求如下：
+```
+{prompt}
+```"""
+
+
+def parse_spec(text: str, kind: str) -> dict:
+    """从大模型返回内容中取出 JSON 图表描述"""
+    match = re.search(r'\{.*\}', text, re.DOTALL)
+    if match is None:
+        raise ChartSpecError(f"返回内容中没有 JSON：{text[:200]}")
+    try:
+        spec = json.loads(match.group(0))
+    except ValueError as e:
+        raise ChartSpecError(f"JSON 解析失败：{e}")
+    if not isinstance(spec, dict):
+        raise ChartSpecError("图表描述应为 JSON 对象")
+    # 以页面选择的类型为准
+    spec['type'] = kind
+    return spec
+
+
+# ---------- SVG 基础 ----------
+
+def _esc(text) -> str:
+    return html.escape(str(text), quote=True)
+
+
+def _fmt(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return f"{value:.4g}"
+
+
+def _text_width(text: str, size: float) -> float:
+    """估算文字宽度：中日韩文字按字号计，其他字符按 0.6 倍字号计"""
+    return sum(size if ord(char) > 0x2e80 else size * 0.6 for char in str(text))
+
+
+def _text(x, y, text, size=12, anchor='middle', color='#333', weight='normal', extra='') -> str:
+    return (f'<text x="{x:.1f}" y="{y:.1f}" font-size="{size:.1f}" text-anchor="{anchor}" fill="{color}" '
+            f'font-weight="{weight}" dominant-baseline="central"{extra}>{_esc(text)}</text>')
+
+
+def _svg(width: float, height: float, title: str, body: list[str]) -> str:
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.0f}" height="{height:.0f}" '
+        f'viewBox="0 0 {width:.0f} {height:.0f}" font-family="{FONT}">',
+        '<defs><marker id="arrow" viewBox="0 0 10 10" refX="10" refY="5" markerWidth="7" markerHeight="7" '
+        'orient="auto-start-reverse"><path d="M0,0 L10,5 L0,10 z" fill="#666"/></marker></defs>',
+        f'<rect width="100%" height="100%" fill="#fff"/>',
+    ]
+    if title:
+        parts.append(_text(width / 2, 28, title, 18, weight='bold'))
+    parts.extend(body)
+    parts.append('</svg>')
+    return '\n'.join(parts)
+
+
+def _legend(names: list[str], width: float, y: float = 54) -> list[str]:
+    """图例居中排成一行"""
+    items = [(name, 22 + _text_width(name, 12) + 16) for name in names]
+    x = (width - sum(item_width for _, item_width in items)) / 2
+    parts = []
+    for index, (name, item_width) in enumerate(items):
+        parts.append(f'<rect x="{x:.1f}" y="{y - 6:.1f}" width="14" height="12" rx="2" '
+                     f'fill="{PALETTE[index % len(PALETTE)]}"/>')
+        parts.append(_text(x + 20, y, name, 12, anchor='start'))
+        x += item_width
+    return parts
+
+
+def _nice_ticks(low: float, high: float, count: int = 5) -> list[float]:
+    """取整的坐标刻度"""
+    if high == low:
+        high = low + 1
+    span = high - low
+    magnitude = 10 ** math.floor(math.log10(span / count))
+    step = magnitude
+    for multiple in (1, 2, 2.5, 5, 10):
+        step = multiple * magnitude
+        if span / step <= count:
+            break
+    start = math.floor(low / step + 1e-9) * step
+    ticks = []
+    value = start
+    while value < high + step * 0.999:
+        ticks.append(round(value, 10))
+        value += step
+    if len(ticks) < 2:
+        ticks.append(round(start + step, 10))
+    return ticks
+
+
+def _numbers(values, name: str) -> list[float]:
+    try:
+        numbers = [float(value) for value in values]
+    except (TypeError, ValueError):
+        raise ChartSpecError(f"{name} 中包含非数值数据")
+    # NaN / Infinity 会让坐标计算得到 nan 或在求刻度时死循环
+    if not all(math.isfinite(number) for number in numbers):
+        raise ChartSpecError(f"{name} 中包含 NaN 或无穷大")
+    return numbers
+
+
+def _series_items(spec: dict, default=None) -> list:
+    items = spec.get('series') or default or []
+    if not isinstance(items, list):
+        raise ChartSpecError("series 必须是数组")
+    return items
+
+
+def _series(spec: dict, length: int) -> list[dict]:
+    series = []
+    for index, item in enumerate(_series_items(spec)):
+        if not isinstance(item, dict):
+            item = {'data': item}
+        data = _numbers(item.get('data') or [], '系列数据')[:length]
+        data += [0.0] * (length - len(data))
+        series.append({**item, 'name': str(item.get('name') or f'系列{index + 1}'), 'data': data})
+    if not series:
+        raise ChartSpecError("缺少 series 数据")
+    return series
+
+
+def _labels(spec: dict) -> list[str]:
+    labels = [str(label) for label in spec.get('labels') or []]
+    if not labels:
+        raise ChartSpecError("缺少 labels 数据")
+    return labels
+
+
+# ---------- 类别坐标图：柱状、条形、折线、面积、双轴 ----------
+
+def _value_axis(ticks, y_of, x0, x1, anchor_x, anchor='end') -> list[str]:
+    parts = []
+    for tick in ticks:
+        y = y_of(tick)
+        if anchor == 'end':
+            parts.append(f'<line x1="{x0:.1f}" y1="{y:.1f}" x2="{x1:.1f}" y2="{y:.1f}" stroke="#e6e6e6"/>')
+        parts.append(_text(anchor_x, y, _fmt(tick), 11, anchor=anchor, color='#666'))
+    return parts
+
+
+def _category_labels(labels, x_of, band, y) -> list[str]:
+    rotate = max(_text_width(label, 12) for label in labels) > band * 0.95
+    parts = []
+    for index, label in enumerate(labels):
+        x = x_of(index)
+        if rotate:
+            parts.append(_text(x, y, label, 12, anchor='end', extra=f' transform="rotate(-35 {x:.1f} {y:.1f})"'))
+        else:
+            parts.append(_text(x, y + 4, label, 12))
+    return parts
+
+
+def _render_category(spec: dict) -> str:
+    kind = spec['type']
+    labels = _labels(spec)
+    series = _series(spec, len(labels))
+    if kind == 'dual_axis':
+        for index, item in enumerate(series):
+            item.setdefault('type', 'bar' if index == 0 else 'line')
+            item.setdefault('axis', 'left' if index == 0 else 'right')
+    else:
+        for item in series:
+            item['type'] = {'column': 'bar', 'bar': 'bar'}.get(kind, kind)
+            item['axis'] = 'left'
+    left_series = [item for item in series if item['axis'] != 'right']
+    right_series = [item for item in series if item['axis'] == 'right']
+
+    width, height = WIDTH, HEIGHT
+    rotate_room = 40 if max(_text_width(label, 12) for label in labels) > (width - 140) / len(labels) else 0
+    x0, x1 = 70, width - (70 if right_series else 30)
+    y0, y1 = 80 if len(series) > 1 else 60, height - 50 - rotate_room
+    band = (x1 - x0) / len(labels)
+
+    def scale(items):
+        values = [value for item in items for value in item['data']] or [0.0]
+        ticks = _nice_ticks(min(0.0, min(values)), max(0.0, max(values)))
+        return ticks, lambda value: y1 - (value - ticks[0]) / (ticks[-1] - ticks[0]) * (y1 - y0)
+
+    left_ticks, left_y = scale(left_series or right_series)
+    right_ticks, right_y = scale(right_series) if right_series else (left_ticks, left_y)
+
+    def x_of(index):
+        return x0 + band * (index + 0.5)
+
+    body = _value_axis(left_ticks, left_y, x0, x1, x0 - 8)
+    if right_series:
+        body += _value_axis(right_ticks, right_y, x0, x1, x1 + 8, anchor='start')
+    body.append(f'<line x1="{x0}" y1="{y1}" x2="{x1}" y2="{y1}" stroke="#999"/>')
+    body += _category_labels(labels, x_of, band, y1 + 12)
+
+    bars = [item for item in series if item['type'] == 'bar']
+    bar_width = band * 0.7 / max(len(bars), 1)
+    for index, item in enumerate(series):
+        color = PALETTE[index % len(PALETTE)]
+        y_of = right_y if item['axis'] == 'right' else left_y
+        ticks = right_ticks if item['axis'] == 'right' else left_ticks
+        baseline = y_of(min(max(0.0, ticks[0]), ticks[-1]))
+        if item['type'] == 'bar':
+            offset = bars.index(item)
+            for position, value in enumerate(item['data']):
+                x = x0 + band * position + band * 0.15 + offset * bar_width
+                top, bottom = sorted((y_of(value), baseline))
+                body.append(f'<rect x="{x:.1f}" y="{top:.1f}" width="{bar_width * 0.92:.1f}" '
+                            f'height="{bottom - top:.1f}" fill="{color}"/>')
+            continue
+        points = [(x_of(position), y_of(value)) for position, value in enumerate(item['data'])]
+        path = ' '.join(f'{x:.1f},{y:.1f}' for x, y in points)
+        if item['type'] == 'area':
+            body.append(f'<polygon points="{points[0][0]:.1f},{baseline:.1f} {path} '
+                        f'{points[-1][0]:.1f},{baseline:.1f}" fill="{color}" fill-opacity="0.3"/>')
+        body.append(f'<polyline points="{path}" fill="none" stroke="{color}" stroke-width="2.5"/>')
+        body += [f'<circle cx="{x:.1f}" cy="{y:.1f}" r="3.5" fill="#fff" stroke="{color}" stroke-width="2"/>'
+                 for x, y in points]
+
+    if spec.get('y_label'):
+        body.append(_text(18, (y0 + y1) / 2, spec['y_label'], 12, extra=f' transform="rotate(-90 18 {(y0 + y1) / 2:.1f})"'))
+    if right_series and spec.get('y2_label'):
+        x = width - 14
+        body.append(_text(x, (y0 + y1) / 2, spec['y2_label'], 12, extra=f' transform="rotate(90 {x} {(y0 + y1) / 2:.1f})"'))
+    if spec.get('x_label'):
+        body.append(_text((x0 + x1) / 2, height - 14, spec['x_label'], 12))
+    if len(series) > 1:
+        body += _legend([item['name'] for item in series], width)
+    return _svg(width, height, spec.get('title', ''), body)
+
+
+def _render_bar(spec: dict) -> str:
+    """横向条形图"""
+    labels = _labels(spec)
+    series = _series(spec, len(labels))
+    width = WIDTH
+    band_height = max(24.0, 14.0 * len(series) + 10)
+    left = min(max(_text_width(label, 12) for label in labels) + 24, 220)
+    x0, x1 = left, width - 40
+    y0 = 80 if len(series) > 1 else 60
+    y1 = max(HEIGHT - 50, y0 + band_height * len(labels))
+    height = y1 + 50
+    band = (y1 - y0) / len(labels)
+
+    values = [value for item in series for value in item['data']]
+    ticks = _nice_ticks(min(0.0, min(values)), max(0.0, max(values)))
+
+    def x_of(value):
+        return x0 + (value - ticks[0]) / (ticks[-1] - ticks[0]) * (x1 - x0)
+
+    body = []
+    for tick in ticks:
+        x = x_of(tick)
+        body.append(f'<line x1="{x:.1f}" y1="{y0}" x2="{x:.1f}" y2="{y1:.1f}" stroke="#e6e6e6"/>')
+        body.append(_text(x, y1 + 14, _fmt(tick), 11, color='#666'))
+    body.append(f'<line x1="{x0}" y1="{y0}" x2="{x0}" y2="{y1:.1f}" stroke="#999"/>')
+    bar_height = band * 0.7 / len(series)
+    baseline = x_of(min(max(0.0, ticks[0]), ticks[-1]))
+    for position, label in enumerate(labels):
+        body.append(_text(x0 - 8, y0 + band * (position + 0.5), label, 12, anchor='end'))
+        for index, item in enumerate(series):
+            left_x, right_x = sorted((x_of(item['data'][position]), baseline))
+            y = y0 + band * position + band * 0.15 + index * bar_height
+            body.append(f'<rect x="{left_x:.1f}" y="{y:.1f}" width="{right_x - left_x:.1f}" '
+                        f'height="{bar_height * 0.92:.1f}" fill="{PALETTE[index % len(PALETTE)]}"/>')
+    if spec.get('x_label') or spec.get('y_label'):
+        body.append(_text((x0 + x1) / 2, height - 14, spec.get('y_label') or spec.get('x_label'), 12))
+    if len(series) > 1:
+        body += _legend([item['name'] for item in series], width)
+    return _svg(width, height, spec.get('title', ''), body)
+
+
+# ---------- 饼图、直方图、散点图、雷达图 ----------
+
+def _render_pie(spec: dict) -> str:
+    labels = _labels(spec)
+    values = [max(value, 0.0) for value in _series(spec, len(labels))[0]['data']]
+    total = sum(values)
+    if total <= 0:
+        raise ChartSpecError("饼图数据之和必须大于 0")
+    cx, cy, radius = WIDTH * 0.38, HEIGHT / 2 + 20, 170
+    body = []
+    angle = -math.pi / 2
+    for index, (label, value) in enumerate(zip(labels, values)):
+        color = PALETTE[index % len(PALETTE)]
+        share = value / total
+        if share >= 0.9999:
+            body.append(f'<circle cx="{cx}" cy="{cy}" r="{radius}" fill="{color}"/>')
+        elif share > 0:
+            end = angle + share * 2 * math.pi
+            large = 1 if share > 0.5 else 0
+            body.append(
+                f'<path d="M{cx:.1f},{cy:.1f} L{cx + radius * math.cos(angle):.1f},{cy + radius * math.sin(angle):.1f} '
+                f'A{radius},{radius} 0 {large} 1 {cx + radius * math.cos(end):.1f},{cy + radius * math.sin(end):.1f} Z" '
+                f'fill="{color}" stroke="#fff" stroke-width="1.5"/>')
+            if share >= 0.04:
+                middle = (angle + end) / 2
+                body.append(_text(cx + radius * 0.65 * math.cos(middle), cy + radius * 0.65 * math.sin(middle),
+                                  f'{share * 100:.1f}%', 12, color='#fff', weight='bold'))
+            angle = end
+        # 右侧图例
+        y = cy - len(labels) * 11 + index * 22
+        body.append(f'<rect x="{WIDTH * 0.7:.1f}" y="{y - 6:.1f}" width="14" height="12" rx="2" fill="{color}"/>')
+        body.append(_text(WIDTH * 0.7 + 20, y, f'{label}（{_fmt(value)}）', 12, anchor='start'))
+    return _svg(WIDTH, HEIGHT, spec.get('title', ''), body)
+
+
+def _render_histogram(spec: dict) -> str:
+    values = _numbers(spec.get('values') or [], 'values')
+    if not values:
+        if spec.get('labels') and spec.get('series'):
+            # 已分好组的数据按无间隔的柱状图绘制
+            return _render_category({**spec, 'type': 'column'})
+        raise ChartSpecError("缺少 values 数据")
+    try:
+        bins = int(spec.get('bins') or 0)
+    except (TypeError, ValueError):
+        bins = 0
+    bins = min(max(bins or round(math.sqrt(len(values))), 3), 40)
+    low, high = min(values), max(values)
+    if high == low:
+        high = low + 1
+    step = (high - low) / bins
+    counts = [0] * bins
+    for value in values:
+        counts[min(int((value - low) / step), bins - 1)] += 1
+
+    x0, x1, y0, y1 = 70, WIDTH - 30, 60, HEIGHT - 60
+    ticks = _nice_ticks(0, max(counts))
+
+    def y_of(count):
+        return y1 - count / ticks[-1] * (y1 - y0)
+
+    body = _value_axis(ticks, y_of, x0, x1, x0 - 8)
+    bin_width = (x1 - x0) / bins
+    label_every = math.ceil(bins / 10)
+    for index, count in enumerate(counts):
+        x = x0 + index * bin_width
+        body.append(f'<rect x="{x:.1f}" y="{y_of(count):.1f}" width="{bin_width:.1f}" height="{y1 - y_of(count):.1f}" '
+                    f'fill="{PALETTE[0]}" stroke="#fff"/>')
+    for index in range(0, bins + 1, label_every):
+        body.append(_text(x0 + index * bin_width, y1 + 14, _fmt(round(low + index * step, 6)), 11, color='#666'))
+    body.append(f'<line x1="{x0}" y1="{y1}" x2="{x1}" y2="{y1}" stroke="#999"/>')
+    if spec.get('x_label'):
+        body.append(_text((x0 + x1) / 2, HEIGHT - 18, spec['x_label'], 12))
+    body.append(_text(18, (y0 + y1) / 2, spec.get('y_label') or '频数', 12,
+                      extra=f' transform="rotate(-90 18 {(y0 + y1) / 2:.1f})"'))
+    return _svg(WIDTH, HEIGHT, spec.get('title', ''), body)
+
+
+def _render_scatter(spec: dict) -> str:
+    series = []
+    for index, item in enumerate(_series_items(spec, [{'data': spec.get('points') or []}])):
+        if not isinstance(item, dict):
+            raise ChartSpecError("散点图的 series 元素必须是对象")
+        points = []
+        for point in item.get('data') or []:
+            if isinstance(point, dict):
+                point = (point.get('x'), point.get('y'))
+            if isinstance(point, (list, tuple)) and len(point) >= 2:
+                points.append(tuple(_numbers(point[:2], '散点数据')))
+        if points:
+            series.append((str(item.get('name') or f'系列{index + 1}'), points))
+    if not series:
+        raise ChartSpecError("缺少散点数据")
+    xs = [x for _, points in series for x, _ in points]
+    ys = [y for _, points in series for _, y in points]
+    x_ticks, y_ticks = _nice_ticks(min(xs), max(xs)), _nice_ticks(min(ys), max(ys))
+    x0, x1, y0, y1 = 70, WIDTH - 30, 80 if len(series) > 1 else 60, HEIGHT - 60
+
+    def x_of(value):
+        return x0 + (value - x_ticks[0]) / (x_ticks[-1] - x_ticks[0]) * (x1 - x0)
+
+    def y_of(value):
+        return y1 - (value - y_ticks[0]) / (y_ticks[-1] - y_ticks[0]) * (y1 - y0)
+
+    body = _value_axis(y_ticks, y_of, x0, x1, x0 - 8)
+    for tick in x_ticks:
+        x = x_of(tick)
+        body.append(f'<line x1="{x:.1f}" y1="{y0}" x2="{x:.1f}" y2="{y1}" stroke="#f0f0f0"/>')
+        body.append(_text(x, y1 + 14, _fmt(tick), 11, color='#666'))
+    body.append(f'<line x1="{x0}" y1="{y1}" x2="{x1}" y2="{y1}" stroke="#999"/>')
+    for index, (_, points) in enumerate(series):
+        color = PALETTE[index % len(PALETTE)]
+        body += [f'<circle cx="{x_of(x):.1f}" cy="{y_of(y):.1f}" r="4.5" fill="{color}" fill-opacity="0.75"/>'
+                 for x, y in points]
+    if spec.get('x_label'):
+        body.append(_text((x0 + x1) / 2, HEIGHT - 18, spec['x_label'], 12))
+    if spec.get('y_label'):
+        body.append(_text(18, (y0 + y1) / 2, spec['y_label'], 12, extra=f' transform="rotate(-90 18 {(y0 + y1) / 2:.1f})"'))
+    if len(series) > 1:
+        body += _legend([name for name, _ in series], WIDTH)
+    return _svg(WIDTH, HEIGHT, spec.get('title', ''), body)
+
+
+def _render_radar(spec: dict) -> str:
+    labels = _labels(spec)
+    if len(labels) < 3:
+        raise ChartSpecError("雷达图至少需要 3 个维度")
+    series = _series(spec, len(labels))
+    try:
+        maximum = float(spec.get('max') or 0)
+    except (TypeError, ValueError):
+        maximum = 0
+    if maximum <= 0:
+        maximum = _nice_ticks(0, max(max(item['data']) for item in series))[-1]
+    cx, cy, radius = WIDTH / 2, HEIGHT / 2 + 25, 170
+
+    def point(index, ratio):
+        angle = -math.pi / 2 + index * 2 * math.pi / len(labels)
+        return cx + radius * ratio * math.cos(angle), cy + radius * ratio * math.sin(angle)
+
+    body = []
+    for level in range(1, 6):
+        ring = ' '.join(f'{x:.1f},{y:.1f}' for x, y in (point(i, level / 5) for i in range(len(labels))))
+        body.append(f'<polygon points="{ring}" fill="none" stroke="#ddd"/>')
+    for index, label in enumerate(labels):
+        x, y = point(index, 1)
+        body.append(f'<line x1="{cx}" y1="{cy}" x2="{x:.1f}" y2="{y:.1f}" stroke="#ddd"/>')
+        lx, ly = point(index, 1.12)
+        anchor = 'middle' if abs(lx - cx) < 10 else ('start' if lx > cx else 'end')
+        body.append(_text(lx, ly, label, 12, anchor=anchor))
+    for index, item in enumerate(series):
+        color = PALETTE[index % len(PALETTE)]
+        shape = ' '.join(f'{x:.1f},{y:.1f}' for x, y in
+                         (point(i, min(max(value / maximum, 0), 1)) for i, value in enumerate(item['data'])))
+        body.append(f'<polygon points="{shape}" fill="{color}" fill-opacity="0.2" stroke="{color}" stroke-width="2"/>')
+    if len(series) > 1:
+        body += _legend([item['name'] for item in series], WIDTH)
+    return _svg(WIDTH, HEIGHT, spec.get('title', ''), body)
+
+
+# ---------- 词云 ----------
+
+def _render_wordcloud(spec: dict) -> str:
+    words = []
+    for item in spec.get('words') or []:
+        if isinstance(item, dict):
+            text, weight = item.get('text') or item.get('name'), item.get('weight', item.get('value', 1))
+        elif isinstance(item, (list, tuple)) and item:
+            text, weight = item[0], item[1] if len(item) > 1 else 1
+        else:
+            text, weight = item, 1
+        try:
+            weight = float(weight)
+        except (TypeError, ValueError):
+            weight = 1.0
+        if text:
+            words.append((str(text), weight))
+    if not words:
+        raise ChartSpecError("缺少 words 数据")
+    words = sorted(words, key=lambda word: -word[1])[:150]
+    low, high = words[-1][1], words[0][1]
+    cx, cy = WIDTH / 2, HEIGHT / 2 + 20
+    placed = []  # (左, 上, 右, 下)
+    body = []
+    for index, (text, weight) in enumerate(words):
+        size = 14 + (weight - low) / ((high - low) or 1) * 50
+        half_width, half_height = _text_width(text, size) / 2 + 2, size * 0.6
+        # 沿阿基米德螺线向外寻找不重叠的位置
+        for step in range(3000):
+            t = step * 0.1
+            x, y = cx + 2.2 * t * math.cos(t), cy + 1.4 * t * math.sin(t)
+            box = (x - half_width, y - half_height, x + half_width, y + half_height)
+            if box[0] < 5 or box[1] < 45 or box[2] > WIDTH - 5 or box[3] > HEIGHT - 5:
+                continue
+            if all(box[2] < other[0] or box[0] > other[2] or box[3] < other[1] or box[1] > other[3]
+                   for other in placed):
+                placed.append(box)
+                body.append(_text(x, y, text, size, color=PALETTE[index % len(PALETTE)], weight='bold'))
+                break
+    return _svg(WIDTH, HEIGHT, spec.get('title', ''), body)
+
+
+# ---------- 层次结构：树形图、思维导图、鱼骨图 ----------
+
+def _tree(spec: dict, max_depth: int = 6) -> dict:
+    def normalize(node, depth):
+        if not isinstance(node, dict):
+            return {'name': str(node), 'children': []}
+        children = (node.get('children') or []) if depth < max_depth else []
+        return {'name': str(node.get('name') or node.get('label') or ''),
+                'children': [normalize(child, depth + 1) for child in children]}
+
+    root = spec.get('root') or {'name': spec.get('title', ''), 'children': spec.get('children') or []}
+    root = normalize(root, 0)
+    if not root['children']:
+        raise ChartSpecError("缺少层次结构数据（root.children）")
+    return root
+
+
+def _layout(root: dict) -> tuple[list[tuple[dict, int, float, dict | None]], int, int]:
+    """叶子节点依次占一个位置，父节点位于子节点中间；返回 [(节点, 深度, 位置, 父节点)]、叶子数与最大深度"""
+    nodes = []
+    leaves = [0]
+
+    def visit(node, depth, parent):
+        if node['children']:
+            positions = [visit(child, depth + 1, node) for child in node['children']]
+            position = (positions[0] + positions[-1]) / 2
+        else:
+            position = leaves[0]
+            leaves[0] += 1
+        node['_position'] = position
+        node['_depth'] = depth
+        nodes.append((node, depth, position, parent))
+        return position
+
+    visit(root, 0, None)
+    return nodes, leaves[0], max(depth for _, depth, _, _ in nodes)
+
+
+def _render_tree(spec: dict) -> str:
+    """自上而下的树形图"""
+    root = _tree(spec)
+    nodes, leaves, depth = _layout(root)
+    slot = max(max(_text_width(node['name'], 12) for node, *_ in nodes if not node['children']) + 20, 70)
+    width = max(WIDTH, leaves * slot + 40)
+    height = max(HEIGHT, depth * 90 + 140)
+
+    def position(node):
+        x = 20 + (node['_position'] + 0.5) * (width - 40) / leaves
+        y = 80 + node['_depth'] * (height - 130) / max(depth, 1)
+        return x, y
+
+    body = []
+    for node, _, _, parent in nodes:
+        if parent is not None:
+            (px, py), (x, y) = position(parent), position(node)
+            middle = (py + y) / 2
+            body.append(f'<path d="M{px:.1f},{py + 13:.1f} V{middle:.1f} H{x:.1f} V{y - 13:.1f}" '
+                        f'fill="none" stroke="#aaa" stroke-width="1.5"/>')
+    for node, node_depth, _, _ in nodes:
+        x, y = position(node)
+        box_width = _text_width(node['name'], 12) + 16
+        color = PALETTE[min(node_depth, len(PALETTE) - 1)]
+        body.append(f'<rect x="{x - box_width / 2:.1f}" y="{y - 13:.1f}" width="{box_width:.1f}" height="26" rx="5" '
+                    f'fill="{color}"/>')
+        body.append(_text(x, y, node['name'], 12, color='#fff'))
+    return _svg(width, height, spec.get('title', ''), body)
+
+
+def _render_mindmap(spec: dict) -> str:
+    """根节点在左侧、分支向右展开的思维导图"""
+    root = _tree(spec, max_depth=5)
+    nodes, leaves, depth = _layout(root)
+    column_width = [0.0] * (depth + 1)
+    for node, node_depth, _, _ in nodes:
+        column_width[node_depth] = max(column_width[node_depth], _text_width(node['name'], 13) + 24)
+    column_x = [40.0]
+    for index in range(depth):
+        column_x.append(column_x[-1] + column_width[index] + 50)
+    width = max(WIDTH, column_x[-1] + column_width[-1] + 40)
+    height = max(HEIGHT, leaves * 34 + 100)
+
+    def position(node):
+        y = 70 + (node['_position'] + 0.5) * (height - 90) / leaves
+        return column_x[node['_depth']], y
+
+    branch = {}
+    for index, child in enumerate(root['children']):
+        branch[id(child)] = PALETTE[index % len(PALETTE)]
+    body = []
+    for node, _, _, parent in sorted(nodes, key=lambda item: item[1]):
+        if parent is not None:
+            # 子节点继承一级分支的颜色
+            color = branch.get(id(node)) or branch.get(id(parent), PALETTE[0])
+            branch[id(node)] = color
+            px, py = position(parent)
+            px += _text_width(parent['name'], 13) + 16
+            x, y = position(node)
+            middle = (px + x) / 2
+            body.append(f'<path d="M{px:.1f},{py:.1f} C{middle:.1f},{py:.1f} {middle:.1f},{y:.1f} {x:.1f},{y:.1f}" '
+                        f'fill="none" stroke="{color}" stroke-width="2"/>')
+    for node, node_depth, _, _ in nodes:
+        x, y = position(node)
+        box_width = _text_width(node['name'], 13) + 16
+        if node_depth == 0:
+            body.append(f'<rect x="{x:.1f}" y="{y - 16:.1f}" width="{box_width:.1f}" height="32" rx="16" fill="#333"/>')
+            body.append(_text(x + box_width / 2, y, node['name'], 13, color='#fff', weight='bold'))
+        else:
+            color = branch.get(id(node), PALETTE[0])
+            body.append(f'<rect x="{x:.1f}" y="{y - 13:.1f}" width="{box_width:.1f}" height="26" rx="6" '
+                        f'fill="#fff" stroke="{color}" stroke-width="1.5"/>')
+            body.append(_text(x + box_width / 2, y, node['name'], 13))
+    return _svg(width, height, spec.get('title', ''), body)
+
+
+def _render_fishbone(spec: dict) -> str:
+    """鱼骨图：鱼头为问题，上下交替排列原因类别，类别下列出具体原因"""
+    root = _tree(spec, max_depth=2)
+    categories = root['children']
+    per_side = math.ceil(len(categories) / 2)
+    head_width = min(max(_text_width(root['name'], 14) + 24, 120), 220)
+    width = max(900, per_side * 230 + head_width + 100)
+    height = 560
+    spine_y, spine_start, spine_end = height / 2 + 10, 40, width - head_width - 30
+    body = [
+        f'<line x1="{spine_start}" y1="{spine_y}" x2="{spine_end}" y2="{spine_y}" stroke="#555" stroke-width="4"/>',
+        f'<rect x="{spine_end:.1f}" y="{spine_y - 30:.1f}" width="{head_width:.1f}" height="60" rx="10" fill="{PALETTE[3]}"/>',
+        _text(spine_end + head_width / 2, spine_y, root['name'][:16], 14, color='#fff', weight='bold'),
+    ]
+    for index, category in enumerate(categories):
+        side = -1 if index % 2 == 0 else 1
+        slot = index // 2
+        joint_x = spine_start + (slot + 1) * (spine_end - spine_start) / (per_side + 1) + 60
+        end_x, end_y = joint_x - 110, spine_y + side * 190
+        color = PALETTE[index % len(PALETTE)]
+        body.append(f'<line x1="{joint_x:.1f}" y1="{spine_y}" x2="{end_x:.1f}" y2="{end_y:.1f}" '
+                    f'stroke="{color}" stroke-width="2.5"/>')
+        label_width = _text_width(category['name'], 13) + 16
+        body.append(f'<rect x="{end_x - label_width / 2:.1f}" y="{end_y + (side * 14) - 13:.1f}" '
+                    f'width="{label_width:.1f}" height="26" rx="5" fill="{color}"/>')
+        body.append(_text(end_x, end_y + side * 14, category['name'], 13, color='#fff', weight='bold'))
+        causes = category['children'][:6]
+        for position, cause in enumerate(causes):
+            ratio = (position + 1) / (len(causes) + 1)
+            x, y = end_x + (joint_x - end_x) * ratio, end_y + (spine_y - end_y) * ratio
+            body.append(f'<line x1="{x - 70:.1f}" y1="{y:.1f}" x2="{x:.1f}" y2="{y:.1f}" stroke="#999"/>')
+            body.append(_text(x - 74, y, cause['name'][:14], 11, anchor='end', color='#444'))
+    return _svg(width, height, spec.get('title', ''), body)
+
+
+# ---------- 关系图：流程图、网络图 ----------
+
+def _graph(spec: dict) -> tuple[list[dict], list[dict]]:
+    nodes, index = [], {}
+    for item in spec.get('nodes') or []:
+        if not isinstance(item, dict):
+            item = {'id': item}
+        node_id = str(item.get('id') or item.get('label') or item.get('name') or '')
+        if not node_id or node_id in index:
+            continue
+        node = {**item, 'id': node_id, 'label': str(item.get('label') or item.get('name') or node_id)}
+        index[node_id] = node
+        index.setdefault(node['label'], node)
+        nodes.append(node)
+    edges = []
+    for item in spec.get('edges') or spec.get('links') or []:
+        if not isinstance(item, dict):
+            continue
+        source = str(item.get('source') or item.get('from') or '')
+        target = str(item.get('target') or item.get('to') or '')
+        for name in (source, target):
+            # 连线引用了未声明的节点时自动补上
+            if name and name not in index:
+                index[name] = {'id': name, 'label': name}
+                nodes.append(index[name])
+        if source and target:
+            edges.append({'source': index[source]['id'], 'target': index[target]['id'],
+                          'label': str(item.get('label') or '')})
+    if not nodes:
+        raise ChartSpecError("缺少 nodes 数据")
+    nodes = nodes[:80]
+    # 只保留两端都在截断后节点中的连线
+    kept = {node['id'] for node in nodes}
+    return nodes, [edge for edge in edges if edge['source'] in kept and edge['target'] in kept]
+
+
+def _render_flowchart(spec: dict) -> str:
+    nodes, edges = _graph(spec)
+    by_id = {node['id']: node for node in nodes}
+    outgoing = {node['id']: [] for node in nodes}
+    for edge in edges:
+        if edge['source'] in outgoing and edge['target'] in outgoing:
+            outgoing[edge['source']].append(edge)
+    # 深度优先找出回边（循环），其余边按最长路径分层
+    state, back_edges = {}, set()
+
+    def visit(node_id):
+        state[node_id] = 1
+        for edge in outgoing[node_id]:
+            if state.get(edge['target']) == 1:
+                back_edges.add(id(edge))
+            elif edge['target'] not in state:
+                visit(edge['target'])
+        state[node_id] = 2
+
+    for node in nodes:
+        if node['id'] not in state:
+            visit(node['id'])
+    layer = {node['id']: 0 for node in nodes}
+    for _ in range(len(nodes)):
+        changed = False
+        for edge in edges:
+            if id(edge) not in back_edges and edge['target'] in layer and layer[edge['target']] <= layer[edge['source']]:
+                layer[edge['target']] = layer[edge['source']] + 1
+                changed = True
+        if not changed:
+            break
+    layers = {}
+    for node in nodes:
+        layers.setdefault(layer[node['id']], []).append(node)
+    widest = max(len(items) for items in layers.values())
+    width = max(WIDTH, widest * 190 + 60)
+    height = max(HEIGHT, len(layers) * 100 + 90)
+    for depth, items in layers.items():
+        for position, node in enumerate(items):
+            node['_x'] = width / 2 + (position - (len(items) - 1) / 2) * 190
+            node['_y'] = 80 + depth * 100
+            node['_w'] = max(110, min(_text_width(node['label'], 13) + 28, 180))
+
+    body = []
+    for edge in edges:
+        source, target = by_id.get(edge['source']), by_id.get(edge['target'])
+        if source is None or target is None:
+            continue
+        if target['_y'] > source['_y']:
+            x1, y1, x2, y2 = source['_x'], source['_y'] + 22, target['_x'], target['_y'] - 22
+            body.append(f'<line x1="{x1:.1f}" y1="{y1:.1f}" x2="{x2:.1f}" y2="{y2:.1f}" stroke="#666" '
+                        f'stroke-width="1.5" marker-end="url(#arrow)"/>')
+        else:
+            # 回到上层（循环）或同层的连线从右侧绕行
+            x1, y1 = source['_x'] + source['_w'] / 2, source['_y']
+            x2, y2 = target['_x'] + target['_w'] / 2, target['_y']
+            bend = max(x1, x2) + 60
+            body.append(f'<path d="M{x1:.1f},{y1:.1f} C{bend:.1f},{y1:.1f} {bend:.1f},{y2:.1f} {x2:.1f},{y2:.1f}" '
+                        f'fill="none" stroke="#666" stroke-width="1.5" stroke-dasharray="5,3" marker-end="url(#arrow)"/>')
+        if edge['label']:
+            body.append(_text((x1 + x2) / 2 + 8, (y1 + y2) / 2, edge['label'], 11, anchor='start', color='#c0392b'))
+    for node in nodes:
+        x, y, node_width = node['_x'], node['_y'], node['_w']
+        shape = str(node.get('shape') or 'process')
+        if shape == 'decision':
+            body.append(f'<polygon points="{x - node_width / 2 - 10:.1f},{y} {x:.1f},{y - 26} '
+                        f'{x + node_width / 2 + 10:.1f},{y} {x:.1f},{y + 26}" fill="{PALETTE[2]}"/>')
+        elif shape in ('start', 'end'):
+            body.append(f'<rect x="{x - node_width / 2:.1f}" y="{y - 20}" width="{node_width:.1f}" height="40" rx="20" '
+                        f'fill="{PALETTE[1] if shape == "start" else PALETTE[3]}"/>')
+        else:
+            body.append(f'<rect x="{x - node_width / 2:.1f}" y="{y - 20}" width="{node_width:.1f}" height="40" rx="6" '
+                        f'fill="{PALETTE[0]}"/>')
+        body.append(_text(x, y, node['label'][:14], 13, color='#222' if shape == 'decision' else '#fff'))
+    return _svg(width, height, spec.get('title', ''), body)
+
+
+def _render_network(spec: dict) -> str:
+    nodes, edges = _graph(spec)
+    count = len(nodes)
+    area_width, area_height = WIDTH - 80, HEIGHT - 110
+    # Fruchterman-Reingold 力导向布局，初始位置取圆周保证结果稳定
+    positions = [[math.cos(2 * math.pi * i / count) * area_width / 3, math.sin(2 * math.pi * i / count) * area_height / 3]
+                 for i in range(count)]
+    index = {node['id']: i for i, node in enumerate(nodes)}
+    links = [(index[edge['source']], index[edge['target']]) for edge in edges
+             if edge['source'] in index and edge['target'] in index and edge['source'] != edge['target']]
+    k = math.sqrt(area_width * area_height / count) * 0.75
+    temperature = area_width / 10
+    for _ in range(300):
+        moves = [[0.0, 0.0] for _ in range(count)]
+        for i in range(count):
+            for j in range(i + 1, count):
+                dx, dy = positions[i][0] - positions[j][0], positions[i][1] - positions[j][1]
+                distance = math.hypot(dx, dy) or 0.01
+                force = k * k / distance
+                moves[i][0] += dx / distance * force
+                moves[i][1] += dy / distance * force
+                moves[j][0] -= dx / distance * force
+                moves[j][1] -= dy / distance * force
+        for i, j in links:
+            dx, dy = positions[i][0] - positions[j][0], positions[i][1] - positions[j][1]
+            distance = math.hypot(dx, dy) or 0.01
+            force = distance * distance / k
+            moves[i][0] -= dx / distance * force
+            moves[i][1] -= dy / distance * force
+            moves[j][0] += dx / distance * force
+            moves[j][1] += dy / distance * force
+        for i in range(count):
+            length = math.hypot(*moves[i]) or 0.01
+            step = min(length, temperature)
+            positions[i][0] += moves[i][0] / length * step
+            positions[i][1] += moves[i][1] / length * step
+        temperature *= 0.98
+    xs, ys = [x for x, _ in positions], [y for _, y in positions]
+    span_x, span_y = (max(xs) - min(xs)) or 1, (max(ys) - min(ys)) or 1
+
+    def place(i):
+        return (40 + (positions[i][0] - min(xs)) / span_x * area_width,
+                70 + (positions[i][1] - min(ys)) / span_y * area_height)
+
+    degree = [0] * count
+    for i, j in links:
+        degree[i] += 1
+        degree[j] += 1
+    groups = {}
+    for node in nodes:
+        groups.setdefault(str(node.get('group') or ''), len(groups))
+    body = []
+    for i, j in links:
+        (x1, y1), (x2, y2) = place(i), place(j)
+        body.append(f'<line x1="{x1:.1f}" y1="{y1:.1f}" x2="{x2:.1f}" y2="{y2:.1f}" stroke="#bbb" stroke-width="1.2"/>')
+    for i, node in enumerate(nodes):
+        x, y = place(i)
+        radius = min(6 + degree[i] * 1.5, 18)
+        color = PALETTE[groups[str(node.get('group') or '')] % len(PALETTE)]
+        body.append(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="{radius:.1f}" fill="{color}" stroke="#fff" stroke-width="1.5"/>')
+        body.append(_text(x, y + radius + 10, node['label'][:12], 11))
+    if len(groups) > 1:
+        body += _legend([name or '其他' for name in groups], WIDTH)
+    return _svg(WIDTH, HEIGHT, spec.get('title', ''), body)
+
+
+RENDERERS = {
+    'bar': _render_bar,
+    'column': _render_category,
+    'line': _render_category,
+    'area': _render_category,
+    'dual_axis': _render_category,
+    'pie': _render_pie,
+    'histogram': _render_histogram,
+    'scatter': _render_scatter,
+    'radar': _render_radar,
+    'wordcloud': _render_wordcloud,
+    'tree': _render_tree,
+    'mindmap': _render_mindmap,
+    'fishbone': _render_fishbone,
+    'flowchart': _render_flowchart,
+    'network': _render_network,
+}
+
+
+def render_svg(spec: dict) -> str:
+    """按图表描述渲染 SVG（在进程池中执行）"""
+    renderer = RENDERERS.get(spec.get('type'))
+    if renderer is None:
+        raise ChartSpecError(f"不支持的图表类型：{spec.get('type')}")
+    return renderer(spec)
+
+
+_pool: concurrent.futures.ProcessPoolExecutor | None = None
+
+
+def get_render_pool(workers: int = 2) -> concurrent.futures.ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn 方式启动子进程，避免 fork 带有事件循环与线程的主进程
+        _pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                       mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def _discard_pool(pool: concurrent.futures.ProcessPoolExecutor):
+    """子进程异常退出后进程池不再可用，丢弃后由 get_render_pool 重建"""
+    global _pool
+    if _pool is pool:
+        _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def render_chart(spec: dict, workers: int = 2) -> str:
+    """在进程池中渲染图表，返回 SVG 文本；进程池损坏时重建并重试一次"""
+    for attempt in range(2):
+        pool = get_render_pool(workers)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, render_svg, spec)
+        except concurrent.futures.process.BrokenProcessPool:
+            _discard_pool(pool)
+            if attempt:
+                raise
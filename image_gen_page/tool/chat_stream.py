@@ -0,0 +1,73 @@
+# OpenAI 兼容聊天接口的流式（SSE）调用：逐段产出正文与推理内容（reasoning_content）
+import json
+import time
+from dataclasses import dataclass
+
+import aiohttp
+
+from image_gen_page.tool.tracing import span
+
+
+@dataclass
+class ChatDelta:
+    content: str = ''
+    reasoning: str = ''
+
+
+async def stream_chat(session: aiohttp.ClientSession, base_url: str, api_key: str, model: str, messages: list,
+                      timeout: float = 120, **params):
+    """以 stream=True 调用 /chat/completions，逐个产出 ChatDelta；服务端不支持流式而直接返回 JSON 时一次性产出"""
+    with span('llm.stream', model=model) as current:
+        async with session.post(
+                base_url + '/chat/completions',
+                headers={
+                    'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream',
+                    'Authorization': f'Bearer {api_key}'
+                },
+                json={'model': model, 'messages': messages, 'stream': True, **params},
+                # 流式响应只限制两段数据之间的间隔，不限制总时长
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=timeout),
+        ) as response:
+            if response.status != 200:
+                raise Exception(f"{response.status}-{await response.text()}")
+            if 'text/event-stream' not in response.headers.get('Content-Type', ''):
+                result = await response.json()
+                message = result['choices'][0]['message'] if result.get('choices') else {}
+                yield ChatDelta(message.get('content') or '', message.get('reasoning_content') or '')
+                return
+            async for raw_line in response.content:
+                line = raw_line.decode('utf-8').strip()
+                if not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    return
+                try:
+                    chunk = json.loads(data)
+                except ValueError:
+                    continue
+                if not chunk.get('choices'):
+                    continue
+                delta = chunk['choices'][0].get('delta') or {}
+                content = delta.get('content') or ''
+                reasoning = delta.get('reasoning_content') or delta.get('reasoning') or ''
+                if content or reasoning:
+                    if 'first_token_ms' not in current.attributes:
+                        current.set(first_token_ms=(time.time_ns() - current.start_ns) // 1_000_000)
+                    yield ChatDelta(content, reasoning)
+
+
+class Throttle:
+    """限制界面刷新频率：距上次刷新超过 interval 秒才返回 True"""
+
+    def __init__(self, interval: float = 0.15):
+        self.interval = interval
+        self._last = 0.0
+
+    def ready(self) -> bool:
+        now = time.monotonic()
+        if now - self._last >= self.interval:
+            self._last = now
+            return True
+        return False
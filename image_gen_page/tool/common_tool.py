@@ -1,33 +1,24 @@
 import base64
 import os
+from pathlib import Path
 
-from deep_translator import GoogleTranslator
 
-
-# 翻译中文为英文
-def translate(text, source='zh-CN', target='en'):
-    proxies = None
-    # 检查环境变量是否存在
-    if os.getenv('translate_proxy'):
-        proxy_url = os.getenv('translate_proxy')
-        proxies = {
-            'http': proxy_url,
-            'https': proxy_url
-        }
-
-    translator = GoogleTranslator(
-        source=source,
-        target=target,
-        proxies=proxies
-    )
-    return translator.translate(text)
+# 本地持久化数据目录（配额、任务队列等 SQLite 文件）
+def get_data_dir() -> Path:
+    path = Path(os.getenv('DATA_DIR', 'data'))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
 
 
 # 图片转base64
 def image_to_base64(upload_dir, upload_img):
+    # tracing 依赖本模块，在函数内导入避免循环引用
+    from image_gen_page.tool.tracing import span
+
     path = upload_dir / upload_img
-    with path.open("rb") as image_file:
+    with span('upload.encode', file=upload_img) as current, path.open("rb") as image_file:
         encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
+        current.set(bytes=len(encoded_string))
 
     image_extension = upload_img.split('.')[-1].lower()
     if image_extension == 'png':
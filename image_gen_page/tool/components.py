@@ -0,0 +1,20 @@
+# 页面共用的输入组件：提示词等文本输入在前端缓冲，停顿或失去焦点时才同步到后端，
+# 避免每次按键都产生一次 websocket 事件、一次状态加锁与一次增量下发
+import reflex as rx
+
+PROMPT_DEBOUNCE_MS = 1000  # 停止输入多久后同步（毫秒）
+
+
+def _debounced(field: rx.Component, value) -> rx.Component:
+    # 点击生成按钮时输入框先失去焦点，缓冲中的内容会在点击事件之前同步，生成时使用的一定是最终内容
+    return rx.debounce_input(field, value=value, debounce_timeout=PROMPT_DEBOUNCE_MS, force_notify_on_blur=True)
+
+
+def prompt_area(value, on_change, **props) -> rx.Component:
+    """多行提示词输入框"""
+    return _debounced(rx.text_area(on_change=on_change, **props), value)
+
+
+def prompt_input(value, on_change, **props) -> rx.Component:
+    """单行文本输入框"""
+    return _debounced(rx.input(on_change=on_change, **props), value)
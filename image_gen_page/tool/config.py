@@ -0,0 +1,348 @@
+# 应用配置：从环境变量（含 .env 文件）解析一次，生成不可变的配置快照供各页面引用
+# 收到 SIGHUP 信号或 .env 文件修改后重新解析，并整体替换快照，修改配置无需重启服务
+import asyncio
+import os
+import signal
+import traceback
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Callable, Mapping
+
+import dotenv
+
+TEXT2IMAGE_DEFAULT_SIZES = "1024x1024x(1:1),1024x1536x(2:3),1536x1024x(3:2)"
+
+
+def normalize_size(value: str) -> str:
+    size = value.strip().split("(", 1)[0].strip().rstrip("x")
+    if not size:
+        return ""
+    if ":" in size and "x" not in size:
+        parts = size.split(":", 1)
+        try:
+            width = int(parts[0])
+            height = int(parts[1])
+        except ValueError:
+            return ""
+        if width > 0 and height > 0:
+            return f"{width}:{height}"
+        return ""
+    parts = size.split("x", 2)
+    if len(parts) < 2:
+        return ""
+    try:
+        width = int(parts[0])
+        height = int(parts[1])
+    except ValueError:
+        return ""
+    if width > 0 and height > 0:
+        return f"{width}x{height}"
+    return ""
+
+
+def parse_size_options(value: str) -> list[str]:
+    options = []
+    for item in value.split(","):
+        size = item.strip()
+        if normalize_size(size):
+            options.append(size)
+    return options
+
+
+def parse_provider_limits(value: str) -> dict[str, tuple[int, float]]:
+    """解析 PROVIDER_LIMITS，格式为 服务商:并发数:每分钟请求数，多个用逗号分隔，例如 fal:2:30,mondo:3:0"""
+    limits = {}
+    for item in value.split(','):
+        parts = [part.strip() for part in item.split(':')]
+        if len(parts) < 2 or not parts[0]:
+            continue
+        try:
+            concurrency = max(int(parts[1]), 1)
+            rate_per_minute = float(parts[2]) if len(parts) > 2 and parts[2] else 0
+        except ValueError:
+            continue
+        limits[parts[0]] = (concurrency, rate_per_minute)
+    return limits
+
+
+def parse_tenant_weights(value: str) -> dict[str, float]:
+    """解析 TENANT_WEIGHTS，格式为 租户:权重，多个用逗号分隔，例如 vip_open_id:4,partner:2"""
+    weights = {}
+    for item in value.split(','):
+        tenant, _, weight = item.strip().rpartition(':')
+        try:
+            if tenant and float(weight) > 0:
+                weights[tenant] = float(weight)
+        except ValueError:
+            continue
+    return weights
+
+
+@dataclass(frozen=True)
+class Endpoint:
+    """OpenAI 兼容接口的地址与密钥"""
+    base_url: str = ''
+    api_key: str = ''
+
+
+@dataclass(frozen=True)
+class Text2ImageConfig:
+    endpoint: Endpoint
+    models: tuple[str, ...]
+    model_counts: Mapping[str, str]  # 模型 -> 每次生成张数
+    size_options: tuple[str, ...]
+    title: str
+
+
+@dataclass(frozen=True)
+class CoverConfig:
+    endpoint: Endpoint
+    models: tuple[str, ...]
+    model_counts: Mapping[str, int]  # 模型 -> 每次生成封面数
+    screen_base_url: str
+    html_cache_bytes: int  # 封面 HTML 磁盘缓存上限
+    png_cache_bytes: int  # 封面截图磁盘缓存上限
+
+
+@dataclass(frozen=True)
+class AppConfig:
+    openai: Endpoint
+    gpt4o_model: str
+    jimeng_model: str
+    cover: CoverConfig
+    gemini: Endpoint
+    gemini_model: str
+    grok_image: Endpoint
+    grok_image_model: str
+    grok_image_edit_model: str
+    grok_video: Endpoint
+    grok_video_model: str
+    grok_video_callback_field: str
+    mondo: Endpoint
+    mondo_image_model: str
+    mondo_text_model: str
+    text2image: Text2ImageConfig
+    fal_key: str
+    fal_queue_url: str
+    aichart_flowise_url: str
+    aichart_engine: str
+    aichart: Endpoint
+    aichart_model: str
+    chart_render_workers: int
+    aichart_concurrency: int
+    translate_proxy: str
+    translate_engine: str
+    translate: Endpoint
+    translate_model: str
+    translate_cache_size: int
+    translate_disk_cache_size: int
+    provider_limits: Mapping[str, tuple[int, float]]
+    default_provider_limit: tuple[int, float]
+    tenant_weights: Mapping[str, float]
+    quota_tenant_weight: float
+    webhook_base_url: str
+    webhook_secret: str
+    disconnect_grace_seconds: float
+    job_abandon_seconds: float
+    trace_export: str
+    trace_file: str
+    trace_file_max_bytes: int
+    trace_otlp_url: str
+    loop_monitor: bool
+    loop_block_threshold: float
+    ws_stats: bool
+    ws_stats_report_seconds: float
+    debug_token: str
+    heap_trace_frames: int
+    session_ttl_seconds: float
+    session_memory_bytes: int
+
+
+def _parse_text2image(env: Mapping[str, str]) -> Text2ImageConfig:
+    default_model = env.get("TEXT2IMAGE_MODEL", "gpt-4o-image")
+    models = [item.strip() for item in env.get("TEXT2IMAGE_MODELS", default_model).split(",") if item.strip()]
+    if not models:
+        models = [default_model]
+    if default_model not in models:
+        models.insert(0, default_model)
+
+    model_counts = {}
+    counts = [item.strip() for item in env.get("TEXT2IMAGE_N", "1").split(",") if item.strip()] or ["1"]
+    for index, model in enumerate(models):
+        count_value = counts[index] if index < len(counts) else counts[0]
+        try:
+            parsed_count = int(count_value)
+        except ValueError:
+            parsed_count = 1
+        model_counts[model] = str(max(parsed_count, 1))
+
+    size_options = parse_size_options(env.get("TEXT2IMAGE_SIZES", TEXT2IMAGE_DEFAULT_SIZES))
+    if not size_options:
+        size_options = parse_size_options(TEXT2IMAGE_DEFAULT_SIZES)
+
+    return Text2ImageConfig(
+        endpoint=Endpoint(env.get("TEXT2IMAGE_OPENAI_BASE_URL", ""), env.get("TEXT2IMAGE_OPENAI_API_KEY", "")),
+        models=tuple(models),
+        model_counts=MappingProxyType(model_counts),
+        size_options=tuple(size_options),
+        title=env.get("TEXT2IMAGE_TITLE", "通用文生图生成器")[:60],
+    )
+
+
+def _parse_cover(env: Mapping[str, str]) -> CoverConfig:
+    cover_model = env.get('COVER_MODEL', '')
+    models = [model for model in cover_model.split(',') if model] if cover_model else []
+    counts = env.get('COVER_COUNT', '1').split(',')
+    model_counts = {}
+    for index, model in enumerate(models):
+        try:
+            model_counts[model] = int(counts[index]) if index < len(counts) else 1
+        except ValueError:
+            model_counts[model] = 1
+    return CoverConfig(
+        endpoint=Endpoint(env.get('COVER_OPENAI_BASE_URL', env.get('OPENAI_BASE_URL', '')),
+                          env.get('COVER_OPENAI_API_KEY', env.get('OPENAI_API_KEY', ''))),
+        models=tuple(models),
+        model_counts=MappingProxyType(model_counts),
+        screen_base_url=env.get('SCREEN_BASE_URL', 'http://10.8.0.2:14140'),
+        html_cache_bytes=int(float(env.get('COVER_HTML_CACHE_MB', '64')) * 1024 * 1024),
+        png_cache_bytes=int(float(env.get('COVER_PNG_CACHE_MB', '512')) * 1024 * 1024),
+    )
+
+
+def parse_config(env: Mapping[str, str]) -> AppConfig:
+    grok_image = Endpoint(env.get('GROK_IMAGE_OPENAI_BASE_URL', ''), env.get('GROK_IMAGE_OPENAI_API_KEY', ''))
+    return AppConfig(
+        openai=Endpoint(env.get('OPENAI_BASE_URL', ''), env.get('OPENAI_API_KEY', '')),
+        gpt4o_model=env.get('GPT4O_MODEL', 'gpt-4o-image'),
+        jimeng_model=env.get('JIMENG_MODEL', 'jimeng'),
+        cover=_parse_cover(env),
+        gemini=Endpoint(env.get('GEMINI_IMAGE_OPENAI_BASE_URL', ''), env.get('GEMINI_IMAGE_OPENAI_API_KEY', '')),
+        gemini_model=env.get('GEMINI_IMAGE_COVER_MODEL', ''),
+        grok_image=grok_image,
+        grok_image_model=env.get('GROK_IMAGE_IMAGE_MODEL', ''),
+        grok_image_edit_model=env.get('GROK_IMAGE_IMAGE_EDIT_MODEL', ''),
+        grok_video=Endpoint(env.get('GROK_VIDEO_BASE_URL', grok_image.base_url),
+                            env.get('GROK_VIDEO_API_KEY', grok_image.api_key)),
+        grok_video_model=env.get('GROK_VIDEO_MODEL', 'grok-imagine-1.0-video'),
+        grok_video_callback_field=env.get('GROK_VIDEO_CALLBACK_FIELD', ''),
+        mondo=Endpoint(env.get('MONDO_OPENAI_BASE_URL', ''), env.get('MONDO_OPENAI_API_KEY', '')),
+        mondo_image_model=env.get('MONDO_IMAGE_MODEL', ''),
+        mondo_text_model=env.get('MONDO_TEXT_MODEL', ''),
+        text2image=_parse_text2image(env),
+        fal_key=env.get('FAL_KEY', ''),
+        fal_queue_url=env.get('FAL_QUEUE_URL', 'https://queue.fal.run').rstrip('/'),
+        aichart_flowise_url=env.get('AICHART_FLOWISE_URL', ''),
+        aichart_engine=env.get('AICHART_ENGINE', 'local').strip().lower(),
+        aichart=Endpoint(env.get('AICHART_OPENAI_BASE_URL') or env.get('OPENAI_BASE_URL', ''),
+                         env.get('AICHART_OPENAI_API_KEY') or env.get('OPENAI_API_KEY', '')),
+        aichart_model=env.get('AICHART_MODEL', 'gpt-4o-mini'),
+        chart_render_workers=max(int(env.get('CHART_RENDER_WORKERS', '2')), 1),
+        aichart_concurrency=max(int(env.get('AICHART_CONCURRENCY', '3')), 1),
+        translate_proxy=env.get('translate_proxy', ''),
+        translate_engine=env.get('TRANSLATE_ENGINE', 'google').strip().lower(),
+        translate=Endpoint(env.get('TRANSLATE_OPENAI_BASE_URL') or env.get('OPENAI_BASE_URL', ''),
+                           env.get('TRANSLATE_OPENAI_API_KEY') or env.get('OPENAI_API_KEY', '')),
+        translate_model=env.get('TRANSLATE_MODEL', 'gpt-4o-mini'),
+        translate_cache_size=int(env.get('TRANSLATE_CACHE_SIZE', '1024')),
+        translate_disk_cache_size=max(int(env.get('TRANSLATE_DISK_CACHE_SIZE', '100000')), 1),
+        provider_limits=MappingProxyType(parse_provider_limits(env.get('PROVIDER_LIMITS', ''))),
+        default_provider_limit=(max(int(env.get('PROVIDER_DEFAULT_CONCURRENCY', '4')), 1),
+                                float(env.get('PROVIDER_DEFAULT_RPM', '0'))),
+        tenant_weights=MappingProxyType(parse_tenant_weights(env.get('TENANT_WEIGHTS', ''))),
+        quota_tenant_weight=float(env.get('QUOTA_TENANT_WEIGHT', '2')),
+        webhook_base_url=env.get('WEBHOOK_BASE_URL', '').rstrip('/'),
+        webhook_secret=env.get('WEBHOOK_SECRET', ''),
+        disconnect_grace_seconds=float(env.get('DISCONNECT_GRACE_SECONDS', '30')),
+        job_abandon_seconds=float(env.get('JOB_ABANDON_SECONDS', '600')),
+        trace_export=env.get('TRACE_EXPORT', 'jsonl').strip().lower(),
+        trace_file=env.get('TRACE_FILE', ''),
+        trace_file_max_bytes=int(float(env.get('TRACE_FILE_MAX_MB', '50')) * 1024 * 1024),
+        trace_otlp_url=env.get('TRACE_OTLP_URL', 'http://localhost:4318/v1/traces'),
+        loop_monitor=env.get('LOOP_MONITOR', '').strip().lower() in ('1', 'true', 'yes', 'on'),
+        loop_block_threshold=float(env.get('LOOP_BLOCK_THRESHOLD_MS', '100')) / 1000,
+        ws_stats=env.get('WS_STATS', '').strip().lower() in ('1', 'true', 'yes', 'on'),
+        ws_stats_report_seconds=max(float(env.get('WS_STATS_REPORT_SECONDS', '300')), 1),
+        debug_token=env.get('DEBUG_TOKEN', ''),
+        heap_trace_frames=int(env.get('HEAP_TRACE_FRAMES', '0')),
+        session_ttl_seconds=float(env.get('SESSION_TTL_SECONDS', '7200')),
+        session_memory_bytes=int(float(env.get('SESSION_MEMORY_MB', '1024')) * 1024 * 1024),
+    )
+
+
+_current: AppConfig | None = None
+_listeners: list[Callable[[AppConfig], None]] = []
+
+
+def get_config() -> AppConfig:
+    """当前配置快照；快照不可变，读取方无需加锁"""
+    global _current
+    if _current is None:
+        _current = parse_config(os.environ)
+    return _current
+
+
+def on_reload(callback: Callable[[AppConfig], None]):
+    """注册配置重载后的回调（例如调整已创建的限流器）"""
+    _listeners.append(callback)
+
+
+def env_file() -> str:
+    return os.getenv('ENV_FILE', '.env')
+
+
+def _read_env_file() -> dict[str, str]:
+    if not os.path.exists(env_file()):
+        return {}
+    return {key: value for key, value in dotenv.dotenv_values(env_file()).items() if value is not None}
+
+
+# 启动时由 load_dotenv 复制到 os.environ 的 .env 内容（load_dotenv 在本模块导入之后执行，读到的是同一份文件）；
+# 重载不修改 os.environ，因此与之相同的环境变量始终视为来自文件
+_startup_file_values = _read_env_file()
+
+
+def reload_config() -> AppConfig:
+    """重新读取 .env 并替换配置快照，解析失败时保留旧快照。
+    与启动时的优先级一致：真实环境变量优先于 .env；启动时从 .env 加载的变量以文件当前内容为准，
+    因而 .env 中修改或删除的配置能够生效"""
+    global _current
+    process_env = {key: value for key, value in os.environ.items() if _startup_file_values.get(key) != value}
+    env = {**_read_env_file(), **process_env}
+    try:
+        config = parse_config(env)
+    except Exception:
+        traceback.print_exc()
+        return get_config()
+    _current = config
+    for callback in _listeners:
+        try:
+            callback(config)
+        except Exception:
+            traceback.print_exc()
+    print("[配置] 已重新加载")
+    return config
+
+
+async def watch_config(interval: float = 2.0):
+    """应用生命周期任务：监听 SIGHUP 信号和 .env 文件修改时间，触发配置重载"""
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGHUP, reload_config)
+    except (NotImplementedError, RuntimeError, AttributeError):
+        # Windows 或非主线程中无法注册信号，仅依靠文件监听
+        pass
+
+    def mtime() -> float:
+        try:
+            return os.path.getmtime(env_file())
+        except OSError:
+            return 0.0
+
+    last_mtime = mtime()
+    while True:
+        await asyncio.sleep(interval)
+        current_mtime = mtime()
+        if current_mtime != last_mtime:
+            last_mtime = current_mtime
+            reload_config()
@@ -0,0 +1,43 @@
+# 调试接口（/debug/*）与指标接口 /metrics 的访问控制：未配置 DEBUG_TOKEN 时一律返回 404，
+# 请求需通过 ?token= 或 Authorization: Bearer 携带该令牌
+import functools
+import hmac
+
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from image_gen_page.tool.config import get_config
+
+
+def _request_token(request: Request) -> str:
+    authorization = request.headers.get('authorization', '')
+    if authorization.lower().startswith('bearer '):
+        return authorization[7:].strip()
+    return request.query_params.get('token', '')
+
+
+def int_param(request: Request, name: str, default: int, maximum: int = 1000) -> int:
+    """读取 1~maximum 之间的整数查询参数，格式错误或越界时抛出 ValueError"""
+    value = request.query_params.get(name, str(default))
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"{name} 必须是整数") from None
+    if not 1 <= number <= maximum:
+        raise ValueError(f"{name} 必须在 1~{maximum} 之间")
+    return number
+
+
+def debug_route(endpoint):
+    """调试路由装饰器：校验 DEBUG_TOKEN"""
+
+    @functools.wraps(endpoint)
+    async def wrapper(request: Request):
+        expected = get_config().debug_token
+        if not expected:
+            return JSONResponse({'error': 'not found'}, status_code=404)
+        if not hmac.compare_digest(_request_token(request), expected):
+            return JSONResponse({'error': 'invalid token'}, status_code=403)
+        return await endpoint(request)
+
+    return wrapper
@@ -0,0 +1,82 @@
+# 带容量上限的磁盘缓存：每个条目一个文件，按最近访问时间（文件修改时间）淘汰
+# 多个 worker 进程可共享同一目录，写入先写临时文件再原子替换
+import asyncio
+import hashlib
+import json
+import os
+import uuid
+from pathlib import Path
+
+from image_gen_page.tool.metrics import cache_result
+
+
+def cache_key(*parts) -> str:
+    """由任意可 JSON 序列化的参数生成缓存键"""
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+
+
+class DiskCache:
+    def __init__(self, directory: Path, max_bytes: int, suffix: str = '', name: str = ''):
+        self.directory = Path(directory)
+        self.name = name or self.directory.name  # 指标中的缓存名称
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        # 本进程估计的缓存总大小，超出上限时重新扫描目录并淘汰
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}{self.suffix}"
+
+    def _entries(self):
+        for path in self.directory.glob(f"*/*{self.suffix}"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            yield path, stat.st_size, stat.st_mtime
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            # 更新修改时间，作为最近访问时间
+            os.utime(path)
+        except OSError:
+            cache_result(self.name, False)
+            return None
+        cache_result(self.name, True)
+        return data
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_name(f".{uuid.uuid4().hex}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        self._size += len(data)
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        """按最近访问时间从旧到新删除，直到总大小降到上限的 90%"""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                continue
+        self._size = total
+
+    async def aget(self, key: str) -> bytes | None:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, data: bytes):
+        await asyncio.to_thread(self.put, key, data)
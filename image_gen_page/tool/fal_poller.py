@@ -0,0 +1,183 @@
+# fal 队列任务的共享轮询服务：所有进行中的 fal 任务由同一个后台协程统一查询状态接口
+# 轮询间隔根据历史完成耗时自适应：远未到预计完成时间时稀疏查询，临近时密集查询，超时后指数退避
+import asyncio
+import contextvars
+import time
+import traceback
+
+import aiohttp
+
+from image_gen_page.tool.config import get_config
+from image_gen_page.tool.metrics import client_session
+from image_gen_page.tool.tracing import span
+
+MIN_INTERVAL = 0.25  # 临近预计完成时的查询间隔（秒）
+MAX_INTERVAL = 5.0  # 最长查询间隔（秒）
+DEFAULT_EXPECTED_SECONDS = 15  # 没有历史数据时假定的完成耗时
+MAX_ERRORS = 5  # 状态接口连续出错次数上限
+FALLBACK_INTERVAL = 15.0  # 已注册完成回调的任务，轮询仅作兜底时的查询间隔（秒）
+
+
+def status_url_of(response_url: str) -> str:
+    """fal 队列的状态接口地址为结果地址加 /status"""
+    return response_url.rstrip('/') + '/status'
+
+
+class _Tracked:
+    def __init__(self, response_url: str, status_url: str, timeout: float, fallback: bool):
+        self.response_url = response_url
+        self.status_url = status_url or status_url_of(response_url)
+        self.started_at = time.monotonic()
+        self.deadline = self.started_at + timeout
+        self.next_poll_at = self.started_at
+        self.status = 'IN_QUEUE'
+        self.overdue_polls = 0
+        self.errors = 0
+        self.waiters = 0
+        self.fallback = fallback
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # 等待方被取消时 shield 内的 future 可能无人读取，标记异常已读取，避免 "exception was never retrieved" 日志
+        self.future.add_done_callback(lambda future: future.cancelled() or future.exception())
+
+    def fail(self, error: Exception):
+        """任务失败；已结束或已没有等待方时忽略"""
+        if not self.future.done() and self.waiters > 0:
+            self.future.set_exception(error)
+
+
+class FalPoller:
+    """统一轮询所有进行中的 fal 任务，每个任务通过 future 获取结果"""
+
+    def __init__(self):
+        self._tracked: dict[str, _Tracked] = {}
+        self._task: asyncio.Task | None = None
+        self._wakeup: asyncio.Event | None = None
+        # 提交到完成耗时的指数滑动平均，用于安排下一次查询时间
+        self.expected_seconds = DEFAULT_EXPECTED_SECONDS
+
+    async def wait(self, response_url: str, status_url: str = '', timeout: float = 300,
+                   fallback: bool = False) -> dict:
+        """等待任务完成并返回结果数据；同一任务被多次等待时共享一次轮询。
+        fallback=True 表示已注册完成回调，轮询只作兜底，使用较长的固定间隔"""
+        tracked = self._tracked.get(response_url)
+        if tracked is None:
+            tracked = _Tracked(response_url, status_url, timeout, fallback)
+            self._tracked[response_url] = tracked
+            self._ensure_running()
+        tracked.waiters += 1
+        try:
+            with span('fal.poll', fallback=fallback, shared=tracked.waiters > 1):
+                # shield：单个等待方被取消时不影响其他等待同一任务的协程；
+                # 超时在这里兜底，即使轮询协程意外停止也不会无限等待
+                remaining = max(tracked.deadline - time.monotonic(), 0)
+                try:
+                    return await asyncio.wait_for(asyncio.shield(tracked.future), timeout=remaining)
+                except asyncio.TimeoutError:
+                    raise Exception("等待超时，未能获取到图像数据") from None
+        finally:
+            tracked.waiters -= 1
+            if tracked.waiters == 0:
+                # 没有等待方后停止跟踪，已无人关心的任务不再轮询
+                self._tracked.pop(response_url, None)
+                if not tracked.future.done():
+                    tracked.future.cancel()
+
+    def tracked_count(self) -> int:
+        return len(self._tracked)
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            # 轮询循环在空白上下文中运行，其请求不归属于首个等待方的追踪
+            self._task = asyncio.get_running_loop().create_task(self._run(), context=contextvars.Context())
+        else:
+            self._wakeup.set()
+
+    def _next_delay(self, tracked: _Tracked, now: float) -> float:
+        elapsed = now - tracked.started_at
+        if tracked.fallback:
+            return FALLBACK_INTERVAL
+        if tracked.status == 'IN_QUEUE':
+            # 仍在排队，离开始生成还早
+            return min(max(self.expected_seconds / 3, MIN_INTERVAL), MAX_INTERVAL)
+        remaining = self.expected_seconds - elapsed
+        if remaining > 0:
+            # 每次把剩余时间减半，越接近预计完成查询越密集
+            return min(max(remaining / 2, MIN_INTERVAL), MAX_INTERVAL)
+        tracked.overdue_polls += 1
+        return min(MIN_INTERVAL * 2 ** tracked.overdue_polls, MAX_INTERVAL)
+
+    async def _run(self):
+        headers = {'Authorization': 'Key ' + get_config().fal_key}
+        # 关闭会话期间可能有新任务加入（此时 _task 尚未结束，_ensure_running 只会唤醒），
+        # 关闭后重新检查，仍有任务则继续轮询；检查与返回之间没有 await，不会再遗漏
+        while self._pending():
+            async with client_session(headers=headers) as session:
+                await self._poll_all(session)
+
+    def _pending(self) -> bool:
+        return any(not tracked.future.done() for tracked in self._tracked.values())
+
+    async def _poll_all(self, session: aiohttp.ClientSession):
+        while self._tracked:
+            now = time.monotonic()
+            due = [tracked for tracked in self._tracked.values()
+                   if tracked.next_poll_at <= now and not tracked.future.done()]
+            if due:
+                await asyncio.gather(*(self._poll(session, tracked) for tracked in due))
+                continue
+            # 没有任务到期时休眠到最近的查询时间，新任务加入时提前唤醒
+            pending = [tracked.next_poll_at for tracked in self._tracked.values() if not tracked.future.done()]
+            if not pending:
+                break
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(min(pending) - now, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, session: aiohttp.ClientSession, tracked: _Tracked):
+        now = time.monotonic()
+        try:
+            if now > tracked.deadline:
+                raise Exception("等待超时，未能获取到图像数据")
+            async with session.get(tracked.status_url) as response:
+                if response.status not in (200, 202):
+                    raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                      status=response.status, message=await response.text())
+                data = await response.json()
+            tracked.errors = 0
+            tracked.status = data.get('status', tracked.status)
+            if tracked.status == 'COMPLETED':
+                async with session.get(tracked.response_url) as response:
+                    result = await response.json()
+                if result.get('detail') and not result.get('images'):
+                    raise Exception(f"{response.status}-{result['detail']}")
+                duration = time.monotonic() - tracked.started_at
+                self.expected_seconds = self.expected_seconds * 0.8 + duration * 0.2
+                if not tracked.future.done():
+                    tracked.future.set_result(result)
+                return
+        except aiohttp.ClientError as e:
+            # 网络抖动时继续重试，连续失败多次才放弃
+            tracked.errors += 1
+            if tracked.errors < MAX_ERRORS:
+                tracked.next_poll_at = time.monotonic() + MAX_INTERVAL
+                return
+            traceback.print_exc()
+            tracked.fail(Exception(f"查询任务状态失败：{e}"))
+            return
+        except Exception as e:
+            tracked.fail(e)
+            return
+        tracked.next_poll_at = time.monotonic() + self._next_delay(tracked, time.monotonic())
+
+
+_poller: FalPoller | None = None
+
+
+def get_fal_poller() -> FalPoller:
+    global _poller
+    if _poller is None:
+        _poller = FalPoller()
+    return _poller
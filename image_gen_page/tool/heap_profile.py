@@ -0,0 +1,140 @@
+# 堆内存分析：/debug/heap 对比当前与基线的 tracemalloc 快照（按模块、代码行或调用栈分组），
+# 并统计存活的状态实例、aiohttp 会话等对象数量，用于在线上确认内存增长来源。
+# HEAP_TRACE_FRAMES>0 时进程启动即开始追踪，否则在首次请求时开始（追踪期间内存分配会变慢）
+import asyncio
+import collections
+import gc
+import sys
+import time
+import tracemalloc
+
+import aiohttp
+from reflex.state import BaseState
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from image_gen_page.tool.config import get_config
+from image_gen_page.tool.debug import debug_route, int_param
+
+GROUPS = ('filename', 'lineno', 'traceback')
+_PATH_PREFIXES = sorted({path.rstrip('/') + '/' for path in sys.path if path}, key=len, reverse=True)
+
+
+def _short(filename: str) -> str:
+    """去掉 sys.path 前缀，便于阅读"""
+    for prefix in _PATH_PREFIXES:
+        if filename.startswith(prefix):
+            return filename[len(prefix):]
+    return filename
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    ))
+
+
+class HeapProfiler:
+    def __init__(self):
+        self.baseline: tracemalloc.Snapshot | None = None
+        self.baseline_at = 0.0
+
+    def start(self, frames: int = 1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(max(frames, 1))
+        self.reset()
+
+    def stop(self):
+        tracemalloc.stop()
+        self.baseline = None
+
+    def reset(self, snapshot: tracemalloc.Snapshot | None = None):
+        self.baseline = snapshot or _snapshot()
+        self.baseline_at = time.time()
+
+    def diff(self, group: str = 'lineno', limit: int = 30, reset: bool = False) -> dict:
+        """与基线对比，按增长量排序；reset=True 时把当前快照作为新的基线"""
+        snapshot = _snapshot()
+        stats = snapshot.compare_to(self.baseline, group)
+        current, peak = tracemalloc.get_traced_memory()
+        result = {
+            'traced_mb': round(current / 1024 / 1024, 2),
+            'peak_mb': round(peak / 1024 / 1024, 2),
+            'baseline_age_seconds': round(time.time() - self.baseline_at),
+            'top': [{
+                'where': ' <- '.join(f"{_short(frame.filename)}:{frame.lineno}" for frame in reversed(stat.traceback))
+                if group != 'filename' else _short(stat.traceback[0].filename),
+                'size_kb': round(stat.size / 1024, 1),
+                'size_diff_kb': round(stat.size_diff / 1024, 1),
+                'count': stat.count,
+                'count_diff': stat.count_diff,
+            } for stat in stats[:limit]],
+        }
+        if reset:
+            self.reset(snapshot)
+        return result
+
+
+def live_objects(limit: int = 30) -> dict:
+    """gc 跟踪的存活对象：各状态类实例数、aiohttp 会话数与数量最多的类型"""
+    types = collections.Counter()
+    states = collections.Counter()
+    client_sessions = {'open': 0, 'closed': 0}
+    for obj in gc.get_objects():
+        cls = type(obj)
+        types[f"{cls.__module__}.{cls.__qualname__}"] += 1
+        if isinstance(obj, BaseState):
+            states[cls.__name__] += 1
+        elif isinstance(obj, aiohttp.ClientSession):
+            client_sessions['closed' if obj.closed else 'open'] += 1
+    return {
+        'states': dict(states.most_common()),
+        'client_sessions': client_sessions,
+        'types': dict(types.most_common(limit)),
+    }
+
+
+_profiler: HeapProfiler | None = None
+
+
+def get_heap_profiler() -> HeapProfiler:
+    global _profiler
+    if _profiler is None:
+        _profiler = HeapProfiler()
+    return _profiler
+
+
+async def trace_heap():
+    """应用生命周期任务：HEAP_TRACE_FRAMES>0 时启动即开始追踪，基线为启动时的快照"""
+    frames = get_config().heap_trace_frames
+    if frames > 0:
+        get_heap_profiler().start(frames)
+
+
+@debug_route
+async def endpoint(request: Request):
+    """堆内存分析：GET /debug/heap?group=lineno&limit=30&reset=1；stop=1 停止追踪"""
+    params = request.query_params
+    group = params.get('group', 'lineno')
+    if group not in GROUPS:
+        return JSONResponse({'error': f"group 只能是 {', '.join(GROUPS)}"}, status_code=400)
+    try:
+        limit = int_param(request, 'limit', 30)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    profiler = get_heap_profiler()
+    if params.get('stop'):
+        profiler.stop()
+        return JSONResponse({'tracing': False})
+    # 快照与对比耗时较长，放到线程中执行，避免长时间阻塞事件循环
+    if not tracemalloc.is_tracing() or profiler.baseline is None:
+        await asyncio.to_thread(profiler.start, get_config().heap_trace_frames)
+        result = {'tracing': True, 'started': True}
+    else:
+        result = {'tracing': True, **await asyncio.to_thread(profiler.diff, group, limit, bool(params.get('reset')))}
+    result['tasks'] = len(asyncio.all_tasks())
+    result.update(await asyncio.to_thread(live_objects, limit))
+    return JSONResponse(result)
@@ -0,0 +1,355 @@
+# 持久化生成任务队列：任务存储在 SQLite 中，由后台 worker 池执行，与浏览器 websocket 会话解耦
+# 页面提交任务后只保存任务ID，刷新或断线重连后可凭任务ID重新订阅进度与结果
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import traceback
+import uuid
+
+from image_gen_page.tool.common_tool import get_data_dir
+from image_gen_page.tool.tracing import current_span, span
+
+TERMINAL_STATUSES = ('done', 'failed', 'cancelled')
+
+# 任务类型 -> 处理函数，处理函数签名为 async def handler(job: Job) -> dict
+_handlers = {}
+
+
+def register_job_handler(kind: str):
+    """注册任务处理函数的装饰器，页面模块导入时调用"""
+
+    def decorator(handler):
+        _handlers[kind] = handler
+        return handler
+
+    return decorator
+
+
+class Job:
+    """worker 执行任务时传给处理函数的上下文"""
+
+    def __init__(self, queue: "JobQueue", row: dict):
+        self.queue = queue
+        self.id = row['id']
+        self.kind = row['kind']
+        # 提交任务的会话，用于公平调度
+        self.owner = row['owner']
+        self.payload = row['payload']
+        # 断点数据，worker 重启后重新执行时可据此恢复（例如已创建的远端任务ID）
+        self.checkpoint = row['checkpoint']
+        self.attempts = row['attempts']
+
+    async def progress(self, progress: float | None = None, message: str | None = None, **checkpoint):
+        """更新任务进度、提示信息和断点数据"""
+        self.checkpoint.update(checkpoint)
+        await self.queue.update_progress(self.id, progress, message, self.checkpoint if checkpoint else None)
+
+    async def is_cancelled(self) -> bool:
+        """任务是否已被用户取消，处理函数可据此决定是否清理远端任务"""
+        return await asyncio.to_thread(self.queue._status, self.id) == 'cancelled'
+
+
+class JobQueue:
+    """基于 SQLite 的任务队列，多个 worker 进程通过租约抢占任务"""
+
+    def __init__(self, path: str, workers: int = 4, lease_seconds: float = 60, max_attempts: int = 3,
+                 retention_seconds: float = 86400):
+        self.path = path
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self._tasks: list[asyncio.Task] = []
+        self._loop = None
+        self._wakeup: asyncio.Event | None = None
+        self._changed: asyncio.Event | None = None
+        self._last_purge = 0.0
+        # 本进程内正在执行的任务ID -> 处理函数所在的 asyncio.Task，用于取消
+        self._running: dict[str, asyncio.Task] = {}
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    owner TEXT NOT NULL DEFAULT '',
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    progress REAL NOT NULL DEFAULT 0,
+                    message TEXT NOT NULL DEFAULT '',
+                    checkpoint TEXT NOT NULL DEFAULT '{}',
+                    result TEXT,
+                    error TEXT NOT NULL DEFAULT '',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    lease_until REAL NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['checkpoint'] = json.loads(job['checkpoint'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    # ---------- 同步的数据库操作（在线程中执行，避免阻塞事件循环） ----------
+
+    def _insert(self, job_id: str, kind: str, payload: dict, owner: str):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, owner, payload, status, message, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'queued', '排队中', ?, ?)",
+                (job_id, kind, owner, json.dumps(payload, ensure_ascii=False), now, now),
+            )
+
+    def _select(self, job_id: str) -> dict | None:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def _claim(self, kinds: list[str]) -> dict | None:
+        """抢占一个排队中（或租约已过期）的任务"""
+        if not kinds:
+            return None
+        now = time.time()
+        placeholders = ','.join('?' * len(kinds))
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                f"SELECT * FROM jobs WHERE kind IN ({placeholders}) "
+                "AND (status = 'queued' OR (status = 'running' AND lease_until < ?)) "
+                "ORDER BY created_at LIMIT 1",
+                (*kinds, now),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, updated_at = ? "
+                "WHERE id = ?",
+                (now + self.lease_seconds, now, row['id']),
+            )
+            conn.execute("COMMIT")
+            job = self._to_dict(row)
+            job['attempts'] += 1
+            return job
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _update(self, job_id: str, only_running: bool = False, **fields):
+        """only_running=True 用于写入结束状态：任务已被取消（或已被其他 worker 结束）时不覆盖"""
+        fields['updated_at'] = time.time()
+        for key in ('checkpoint', 'result'):
+            if key in fields and fields[key] is not None:
+                fields[key] = json.dumps(fields[key], ensure_ascii=False)
+        assignments = ', '.join(f"{key} = ?" for key in fields)
+        condition = " AND status = 'running'" if only_running else ""
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?{condition}", (*fields.values(), job_id))
+
+    def _mark_cancelled(self, job_id: str, owner: str | None = None) -> bool:
+        owner_clause = " AND owner = ?" if owner is not None else ""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'cancelled', message = '已取消', updated_at = ? "
+                f"WHERE id = ? AND status IN ('queued', 'running'){owner_clause}",
+                (time.time(), job_id, *((owner,) if owner is not None else ())),
+            )
+        return cursor.rowcount > 0
+
+    def _status(self, job_id: str) -> str:
+        with self._connect() as conn:
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row['status'] if row else ''
+
+    def status_counts(self) -> dict[str, int]:
+        """各状态的任务数（同步方法，用于输出指标）"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status").fetchall()
+        return {row['status']: row['count'] for row in rows}
+
+    def _purge(self):
+        now = time.time()
+        if now - self._last_purge < 600:
+            return
+        self._last_purge = now
+        placeholders = ','.join('?' * len(TERMINAL_STATUSES))
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM jobs WHERE status IN ({placeholders}) AND updated_at < ?",
+                         (*TERMINAL_STATUSES, now - self.retention_seconds))
+
+    # ---------- 异步接口 ----------
+
+    def _notify(self):
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = asyncio.Event()
+
+    async def submit(self, kind: str, payload: dict, owner: str = '') -> str:
+        """提交任务，返回任务ID"""
+        self.ensure_started()
+        job_id = uuid.uuid4().hex
+        current = current_span()
+        if current is not None:
+            # 任务在 worker 中执行时接续提交方的追踪
+            payload = {**payload, '_traceparent': current.traceparent}
+        await asyncio.to_thread(self._insert, job_id, kind, payload, owner)
+        self._wakeup.set()
+        return job_id
+
+    async def get(self, job_id: str) -> dict | None:
+        return await asyncio.to_thread(self._select, job_id)
+
+    async def update_progress(self, job_id: str, progress: float | None = None, message: str | None = None,
+                              checkpoint: dict | None = None):
+        fields = {}
+        if progress is not None:
+            fields['progress'] = progress
+        if message is not None:
+            fields['message'] = message
+        if checkpoint is not None:
+            fields['checkpoint'] = checkpoint
+        if fields:
+            await asyncio.to_thread(self._update, job_id, **fields)
+            self._notify()
+
+    async def cancel(self, job_id: str, owner: str | None = None) -> bool:
+        """取消排队中或执行中的任务；本进程内执行的任务立即中断，其他进程的任务在下次续租时中断。
+        指定 owner 时只取消该会话提交的任务（任务ID保存在浏览器中，不能信任）"""
+        cancelled = await asyncio.to_thread(self._mark_cancelled, job_id, owner)
+        task = self._running.get(job_id)
+        if cancelled and task is not None:
+            task.cancel()
+        self._notify()
+        return cancelled
+
+    async def watch(self, job_id: str, interval: float = 1.0, owner: str | None = None):
+        """订阅任务状态：每次变化时产出任务快照，任务结束（或不存在）后停止；
+        指定 owner 时其他会话提交的任务视为不存在"""
+        self.ensure_started()
+        last_updated = None
+        while True:
+            changed = self._changed
+            job = await self.get(job_id)
+            if job is None or (owner is not None and job['owner'] != owner):
+                return
+            if job['updated_at'] != last_updated:
+                last_updated = job['updated_at']
+                yield job
+            if job['status'] in TERMINAL_STATUSES:
+                return
+            # 本进程内的更新会立即唤醒，其他进程的更新依靠定时轮询发现
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    # ---------- worker 池 ----------
+
+    def ensure_started(self):
+        """在当前事件循环中启动 worker（已启动则忽略）"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and any(not task.done() for task in self._tasks):
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._changed = asyncio.Event()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def serve(self):
+        """作为应用生命周期任务运行，进程启动后立即恢复未完成的任务"""
+        self.ensure_started()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _worker(self):
+        while True:
+            try:
+                await asyncio.to_thread(self._purge)
+                job = await asyncio.to_thread(self._claim, list(_handlers))
+            except Exception:
+                traceback.print_exc()
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=2)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(job)
+            except Exception:
+                # 数据库写入失败等意外错误不能让 worker 退出，任务租约过期后会被重新领取
+                traceback.print_exc()
+
+    async def _heartbeat(self, job_id: str, task: asyncio.Task):
+        """任务执行期间定期续租，防止被其他 worker 当作失联任务抢走；发现任务已被取消时中断处理函数"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if await asyncio.to_thread(self._status, job_id) == 'cancelled':
+                task.cancel()
+                return
+            await asyncio.to_thread(self._update, job_id, lease_until=time.time() + self.lease_seconds)
+
+    async def _run(self, row: dict):
+        job_id = row['id']
+        self._notify()
+        if row['attempts'] > self.max_attempts:
+            await asyncio.to_thread(self._update, job_id, only_running=True, status='failed',
+                                    error='任务多次执行中断，已放弃')
+            self._notify()
+            return
+        with span(f"job.{row['kind']}", parent=row['payload'].get('_traceparent'), job_id=job_id,
+                  attempt=row['attempts']) as current:
+            # 处理函数在本 span 的上下文中运行，其内部阶段都挂在此任务下
+            task = asyncio.create_task(_handlers[row['kind']](Job(self, row)))
+            self._running[job_id] = task
+            heartbeat = asyncio.create_task(self._heartbeat(job_id, task))
+            try:
+                result = await task
+                await asyncio.to_thread(self._update, job_id, only_running=True, status='done', progress=100,
+                                        message='已完成', result=result or {})
+            except asyncio.CancelledError:
+                if task.cancelled() and not asyncio.current_task().cancelling():
+                    # 用户取消：任务已标记为 cancelled，worker 继续处理下一个任务
+                    current.set(cancelled=True)
+                    return
+                # 进程退出时保持 running 状态，租约过期后由新的 worker 接手
+                raise
+            except Exception as e:
+                traceback.print_exc()
+                current.error = f"{type(e).__name__}: {e}"[:500]
+                await asyncio.to_thread(self._update, job_id, only_running=True, status='failed', message='失败',
+                                        error=str(e))
+            finally:
+                heartbeat.cancel()
+                self._running.pop(job_id, None)
+                self._notify()
+
+
+_queue: JobQueue | None = None
+
+
+def get_job_queue() -> JobQueue:
+    global _queue
+    if _queue is None:
+        path = os.getenv('JOB_QUEUE_SQLITE_PATH') or str(get_data_dir() / 'jobs.sqlite3')
+        _queue = JobQueue(path, workers=int(os.getenv('JOB_WORKERS', '4')))
+    return _queue
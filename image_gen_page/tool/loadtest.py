@@ -0,0 +1,367 @@
+# 离线压测：在子进程中启动服务商模拟（provider_stub），把各页面的服务商地址指向它，
+# 再用大量并发的模拟会话直接驱动页面的 Reflex 事件处理函数，统计吞吐、p50/p99 耗时、事件循环延迟（含阻塞位置）与峰值内存，
+# 用于在上线前验证并发、限流、缓存等改动的效果
+# 用法：python -m image_gen_page.tool.loadtest --pages jimeng,cover,kontext --sessions 50 --iterations 3 \
+#           --latency 1 --latency-dist lognormal --error-rate 0.02
+# .env 中的调度相关配置（PROVIDER_LIMITS、TENANT_WEIGHTS 等）照常生效，服务商地址、密钥与模型会被替换为模拟服务
+import argparse
+import asyncio
+import contextlib
+import functools
+import importlib
+import inspect
+import json
+import os
+import re
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+import dotenv
+
+from image_gen_page.tool.config import env_file
+
+SAMPLE_UPLOAD = 'loadtest.png'
+
+
+@dataclass(frozen=True)
+class Scenario:
+    module: str  # 页面模块
+    state: str  # 状态类
+    handler: str  # 压测的事件处理函数
+    inputs: Callable  # (状态, 提示词) -> 提交前设置的状态变量
+    result: str  # 生成结果所在的状态变量，为空视为失败
+
+    def state_class(self):
+        return getattr(importlib.import_module(f'image_gen_page.pages.{self.module}'), self.state)
+
+
+SCENARIOS = {
+    'jimeng': Scenario('jimeng', 'JimengState', 'get_image', lambda state, prompt: {'prompt': prompt}, 'image_urls'),
+    'gpt4o': Scenario('gpt4o', 'Gpt4oState', 'get_image', lambda state, prompt: {'prompt': prompt}, 'image_urls'),
+    'cover': Scenario('cover', 'PageState', 'get_image', lambda state, prompt: {'prompt': prompt}, 'image_urls'),
+    'kontext': Scenario('kontext', 'KontextState', 'get_image',
+                        lambda state, prompt: {'prompt': prompt, 'upload_img': SAMPLE_UPLOAD}, 'image_urls'),
+    'geminiImage': Scenario('geminiImage', 'GeminiImageState', 'get_image',
+                            lambda state, prompt: {'text2img_prompt': prompt}, 'text2img_urls'),
+    'geminiImage_edit': Scenario('geminiImage', 'GeminiImageState', 'get_image',
+                                 lambda state, prompt: {'current_mode': 'img2img', 'img2img_prompt': prompt,
+                                                        'upload_imgs': [SAMPLE_UPLOAD]}, 'img2img_urls'),
+    'grokImage': Scenario('grokImage', 'GrokImageState', 'get_image',
+                          lambda state, prompt: {'text2img_prompt': prompt}, 'text2img_urls'),
+    'grokImage_edit': Scenario('grokImage', 'GrokImageState', 'get_image',
+                               lambda state, prompt: {'current_mode': 'img2img', 'img2img_prompt': prompt,
+                                                      'upload_imgs': [SAMPLE_UPLOAD]}, 'img2img_urls'),
+    'grokVideo': Scenario('grokVideo', 'GrokVideoState', 'generate_video', lambda state, prompt: {'prompt': prompt},
+                          'video_urls'),
+    'mondo': Scenario('mondo', 'MondoState', 'get_image', lambda state, prompt: {'prompt': prompt}, 'image_urls'),
+    'mondo_enhance': Scenario('mondo', 'MondoState', 'enhance_current_prompt', lambda state, prompt: {'prompt': prompt},
+                              'enhanced_prompt'),
+    # 一次提交三种图表，覆盖并发生成
+    'aichart': Scenario('aichart', 'AichartState', 'get_image',
+                        lambda state, prompt: {'prompt': prompt, 'chart_types': list(state.chart_type_options[:3])},
+                        'image_urls'),
+    'text2image': Scenario('text2image', 'Text2ImageState', 'get_image', lambda state, prompt: {'prompt': prompt},
+                           'image_urls'),
+}
+
+
+def stub_env(base_url: str, workdir: str) -> dict[str, str]:
+    """所有服务商指向模拟服务；不配置回调地址（压测不启动 HTTP 服务），异步任务通过轮询获取结果"""
+    key = 'stub'
+    return {
+        'OPENAI_BASE_URL': base_url, 'OPENAI_API_KEY': key,
+        'COVER_OPENAI_BASE_URL': base_url, 'COVER_OPENAI_API_KEY': key, 'COVER_MODEL': 'stub-cover',
+        'COVER_COUNT': os.getenv('COVER_COUNT', '1').split(',')[0],
+        'SCREEN_BASE_URL': base_url,
+        'GEMINI_IMAGE_OPENAI_BASE_URL': base_url, 'GEMINI_IMAGE_OPENAI_API_KEY': key,
+        'GEMINI_IMAGE_COVER_MODEL': 'stub-gemini',
+        'GROK_IMAGE_OPENAI_BASE_URL': base_url, 'GROK_IMAGE_OPENAI_API_KEY': key,
+        'GROK_IMAGE_IMAGE_MODEL': 'stub-grok', 'GROK_IMAGE_IMAGE_EDIT_MODEL': 'stub-grok-edit',
+        'GROK_VIDEO_BASE_URL': base_url, 'GROK_VIDEO_API_KEY': key, 'GROK_VIDEO_CALLBACK_FIELD': '',
+        'MONDO_OPENAI_BASE_URL': base_url, 'MONDO_OPENAI_API_KEY': key,
+        'MONDO_IMAGE_MODEL': 'stub-mondo', 'MONDO_TEXT_MODEL': 'stub-mondo-text',
+        'TEXT2IMAGE_OPENAI_BASE_URL': base_url, 'TEXT2IMAGE_OPENAI_API_KEY': key, 'TEXT2IMAGE_MODELS': 'stub-image',
+        'TEXT2IMAGE_MODEL': 'stub-image',
+        'FAL_KEY': key, 'FAL_QUEUE_URL': base_url,
+        'AICHART_FLOWISE_URL': base_url + '/api/v1/prediction/stub',
+        'AICHART_OPENAI_BASE_URL': base_url, 'AICHART_OPENAI_API_KEY': key,
+        'TRANSLATE_ENGINE': 'openai', 'TRANSLATE_OPENAI_BASE_URL': base_url, 'TRANSLATE_OPENAI_API_KEY': key,
+        'WEBHOOK_BASE_URL': '',
+        'DATA_DIR': str(Path(workdir) / 'data'),
+        'REFLEX_UPLOADED_FILES_DIR': str(Path(workdir) / 'uploaded_files'),
+        'TRACE_EXPORT': os.getenv('TRACE_EXPORT', 'none'),
+    }
+
+
+class SimulatedSession:
+    """模拟一个浏览器会话：事件处理函数中的 async with self 获取本会话的状态锁，
+    退出时像 Reflex 一样计算并序列化状态增量（计入推送次数与字节数）；self.router 返回本会话的 token"""
+
+    def __init__(self, state, token: str):
+        object.__setattr__(self, '_state', state)
+        object.__setattr__(self, '_lock', asyncio.Lock())
+        object.__setattr__(self, 'router', types.SimpleNamespace(
+            session=types.SimpleNamespace(client_token=token), url='', headers={}))
+        object.__setattr__(self, 'pushes', 0)
+        object.__setattr__(self, 'delta_bytes', 0)
+
+    def __getattr__(self, name):
+        value = getattr(self._state, name)
+        # 状态方法重新绑定到本对象，方法内部的 async with self 同样经过模拟会话
+        if inspect.ismethod(value) and value.__self__ is self._state:
+            return types.MethodType(value.__func__, self)
+        if isinstance(value, functools.partial) and value.args[:1] == (self._state,):
+            return functools.partial(value.func, self, *value.args[1:], **value.keywords)
+        return value
+
+    def __setattr__(self, name, value):
+        setattr(self._state, name, value)
+
+    async def __aenter__(self):
+        await self._lock.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        from reflex.utils.format import json_dumps
+
+        try:
+            delta = self._state.get_delta()
+            self._state._clean()
+            if delta:
+                object.__setattr__(self, 'pushes', self.pushes + 1)
+                object.__setattr__(self, 'delta_bytes', self.delta_bytes + len(json_dumps(delta)))
+        finally:
+            self._lock.release()
+
+
+@dataclass
+class Sample:
+    page: str
+    seconds: float
+    ok: bool
+    finished_at: float
+    error: str = ''
+    pushes: int = 0
+    delta_bytes: int = 0
+
+
+def percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * percent / 100), len(ordered) - 1)]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_port(port: int, timeout: float):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+@contextlib.asynccontextmanager
+async def stub_server(args):
+    """模拟服务运行在子进程中，其 CPU 与内存开销不计入被测进程"""
+    port = _free_port()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, '-m', 'image_gen_page.tool.provider_stub', '--port', str(port),
+        '--delay', str(args.task_delay), '--latency', str(args.latency), '--latency-dist', args.latency_dist,
+        '--latency-sigma', str(args.latency_sigma), '--error-rate', str(args.error_rate),
+        '--error-status', args.error_status,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await _wait_port(port, timeout=30)
+        yield f'http://127.0.0.1:{port}'
+    finally:
+        process.terminate()
+        await process.wait()
+
+
+def _alert_text(event) -> str:
+    """从 window_alert 事件中取出提示文字"""
+    match = re.search(r'\["alert"\]\((".*")\)', ' '.join(str(value) for _, value in event.args))
+    with contextlib.suppress(ValueError):
+        if match:
+            return json.loads(match.group(1)).split('\n')[0][:200]
+    return 'alert'
+
+
+async def submit(session: SimulatedSession, page: str, scenario: Scenario, handler, prompt: str) -> Sample:
+    """提交一次生成并等待事件处理函数结束"""
+    from image_gen_page.tool.metrics import is_alert
+
+    for name, value in scenario.inputs(session._state, prompt).items():
+        setattr(session._state, name, value)
+    session._state._clean()
+    pushes, delta_bytes = session.pushes, session.delta_bytes
+    error = ''
+    started = time.perf_counter()
+    try:
+        async for event in handler(session):
+            if is_alert(event) and not error:
+                error = _alert_text(event)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    seconds = time.perf_counter() - started
+    ok = not error and bool(getattr(session._state, scenario.result))
+    return Sample(page, seconds, ok, time.perf_counter(), error or ('' if ok else '未返回结果'),
+                  session.pushes - pushes, session.delta_bytes - delta_bytes)
+
+
+async def simulate(page: str, index: int, args, samples: list[Sample]):
+    """一个模拟会话：按思考时间间隔依次提交多次生成"""
+    scenario = SCENARIOS[page]
+    state_class = scenario.state_class()
+    state = state_class(_reflex_internal_init=True, init_substates=False)
+    session = SimulatedSession(state, f'loadtest-{page}-{index}-{uuid.uuid4().hex[:8]}')
+    handler = getattr(state_class, scenario.handler).fn
+    # 启动时间在 ramp 秒内均匀分布，避免所有会话同一时刻提交
+    await asyncio.sleep(args.ramp * index / max(args.sessions, 1))
+    for iteration in range(args.iterations):
+        # 每次提示词不同，避免命中各级缓存
+        samples.append(await submit(session, page, scenario, handler,
+                                    f'压测 {page} 会话{index} 第{iteration}次 {uuid.uuid4().hex}'))
+        if args.think:
+            await asyncio.sleep(args.think)
+
+
+def summarize(samples: list[Sample], pages: list[str], wall: float, monitor, baseline_rss: float) -> dict:
+    report = {'wall_seconds': round(wall, 3), 'pages': {}}
+    for page in pages:
+        items = [sample for sample in samples if sample.page == page]
+        if not items:
+            continue
+        latencies = [sample.seconds for sample in items]
+        # 吞吐按该页面从第一次提交到最后一次完成的时间窗口计算
+        window = max(sample.finished_at for sample in items) - min(sample.finished_at - sample.seconds
+                                                                     for sample in items)
+        errors = {}
+        for sample in items:
+            if not sample.ok:
+                errors[sample.error] = errors.get(sample.error, 0) + 1
+        report['pages'][page] = {
+            'requests': len(items),
+            'ok': sum(sample.ok for sample in items),
+            'throughput': round(sum(sample.ok for sample in items) / max(window, 1e-9), 3),
+            'p50': round(percentile(latencies, 50), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'max': round(max(latencies), 3),
+            'pushes': round(sum(sample.pushes for sample in items) / len(items), 1),
+            'delta_kb': round(sum(sample.delta_bytes for sample in items) / len(items) / 1024, 1),
+            'errors': dict(sorted(errors.items(), key=lambda item: -item[1])[:5]),
+        }
+    report['loop_lag_ms'] = {
+        'p50': round(percentile(monitor.lags, 50) * 1000, 2),
+        'p99': round(percentile(monitor.lags, 99) * 1000, 2),
+        'max': round(max(monitor.lags, default=0) * 1000, 2),
+    }
+    report['loop_blocks'] = [{'site': site, 'count': entry.count, 'total_ms': round(entry.total_seconds * 1000, 1),
+                              'max_ms': round(entry.max_seconds * 1000, 1)} for site, entry in monitor.top_sites(10)]
+    report['rss_mb'] = {'baseline': round(baseline_rss, 1), 'peak': round(peak_rss_mb(), 1)}
+    return report
+
+
+def print_report(report: dict):
+    print(f"\n总耗时 {report['wall_seconds']} 秒")
+    print(f"{'页面':<18}{'请求':>6}{'成功':>6}{'吞吐/秒':>9}{'p50':>8}{'p99':>8}{'最大':>8}{'推送/次':>9}{'增量KB':>9}")
+    for page, row in report['pages'].items():
+        print(f"{page:<20}{row['requests']:>6}{row['ok']:>7}{row['throughput']:>10}{row['p50']:>9}{row['p99']:>8}"
+              f"{row['max']:>9}{row['pushes']:>10}{row['delta_kb']:>10}")
+        for error, count in row['errors'].items():
+            print(f"    失败 {count} 次：{error}")
+    lag = report['loop_lag_ms']
+    print(f"事件循环延迟（毫秒）：p50 {lag['p50']}，p99 {lag['p99']}，最大 {lag['max']}")
+    for block in report['loop_blocks']:
+        print(f"    阻塞 {block['count']} 次，累计 {block['total_ms']} 毫秒，最长 {block['max_ms']} 毫秒：{block['site']}")
+    print(f"内存（MB）：压测前 {report['rss_mb']['baseline']}，峰值 {report['rss_mb']['peak']}")
+
+
+async def run(args) -> dict:
+    pages = [page.strip() for page in args.pages.split(',') if page.strip()] if args.pages else list(SCENARIOS)
+    unknown = [page for page in pages if page not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"未知页面：{', '.join(unknown)}，可选：{', '.join(SCENARIOS)}")
+    with tempfile.TemporaryDirectory(prefix='loadtest_') as workdir:
+        async with stub_server(args) as base_url:
+            if os.path.exists(env_file()):
+                dotenv.load_dotenv(env_file())
+            # 在任何模块读取配置之前设置环境变量
+            os.environ.update(stub_env(base_url, workdir))
+            from image_gen_page.tool.job_queue import get_job_queue
+            from image_gen_page.tool.loop_monitor import EventLoopMonitor
+
+            import reflex as rx
+
+            for page in pages:
+                SCENARIOS[page].state_class()
+            (rx.get_upload_dir() / SAMPLE_UPLOAD).write_bytes(
+                importlib.import_module('image_gen_page.tool.provider_stub').SAMPLE_PNG)
+            worker = asyncio.create_task(get_job_queue().serve())
+            monitor = EventLoopMonitor(threshold=args.block_threshold / 1000)
+            monitor_task = asyncio.create_task(monitor.run())
+            baseline_rss = peak_rss_mb()
+            samples: list[Sample] = []
+            started = time.perf_counter()
+            try:
+                await asyncio.gather(*(simulate(page, index, args, samples)
+                                       for page in pages for index in range(args.sessions)))
+            finally:
+                wall = time.perf_counter() - started
+                monitor_task.cancel()
+                worker.cancel()
+                await asyncio.gather(monitor_task, worker, return_exceptions=True)
+    return summarize(samples, pages, wall, monitor, baseline_rss)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='使用模拟服务商对各页面的事件处理函数进行离线压测')
+    parser.add_argument('--pages', default='', help=f"压测的页面，逗号分隔，默认全部：{','.join(SCENARIOS)}")
+    parser.add_argument('--sessions', type=int, default=20, help='每个页面的并发会话数')
+    parser.add_argument('--iterations', type=int, default=3, help='每个会话依次提交的次数')
+    parser.add_argument('--think', type=float, default=0, help='同一会话两次提交之间的间隔（秒）')
+    parser.add_argument('--ramp', type=float, default=1, help='所有会话在多少秒内陆续开始')
+    parser.add_argument('--task-delay', type=float, default=3, help='fal/视频等异步任务的完成耗时（秒）')
+    parser.add_argument('--latency', type=float, default=0.5, help='同步接口的平均响应耗时（秒）')
+    parser.add_argument('--latency-dist', default='lognormal', choices=['fixed', 'uniform', 'exp', 'lognormal'])
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0, help='同步接口返回错误的比例（0-1）')
+    parser.add_argument('--error-status', default='500,429', help='错误状态码，逗号分隔')
+    parser.add_argument('--block-threshold', type=float, default=50, help='事件循环阻塞的统计阈值（毫秒）')
+    parser.add_argument('--json', default='', help='同时把结果写入 JSON 文件')
+    args = parser.parse_args()
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# 事件循环阻塞检测：协程按固定间隔休眠并测量唤醒延迟，后台线程发现事件循环长时间没有唤醒时
+# 抓取事件循环线程当前的调用栈，按调用位置统计阻塞次数与时长，通过 /metrics 输出
+# 通过 LOOP_MONITOR=1 开启，阻塞阈值由 LOOP_BLOCK_THRESHOLD_MS 配置
+import asyncio
+import collections
+import sys
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from pathlib import Path
+
+from image_gen_page.tool.config import get_config
+from image_gen_page.tool.metrics import LOOP_BLOCK_SECONDS, LOOP_BLOCKS, LOOP_LAG
+
+PACKAGE_DIR = str(Path(__file__).resolve().parent.parent)
+MAX_STACK_FRAMES = 20
+
+
+@dataclass
+class BlockSite:
+    count: int = 0
+    total_seconds: float = 0
+    max_seconds: float = 0
+    stack: str = ''  # 最近一次抓取到的调用栈
+
+
+def _call_site(stack: list[traceback.FrameSummary]) -> str:
+    """优先取调用栈中最内层的本项目代码，其次取最内层的一帧"""
+    for frame in reversed(stack):
+        if frame.filename.startswith(PACKAGE_DIR) and frame.filename != __file__:
+            return f"{Path(frame.filename).relative_to(Path(PACKAGE_DIR).parent)}:{frame.lineno} {frame.name}"
+    if stack:
+        frame = stack[-1]
+        return f"{frame.filename}:{frame.lineno} {frame.name}"
+    return 'unknown'
+
+
+class EventLoopMonitor:
+    def __init__(self, interval: float = 0.05, threshold: float = 0.1):
+        self.interval = interval
+        self.threshold = threshold
+        self.sites: dict[str, BlockSite] = {}
+        self.lags: collections.deque[float] = collections.deque(maxlen=10000)  # 最近的唤醒延迟（秒）
+        self._tick = time.perf_counter()  # 最近一次开始休眠的时间
+        self._captured: tuple[float, str, str] | None = None  # (对应的 tick, 调用位置, 调用栈)
+        self._stopped = threading.Event()
+
+    async def run(self):
+        """在事件循环中运行，直到被取消"""
+        loop_thread = threading.get_ident()
+        watchdog = threading.Thread(target=self._watch, args=(loop_thread,), name='loop-monitor', daemon=True)
+        self._stopped.clear()
+        watchdog.start()
+        try:
+            while True:
+                self._tick = started = time.perf_counter()
+                await asyncio.sleep(self.interval)
+                lag = max(time.perf_counter() - started - self.interval, 0)
+                self.lags.append(lag)
+                LOOP_LAG.observe(lag)
+                if lag >= self.threshold:
+                    self._record(started, lag)
+        finally:
+            self._stopped.set()
+
+    def _record(self, tick: float, lag: float):
+        captured, self._captured = self._captured, None
+        if captured is not None and captured[0] == tick:
+            _, site, stack = captured
+        else:
+            # 阻塞时间太短，后台线程没来得及抓取调用栈（或延迟来自大量回调而非单次阻塞）
+            site, stack = 'unknown', ''
+        entry = self.sites.get(site)
+        if entry is None:
+            entry = self.sites[site] = BlockSite()
+            print(f"[事件循环] 阻塞 {lag * 1000:.0f} 毫秒：{site}\n{stack}")
+        entry.count += 1
+        entry.total_seconds += lag
+        entry.max_seconds = max(entry.max_seconds, lag)
+        entry.stack = stack or entry.stack
+        LOOP_BLOCKS.inc(site=site)
+        LOOP_BLOCK_SECONDS.inc(lag, site=site)
+
+    def _watch(self, loop_thread: int):
+        """后台线程：事件循环超过阈值仍未唤醒时抓取其调用栈，每次阻塞只抓取一次"""
+        while not self._stopped.wait(self.threshold / 4):
+            tick = self._tick
+            if time.perf_counter() - tick < self.interval + self.threshold:
+                continue
+            if self._captured is not None and self._captured[0] == tick:
+                continue
+            frame = sys._current_frames().get(loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            # 去掉事件循环自身的调度帧，只保留当前回调内的调用栈
+            starts = [index for index, item in enumerate(stack) if item.filename == asyncio.events.__file__]
+            stack = stack[starts[-1] + 1 if starts else 0:][-MAX_STACK_FRAMES:]
+            self._captured = (tick, _call_site(stack), ''.join(traceback.format_list(stack)))
+
+    def top_sites(self, limit: int = 20) -> list[tuple[str, BlockSite]]:
+        return sorted(self.sites.items(), key=lambda item: -item[1].total_seconds)[:limit]
+
+
+_monitor: EventLoopMonitor | None = None
+
+
+def get_loop_monitor() -> EventLoopMonitor | None:
+    """未开启检测时为 None"""
+    return _monitor
+
+
+async def watch_event_loop():
+    """应用生命周期任务：LOOP_MONITOR 开启时持续检测事件循环阻塞"""
+    global _monitor
+    config = get_config()
+    if not config.loop_monitor:
+        return
+    _monitor = EventLoopMonitor(threshold=config.loop_block_threshold)
+    await _monitor.run()
@@ -0,0 +1,357 @@
+# 进程内运行指标，以 Prometheus 文本格式通过 /metrics 输出：
+# 上游调用耗时、响应大小与状态码（aiohttp TraceConfig 自动采集），页面生成耗时与结果，进行中数量，缓存命中，排队深度
+import asyncio
+import contextlib
+import math
+import re
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+
+from image_gen_page.tool.config import AppConfig, get_config, on_reload
+from image_gen_page.tool.debug import debug_route
+from image_gen_page.tool.tracing import http_trace_config
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1KB ~ 256MB
+HANDLER_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 1800)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, object] = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _labels(self, key: tuple, extra: str = '') -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, value in sorted(self._values.items()):
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key: tuple, value) -> list[str]:
+        return [f'{self.name}{self._labels(key)} {_format(value)}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def clear(self):
+        self._values.clear()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # [各桶计数, 总和, 总数]
+            state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[0][index] += 1
+                break
+        state[1] += value
+        state[2] += 1
+
+    def _render_value(self, key: tuple, value) -> list[str]:
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            le = 'le="' + _format(bound) + '"'
+            lines.append(f'{self.name}_bucket{self._labels(key, le)} {cumulative}')
+        lines.append(f'{self.name}_sum{self._labels(key)} {_format(total)}')
+        lines.append(f'{self.name}_count{self._labels(key)} {count}')
+        return lines
+
+
+_registry: list[_Metric] = []
+
+# 上游调用
+UPSTREAM_DURATION = Histogram('upstream_request_duration_seconds', '上游请求发出到收到响应头的耗时',
+                              ('provider', 'model', 'endpoint', 'method'))
+UPSTREAM_RESPONSE_SIZE = Histogram('upstream_response_size_bytes', '上游响应体大小',
+                                   ('provider', 'model', 'endpoint'), SIZE_BUCKETS)
+UPSTREAM_REQUESTS = Counter('upstream_requests_total', '上游请求数（按状态码，连接失败等为 error）',
+                            ('provider', 'model', 'endpoint', 'status'))
+UPSTREAM_IN_FLIGHT = Gauge('upstream_requests_in_flight', '等待响应中的上游请求数', ('provider',))
+
+# 页面生成
+HANDLER_DURATION = Histogram('handler_duration_seconds', '页面生成处理耗时', ('page', 'handler'), HANDLER_BUCKETS)
+HANDLER_RESULTS = Counter('handler_results_total', '页面生成结果（ok / alert / error / cancelled）',
+                          ('page', 'handler', 'result'))
+HANDLER_IN_FLIGHT = Gauge('handler_in_flight', '进行中的页面生成数', ('page',))
+
+# 缓存与队列
+CACHE_REQUESTS = Counter('cache_requests_total', '缓存查询次数（hit / miss）', ('cache', 'result'))
+QUEUE_WAITING = Gauge('admission_waiting', '等待准入的请求数', ('provider',))
+QUEUE_ACTIVE = Gauge('admission_active', '已准入、进行中的请求数', ('provider',))
+QUEUE_AVG_CALL = Gauge('admission_avg_call_seconds', '单次调用耗时的滑动平均', ('provider',))
+JOBS = Gauge('job_queue_jobs', '任务队列中各状态的任务数', ('status',))
+FAL_POLLS = Gauge('fal_poller_tracked', '统一轮询中的 fal 任务数')
+
+# 会话状态（内存状态管理器，会话回收任务每分钟更新）
+SESSIONS = Gauge('state_sessions', '内存中保留的会话数')
+STATE_BYTES = Gauge('state_bytes', '内存中各状态类变量的估算大小', ('state',))
+SESSIONS_EVICTED = Counter('state_sessions_evicted_total', '被回收的会话数（ttl / memory）', ('reason',))
+
+# 事件循环（LOOP_MONITOR 开启时采集）
+LOOP_LAG = Histogram('event_loop_lag_seconds', '事件循环唤醒延迟', buckets=LAG_BUCKETS)
+LOOP_BLOCKS = Counter('event_loop_blocks_total', '事件循环阻塞超过阈值的次数（按阻塞时正在执行的调用位置）', ('site',))
+LOOP_BLOCK_SECONDS = Counter('event_loop_blocked_seconds_total', '事件循环阻塞的累计时长（按调用位置）', ('site',))
+
+# websocket 流量（WS_STATS 开启时采集）
+WS_EVENTS = Counter('ws_events_total', '前端发来的事件数', ('state', 'handler'))
+WS_EVENT_BYTES = Counter('ws_event_bytes_total', '前端发来的事件序列化大小', ('state', 'handler'))
+WS_DELTAS = Counter('ws_deltas_total', '下发的状态增量数（按所属状态类与触发的事件处理函数）', ('state', 'handler'))
+WS_DELTA_BYTES = Counter('ws_delta_bytes_total', '下发的状态增量序列化大小', ('state', 'handler'))
+WS_VAR_BYTES = Counter('ws_var_bytes_total', '下发的状态增量序列化大小（按变量）', ('state', 'var'))
+
+
+def cache_result(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+# ---------- 上游调用采集 ----------
+
+# 主机 -> 服务商名称，由配置中的各接口地址得到
+_providers: dict[str, str] = {}
+
+
+def _build_providers(config: AppConfig):
+    urls = {
+        'openai': config.openai.base_url,
+        'cover': config.cover.endpoint.base_url,
+        'screenshot': config.cover.screen_base_url,
+        'gemini': config.gemini.base_url,
+        'grok_image': config.grok_image.base_url,
+        'grok_video': config.grok_video.base_url,
+        'mondo': config.mondo.base_url,
+        'text2image': config.text2image.endpoint.base_url,
+        'fal': config.fal_queue_url,
+        'flowise': config.aichart_flowise_url,
+        'aichart': config.aichart.base_url,
+        'translate': config.translate.base_url,
+    }
+    providers = {}
+    for name, url in urls.items():
+        host = urlsplit(url).netloc if url else ''
+        # 多个功能共用同一地址时保留先出现的名称
+        if host and host not in providers:
+            providers[host] = name
+    _providers.clear()
+    _providers.update(providers)
+
+
+on_reload(_build_providers)
+
+_ID_SEGMENT = re.compile(r'^(?=.*\d)[0-9A-Za-z_-]{12,}$')
+_MODEL_JSON = re.compile(rb'"model"\s*:\s*"([^"]{1,100})"')
+_MODEL_FORM = re.compile(rb'name="model"\r\n(?:[^\r\n]*\r\n)*\r\n([^\r\n]{1,100})')
+
+
+def _endpoint(path: str) -> str:
+    """接口路径中的任务ID等可变部分替换为 {id}，控制标签数量"""
+    return '/'.join('{id}' if _ID_SEGMENT.match(segment) else segment for segment in path.split('/')) or '/'
+
+
+def _provider(url) -> str:
+    if not _providers:
+        _build_providers(get_config())
+    host = url.host or ''
+    if url.port and not url.is_default_port():
+        host = f'{host}:{url.port}'
+    return _providers.get(host, host)
+
+
+async def _on_request_start(session, context, params):
+    context.started_at = time.perf_counter()
+    context.provider = _provider(params.url)
+    context.endpoint = _endpoint(params.url.path)
+    context.model = ''
+    UPSTREAM_IN_FLIGHT.inc(provider=context.provider)
+
+
+async def _on_request_chunk_sent(session, context, params):
+    # 从请求体（JSON 或表单）中取出模型名
+    if context.model:
+        return
+    chunk = params.chunk[:8192]
+    match = _MODEL_JSON.search(chunk) or _MODEL_FORM.search(chunk)
+    if match:
+        context.model = match.group(1).decode('utf-8', 'replace')
+
+
+async def _on_request_end(session, context, params):
+    response = params.response
+    labels = {'provider': context.provider, 'model': context.model, 'endpoint': context.endpoint}
+    UPSTREAM_IN_FLIGHT.dec(provider=context.provider)
+    UPSTREAM_DURATION.observe(time.perf_counter() - context.started_at, method=params.method, **labels)
+    UPSTREAM_REQUESTS.inc(status=response.status, **labels)
+    content = response.content
+
+    def on_eof():
+        size = getattr(content, 'total_bytes', None)
+        if size is None:
+            size = response.content_length or 0
+        UPSTREAM_RESPONSE_SIZE.observe(size, **labels)
+
+    # 响应体读完后记录大小（流式响应未读完就断开时不记录）
+    try:
+        content.on_eof(on_eof)
+    except AttributeError:
+        if response.content_length is not None:
+            UPSTREAM_RESPONSE_SIZE.observe(response.content_length, **labels)
+
+
+async def _on_request_exception(session, context, params):
+    UPSTREAM_IN_FLIGHT.dec(provider=context.provider)
+    UPSTREAM_REQUESTS.inc(provider=context.provider, model=context.model, endpoint=context.endpoint, status='error')
+
+
+_trace_config: aiohttp.TraceConfig | None = None
+
+
+def upstream_trace_config() -> aiohttp.TraceConfig:
+    global _trace_config
+    if _trace_config is None:
+        _trace_config = aiohttp.TraceConfig()
+        _trace_config.on_request_start.append(_on_request_start)
+        _trace_config.on_request_chunk_sent.append(_on_request_chunk_sent)
+        _trace_config.on_request_end.append(_on_request_end)
+        _trace_config.on_request_exception.append(_on_request_exception)
+    return _trace_config
+
+
+def client_session(**kwargs) -> aiohttp.ClientSession:
+    """创建带指标采集与追踪的 aiohttp 会话，调用上游接口统一使用"""
+    return aiohttp.ClientSession(trace_configs=[upstream_trace_config(), http_trace_config()], **kwargs)
+
+
+# ---------- 页面生成采集 ----------
+
+def is_alert(event) -> bool:
+    """页面通过 rx.window_alert 提示失败"""
+    handler = getattr(event, 'handler', None)
+    name = getattr(getattr(handler, 'fn', None), '__name__', '')
+    if name == '_alert':
+        return True
+    # 新版 Reflex 的 window_alert 改为调用前端函数 window.alert
+    return any('window?.["alert"]' in str(value) for _, value in getattr(event, 'args', ()))
+
+
+class HandlerRecord:
+    def __init__(self, page: str, handler: str):
+        self.page = page
+        self.handler = handler
+        self.result = 'ok'
+
+    def saw(self, event):
+        if is_alert(event):
+            self.result = 'alert'
+
+
+@contextlib.contextmanager
+def track_handler(page: str, handler: str):
+    """记录一次页面生成的耗时与结果：with track_handler('cover', 'get_image') as record: ... record.saw(event)"""
+    record = HandlerRecord(page, handler)
+    started_at = time.perf_counter()
+    HANDLER_IN_FLIGHT.inc(page=page)
+    try:
+        yield record
+    except asyncio.CancelledError:
+        record.result = 'cancelled'
+        raise
+    except Exception:
+        record.result = 'error'
+        raise
+    finally:
+        HANDLER_IN_FLIGHT.dec(page=page)
+        HANDLER_DURATION.observe(time.perf_counter() - started_at, page=page, handler=handler)
+        HANDLER_RESULTS.inc(page=page, handler=handler, result=record.result)
+
+
+# ---------- 输出 ----------
+
+async def _collect():
+    """输出前采集排队深度等即时数值"""
+    from image_gen_page.tool.admission import limiters
+    from image_gen_page.tool.fal_poller import get_fal_poller
+    from image_gen_page.tool.job_queue import get_job_queue
+
+    for provider, limiter in limiters().items():
+        QUEUE_WAITING.set(len(limiter.waiters), provider=provider)
+        QUEUE_ACTIVE.set(limiter.active, provider=provider)
+        QUEUE_AVG_CALL.set(limiter.avg_call_seconds, provider=provider)
+    FAL_POLLS.set(get_fal_poller().tracked_count())
+    JOBS.clear()
+    for status, count in (await asyncio.to_thread(get_job_queue().status_counts)).items():
+        JOBS.set(count, status=status)
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+@debug_route
+async def endpoint(request: Request):
+    """指标接口：GET /metrics（指标中含页面名、上游地址等内部信息，与调试接口一样需要 DEBUG_TOKEN）"""
+    await _collect()
+    return PlainTextResponse(render(), media_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,296 @@
+# 本地联调与压测用的服务商模拟：模拟 fal 队列接口、OpenAI 兼容的视频接口（任务完成后向回调地址推送结果）、
+# 图片生成/编辑接口、流式（SSE）与非流式聊天接口、截图服务以及 Flowise 预测接口；
+# 同步接口的响应耗时与出错比例可配置，用于压测（见 loadtest.py）
+# 用法：python -m image_gen_page.tool.provider_stub --port 9000 --delay 5 --latency 1 --latency-dist lognormal
+# 然后在 .env 中设置 FAL_QUEUE_URL=http://127.0.0.1:9000、GROK_VIDEO_BASE_URL=http://127.0.0.1:9000、
+# GROK_VIDEO_CALLBACK_FIELD=callback_url、WEBHOOK_BASE_URL=http://127.0.0.1:8000、WEBHOOK_SECRET=任意字符串，
+# 测试流式提示词增强时设置 MONDO_OPENAI_BASE_URL=http://127.0.0.1:9000、MONDO_OPENAI_API_KEY=任意字符串
+import argparse
+import asyncio
+import json
+import random
+import re
+import struct
+import time
+import uuid
+import zlib
+
+import aiohttp
+from aiohttp import web
+
+SAMPLE_IMAGE = 'https://placehold.co/1024x1024.png'
+SAMPLE_VIDEO = 'https://samplelib.com/lib/preview/mp4/sample-5s.mp4'
+POSTER_REASONING = 'The user wants a poster. Pick one symbolic element and a restrained palette.'
+POSTER_TEXT = ('A lone lighthouse beam cutting through a stormy sea, the beam forming a key shape, '
+               'deep navy and warm amber, bold negative space')
+COVER_HTML = '''```html
+<!DOCTYPE html>
+<html><head><meta charset="utf-8"><style>
+body { margin: 0; } #maincover { width: 100%; height: 100vh; display: flex; align-items: center;
+justify-content: center; background: linear-gradient(135deg, #1e3c72, #2a5298); color: #fff; font-size: 64px; }
+</style></head>
+<body><div id="maincover">封面标题</div></body></html>
+```'''
+
+# 图表描述请求（见 chart_render.spec_prompt）按要求的类型返回的示例数据
+_CATEGORY_SPEC = {'title': '季度销售额', 'x_label': '季度', 'y_label': '万元', 'labels': ['一季度', '二季度', '三季度', '四季度'],
+                  'series': [{'name': '华东', 'data': [120, 200, 150, 80]}, {'name': '华南', 'data': [90, 110, 170, 130]}]}
+_TREE_SPEC = {'title': '产品规划', 'root': {'name': '产品', 'children': [
+    {'name': '移动端', 'children': [{'name': 'iOS'}, {'name': 'Android'}]},
+    {'name': '服务端', 'children': [{'name': '接口'}, {'name': '存储'}]}]}}
+_GRAPH_SPEC = {'title': '审批流程', 'nodes': [
+    {'id': 'a', 'label': '提交', 'shape': 'start', 'group': '申请人'},
+    {'id': 'b', 'label': '审核', 'shape': 'decision', 'group': '主管'},
+    {'id': 'c', 'label': '归档', 'shape': 'end', 'group': '行政'}],
+    'edges': [{'source': 'a', 'target': 'b', 'label': ''}, {'source': 'b', 'target': 'c', 'label': '通过'}]}
+SAMPLE_SPECS = {
+    'bar': _CATEGORY_SPEC, 'column': _CATEGORY_SPEC, 'line': _CATEGORY_SPEC, 'area': _CATEGORY_SPEC,
+    'dual_axis': {**_CATEGORY_SPEC, 'y2_label': '增长率', 'series': [
+        {'name': '销售额', 'type': 'bar', 'axis': 'left', 'data': [120, 200, 150, 80]},
+        {'name': '增长率', 'type': 'line', 'axis': 'right', 'data': [0.3, 0.5, 0.2, 0.1]}]},
+    'pie': {'title': '渠道占比', 'labels': ['线上', '门店', '分销'], 'series': [{'name': '占比', 'data': [45, 35, 20]}]},
+    'histogram': {'title': '响应时间分布', 'x_label': '毫秒', 'bins': 8,
+                  'values': [120, 135, 150, 160, 180, 210, 230, 260, 300, 340, 420, 510]},
+    'scatter': {'title': '身高体重', 'x_label': '身高', 'y_label': '体重',
+                'series': [{'name': '样本', 'data': [[160, 52], [170, 63], [175, 70], [182, 78]]}]},
+    'radar': {'title': '能力评估', 'labels': ['沟通', '技术', '管理', '创新'], 'max': 100,
+              'series': [{'name': '张三', 'data': [80, 65, 90, 70]}]},
+    'wordcloud': {'title': '热词', 'words': [{'text': word, 'weight': weight} for word, weight in
+                                           (('性能', 30), ('压测', 24), ('延迟', 18), ('吞吐', 15), ('并发', 12))]},
+    'tree': _TREE_SPEC, 'mindmap': _TREE_SPEC, 'fishbone': _TREE_SPEC,
+    'flowchart': _GRAPH_SPEC, 'network': _GRAPH_SPEC,
+}
+
+
+def _png(width: int = 8, height: int = 8) -> bytes:
+    """生成纯色 PNG，作为截图结果"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    rows = b''.join(b'\x00' + b'\x2a\x52\x98' * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+SAMPLE_PNG = _png()
+
+
+class Latency:
+    """同步接口的响应耗时分布：fixed 固定为 mean，uniform 在 [0, 2*mean] 均匀分布，
+    exp 为均值 mean 的指数分布，lognormal 为中位数 mean、形状参数 sigma 的对数正态分布（长尾）"""
+
+    def __init__(self, mean: float = 0, dist: str = 'fixed', sigma: float = 0.5):
+        self.mean = mean
+        self.dist = dist
+        self.sigma = sigma
+
+    def sample(self) -> float:
+        if self.mean <= 0:
+            return 0
+        if self.dist == 'uniform':
+            return random.uniform(0, self.mean * 2)
+        if self.dist == 'exp':
+            return random.expovariate(1 / self.mean)
+        if self.dist == 'lognormal':
+            return random.lognormvariate(0, self.sigma) * self.mean
+        return self.mean
+
+
+class StubProvider:
+    def __init__(self, delay: float, drop_callbacks: bool, latency: Latency | None = None, error_rate: float = 0,
+                 error_statuses: tuple[int, ...] = (500,)):
+        self.delay = delay
+        # 丢弃回调，用于验证轮询兜底
+        self.drop_callbacks = drop_callbacks
+        self.latency = latency or Latency()
+        # 按比例返回错误状态码，模拟服务商故障与限流
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.tasks: dict[str, dict] = {}
+
+    async def _simulate(self) -> web.Response | None:
+        """模拟服务商处理耗时，按配置的比例返回错误响应"""
+        await asyncio.sleep(self.latency.sample())
+        if self.error_rate and random.random() < self.error_rate:
+            status = random.choice(self.error_statuses)
+            return web.json_response({'error': {'message': f'stub error {status}'}}, status=status)
+        return None
+
+    def _progress(self, task: dict) -> float:
+        if self.delay <= 0:
+            # --delay 0：任务立即完成
+            return 100
+        return min((time.monotonic() - task['created_at']) / self.delay * 100, 100)
+
+    async def _callback(self, url: str, payload: dict):
+        await asyncio.sleep(self.delay)
+        if not url or self.drop_callbacks:
+            return
+        async with aiohttp.ClientSession() as session:
+            async with session.post(url, json=payload) as response:
+                print(f"[stub] 回调 {url} -> {response.status}")
+
+    # ---------- fal 队列 ----------
+
+    async def fal_submit(self, request: web.Request):
+        if (error := await self._simulate()) is not None:
+            return error
+        request_id = uuid.uuid4().hex
+        base = f"{request.scheme}://{request.host}/fal-ai/requests/{request_id}"
+        self.tasks[request_id] = {'created_at': time.monotonic()}
+        result = {'images': [{'url': SAMPLE_IMAGE}]}
+        asyncio.create_task(self._callback(request.query.get('fal_webhook', ''), {
+            'request_id': request_id, 'status': 'OK', 'payload': result,
+        }))
+        return web.json_response({'request_id': request_id, 'response_url': base, 'status_url': base + '/status'})
+
+    async def fal_status(self, request: web.Request):
+        task = self.tasks.get(request.match_info['id'])
+        if task is None:
+            return web.json_response({'error': 'not found'}, status=404)
+        status = 'COMPLETED' if self._progress(task) >= 100 else 'IN_PROGRESS'
+        return web.json_response({'status': status}, status=200 if status == 'COMPLETED' else 202)
+
+    async def fal_result(self, request: web.Request):
+        return web.json_response({'images': [{'url': SAMPLE_IMAGE}]})
+
+    # ---------- 视频接口 ----------
+
+    async def video_create(self, request: web.Request):
+        if (error := await self._simulate()) is not None:
+            return error
+        if request.content_type == 'application/json':
+            data = await request.json()
+        else:
+            data = dict(await request.post())
+        task_id = uuid.uuid4().hex
+        self.tasks[task_id] = {'created_at': time.monotonic()}
+        asyncio.create_task(self._callback(data.get('callback_url', ''), {
+            'id': task_id, 'status': 'completed', 'progress': 100, 'url': SAMPLE_VIDEO,
+        }))
+        return web.json_response({'id': task_id, 'status': 'queued'})
+
+    async def video_get(self, request: web.Request):
+        task_id = request.match_info['id']
+        if task_id not in self.tasks:
+            return web.json_response({'error': 'not found'}, status=404)
+        progress = self._progress(self.tasks[task_id])
+        if progress >= 100:
+            return web.json_response({'id': task_id, 'status': 'completed', 'progress': 100, 'url': SAMPLE_VIDEO})
+        return web.json_response({'id': task_id, 'status': 'in_progress', 'progress': int(progress)})
+
+    async def video_delete(self, request: web.Request):
+        self.tasks.pop(request.match_info['id'], None)
+        return web.json_response({'deleted': True})
+
+    # ---------- 图片接口 ----------
+
+    async def image_generations(self, request: web.Request):
+        data = await request.json()
+        if (error := await self._simulate()) is not None:
+            return error
+        return web.json_response({'created': int(time.time()),
+                                  'data': [{'url': SAMPLE_IMAGE} for _ in range(int(data.get('n') or 1))]})
+
+    async def image_edits(self, request: web.Request):
+        # 读完上传的表单（含原图），与真实接口的请求开销一致
+        await request.post()
+        if (error := await self._simulate()) is not None:
+            return error
+        return web.json_response({'created': int(time.time()), 'data': [{'url': SAMPLE_IMAGE}]})
+
+    # ---------- 截图与 Flowise ----------
+
+    async def screenshot(self, request: web.Request):
+        await request.json()
+        if (error := await self._simulate()) is not None:
+            return error
+        return web.Response(body=SAMPLE_PNG, content_type='image/png')
+
+    async def flowise_prediction(self, request: web.Request):
+        await request.json()
+        if (error := await self._simulate()) is not None:
+            return error
+        output = json.dumps([{'type': 'text', 'text': SAMPLE_IMAGE}])
+        return web.json_response({'text': '图表已生成', 'usedTools': [{'tool': 'chart', 'toolOutput': output}]})
+
+    # ---------- 聊天接口 ----------
+
+    @staticmethod
+    def _reply(messages: list) -> tuple[str, str]:
+        """按请求内容返回 (推理内容, 正文)：翻译、图片生成、封面 HTML、图表描述，其余为海报提示词"""
+        system = ' '.join(str(message.get('content')) for message in messages if message.get('role') == 'system')
+        last = messages[-1].get('content') if messages else ''
+        if system.startswith('Translate'):
+            return '', f'translated: {last}'
+        if isinstance(last, list):
+            # 多模态消息（图片生成/编辑），以 markdown 图片返回
+            return '', f'![image]({SAMPLE_IMAGE})'
+        text = str(last)
+        if 'maincover' in text:
+            return '', COVER_HTML
+        match = re.search(r'"type": "(\w+)"', text)
+        if match and match.group(1) in SAMPLE_SPECS:
+            return '', json.dumps({'type': match.group(1), **SAMPLE_SPECS[match.group(1)]}, ensure_ascii=False)
+        return POSTER_REASONING, POSTER_TEXT
+
+    async def chat_completions(self, request: web.Request):
+        data = await request.json()
+        # 流式请求的处理耗时即首个 token 的等待时间
+        if (error := await self._simulate()) is not None:
+            return error
+        reasoning, content = self._reply(data.get('messages') or [])
+        if not data.get('stream'):
+            return web.json_response({'choices': [{'message': {'role': 'assistant', 'content': content,
+                                                               'reasoning_content': reasoning}}]})
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        # 先推理内容后正文，逐词推送
+        words = [('reasoning_content', word + ' ') for word in reasoning.split()]
+        words += [('content', word) for word in re.split(r'(?<=\s)', content) if word]
+        interval = min(self.delay / max(len(words), 1), 0.2)
+        for field, word in words:
+            chunk = {'choices': [{'index': 0, 'delta': {field: word}}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await asyncio.sleep(interval)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    def app(self) -> web.Application:
+        # 上传的原图可能较大
+        app = web.Application(client_max_size=32 * 1024 * 1024)
+        app.router.add_get('/fal-ai/requests/{id}/status', self.fal_status)
+        app.router.add_get('/fal-ai/requests/{id}', self.fal_result)
+        app.router.add_post('/fal-ai/{model:.+}', self.fal_submit)
+        app.router.add_post('/videos', self.video_create)
+        app.router.add_get('/videos/{id}', self.video_get)
+        app.router.add_delete('/videos/{id}', self.video_delete)
+        app.router.add_post('/chat/completions', self.chat_completions)
+        app.router.add_post('/images/generations', self.image_generations)
+        app.router.add_post('/images/edits', self.image_edits)
+        app.router.add_post('/screenshot', self.screenshot)
+        app.router.add_post('/api/v1/prediction/{id}', self.flowise_prediction)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='模拟服务商接口（含完成回调与流式聊天）')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--delay', type=float, default=5, help='任务完成耗时（秒）')
+    parser.add_argument('--drop-callbacks', action='store_true', help='不推送回调，只能依靠轮询获取结果')
+    parser.add_argument('--latency', type=float, default=0, help='同步接口的平均响应耗时（秒）')
+    parser.add_argument('--latency-dist', default='fixed', choices=['fixed', 'uniform', 'exp', 'lognormal'],
+                        help='响应耗时分布')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='lognormal 分布的形状参数，越大长尾越明显')
+    parser.add_argument('--error-rate', type=float, default=0, help='同步接口返回错误的比例（0-1）')
+    parser.add_argument('--error-status', default='500', help='错误状态码，多个用逗号分隔，例如 500,429,503')
+    args = parser.parse_args()
+    provider = StubProvider(args.delay, args.drop_callbacks, Latency(args.latency, args.latency_dist, args.latency_sigma),
+                            args.error_rate, tuple(int(status) for status in args.error_status.split(',') if status))
+    web.run_app(provider.app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+# 生图配额存储：按 (open_id, 日期) 计数，支持进程内存与 SQLite 两种后端
+import asyncio
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from datetime import date, datetime, timedelta
+
+from image_gen_page.tool.common_tool import get_data_dir
+
+# 过期记录额外保留的时间（秒），避免跨零点时刚预留的配额被提前清理
+EXPIRE_GRACE_SECONDS = 3600
+
+
+def today() -> str:
+    return date.today().isoformat()
+
+
+def day_expires_at(day: str) -> float:
+    """某一天的配额记录过期时间戳（次日零点 + 宽限期）"""
+    next_day = datetime.fromisoformat(day) + timedelta(days=1)
+    return next_day.timestamp() + EXPIRE_GRACE_SECONDS
+
+
+class QuotaBackend(ABC):
+    """配额后端接口"""
+
+    @abstractmethod
+    async def reserve(self, open_id: str, count: int, daily_limit: int, day: str = "") -> tuple[bool, int]:
+        """预留配额，返回 (是否成功, 当日已用量)"""
+
+    @abstractmethod
+    async def refund(self, open_id: str, count: int, day: str = "") -> int:
+        """退还配额（生成失败时调用），返回退还后的当日已用量"""
+
+
+class MemoryQuotaBackend(QuotaBackend):
+    """进程内配额，仅适用于单 worker；日期切换时自动清理过期记录"""
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._usage: dict[tuple[str, str], int] = {}
+        self._current_day = ""
+
+    def _evict_expired(self, day: str):
+        if day <= self._current_day:
+            return
+        self._current_day = day
+        for key in [key for key in self._usage if key[1] < day]:
+            del self._usage[key]
+
+    async def reserve(self, open_id: str, count: int, daily_limit: int, day: str = "") -> tuple[bool, int]:
+        day = day or today()
+        async with self._lock:
+            self._evict_expired(day)
+            quota_key = (open_id, day)
+            used = self._usage.get(quota_key, 0)
+            if used + count > daily_limit:
+                return False, used
+            used += count
+            self._usage[quota_key] = used
+            return True, used
+
+    async def refund(self, open_id: str, count: int, day: str = "") -> int:
+        day = day or today()
+        async with self._lock:
+            quota_key = (open_id, day)
+            if quota_key not in self._usage:
+                return 0
+            used = max(self._usage[quota_key] - count, 0)
+            self._usage[quota_key] = used
+            return used
+
+
+class SqliteQuotaBackend(QuotaBackend):
+    """基于 SQLite 的配额，多个 worker 进程共享同一个数据库文件，使用原子 upsert 计数"""
+
+    # 清理过期记录的最小间隔（秒）
+    purge_interval = 600
+
+    def __init__(self, path: str):
+        self.path = path
+        self._last_purge = 0.0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS quota_usage (
+                    open_id TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    used INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (open_id, day)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS quota_usage_expires ON quota_usage (expires_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def _purge_expired(self, conn: sqlite3.Connection):
+        now = time.time()
+        if now - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = now
+        conn.execute("DELETE FROM quota_usage WHERE expires_at < ?", (now,))
+
+    def _reserve(self, open_id: str, count: int, daily_limit: int, day: str) -> tuple[bool, int]:
+        conn = self._connect()
+        try:
+            self._purge_expired(conn)
+            conn.execute("BEGIN IMMEDIATE")
+            if count <= daily_limit:
+                # 仅当累加后不超过上限时才更新，保证并发下的原子性
+                cursor = conn.execute("""
+                    INSERT INTO quota_usage (open_id, day, used, expires_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (open_id, day) DO UPDATE SET used = used + excluded.used
+                    WHERE quota_usage.used + excluded.used <= ?
+                """, (open_id, day, count, day_expires_at(day), daily_limit))
+                allowed = cursor.rowcount > 0
+            else:
+                allowed = False
+            row = conn.execute("SELECT used FROM quota_usage WHERE open_id = ? AND day = ?", (open_id, day)).fetchone()
+            conn.execute("COMMIT")
+            return allowed, row[0] if row else 0
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _refund(self, open_id: str, count: int, day: str) -> int:
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE quota_usage SET used = MAX(used - ?, 0) WHERE open_id = ? AND day = ?",
+                         (count, open_id, day))
+            row = conn.execute("SELECT used FROM quota_usage WHERE open_id = ? AND day = ?", (open_id, day)).fetchone()
+            return row[0] if row else 0
+        finally:
+            conn.close()
+
+    async def reserve(self, open_id: str, count: int, daily_limit: int, day: str = "") -> tuple[bool, int]:
+        return await asyncio.to_thread(self._reserve, open_id, count, daily_limit, day or today())
+
+    async def refund(self, open_id: str, count: int, day: str = "") -> int:
+        return await asyncio.to_thread(self._refund, open_id, count, day or today())
+
+
+_backend: QuotaBackend | None = None
+
+
+def get_quota_backend() -> QuotaBackend:
+    """根据 QUOTA_BACKEND 环境变量创建配额后端（memory 或 sqlite，默认 sqlite）"""
+    global _backend
+    if _backend is None:
+        backend = os.getenv('QUOTA_BACKEND', 'sqlite').strip().lower()
+        if backend == 'memory':
+            _backend = MemoryQuotaBackend()
+        else:
+            path = os.getenv('QUOTA_SQLITE_PATH') or str(get_data_dir() / 'quota.sqlite3')
+            _backend = SqliteQuotaBackend(path)
+    return _backend
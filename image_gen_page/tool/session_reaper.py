@@ -0,0 +1,141 @@
+# 内存状态管理器的会话回收：reflex 把每个会话的全部页面状态（含 base64 图片等大字段）常驻内存且从不释放，
+# 这里定期回收空闲超过 SESSION_TTL_SECONDS 的会话；估算总占用超过 SESSION_MEMORY_MB 时按最近访问时间淘汰会话，
+# 并输出会话数与各状态类的估算内存
+import asyncio
+import contextlib
+import sys
+import time
+
+from image_gen_page.tool.cancellation import busy_tokens, connected_tokens
+from image_gen_page.tool.config import get_config
+from image_gen_page.tool.metrics import SESSIONS, SESSIONS_EVICTED, STATE_BYTES
+
+SWEEP_INTERVAL = 60  # 检查间隔（秒）
+MAX_DEPTH = 6  # 估算嵌套容器大小时的最大深度
+
+
+def approx_size(value, depth: int = 0) -> int:
+    """估算对象占用的内存：字符串与字节串按长度计，容器递归累加"""
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value)
+    if depth >= MAX_DEPTH:
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sum(approx_size(key, depth + 1) + approx_size(item, depth + 1) for key, item in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sum(approx_size(item, depth + 1) for item in value) + 8 * len(value)
+    return sys.getsizeof(value)
+
+
+def state_sizes(state) -> dict[str, int]:
+    """会话状态树中各状态类的变量（含后端变量）估算大小"""
+    sizes = {}
+    pending = [state]
+    while pending:
+        current = pending.pop()
+        values = current.__dict__
+        size = sum(approx_size(values.get(name)) for name in current.base_vars)
+        size += approx_size(values.get('_backend_vars', {}))
+        name = type(current).__name__
+        sizes[name] = sizes.get(name, 0) + size
+        pending.extend(current.substates.values())
+    return sizes
+
+
+class SessionReaper:
+    def __init__(self, manager):
+        self.manager = manager
+        self.last_access: dict[str, float] = {}
+
+    def install(self):
+        """记录每次读取、修改状态（处理前端事件、上传、后台任务推送）的时间作为会话的最近访问时间"""
+        get_state, modify_state = self.manager.get_state, self.manager.modify_state
+
+        def touch(token: str):
+            # token 可能带有 "_状态名" 后缀
+            self.last_access[token.partition('_')[0]] = time.monotonic()
+
+        async def tracked_get_state(token: str):
+            touch(token)
+            return await get_state(token)
+
+        @contextlib.asynccontextmanager
+        async def tracked_modify_state(token: str, **context):
+            touch(token)
+            async with modify_state(token, **context) as state:
+                yield state
+
+        self.manager.get_state = tracked_get_state
+        self.manager.modify_state = tracked_modify_state
+
+    def _evict(self, token: str, reason: str):
+        self.manager.states.pop(token, None)
+        self.manager._states_locks.pop(token, None)
+        self.last_access.pop(token, None)
+        SESSIONS_EVICTED.inc(reason=reason)
+
+    def sweep(self) -> list[str]:
+        """回收空闲会话并按内存上限淘汰，返回被回收的会话"""
+        config = get_config()
+        now = time.monotonic()
+        states = self.manager.states
+        connected = connected_tokens() or set()
+        busy = busy_tokens()
+        for token in list(self.last_access):
+            if token not in states:
+                del self.last_access[token]
+        for token in states:
+            if token in connected:
+                self.last_access[token] = now
+            else:
+                self.last_access.setdefault(token, now)
+        sizes = {token: state_sizes(state) for token, state in list(states.items())}
+        total = sum(sum(size.values()) for size in sizes.values())
+        evicted = []
+        # 正在修改状态或有生成在执行的会话不回收；内存超限时先淘汰已断开的会话，再按最近访问时间从旧到新淘汰
+        candidates = [token for token in sizes if token not in busy and not self._locked(token)]
+        candidates.sort(key=lambda token: (token in connected, self.last_access[token]))
+        for token in candidates:
+            over_budget = config.session_memory_bytes and total > config.session_memory_bytes
+            if over_budget:
+                reason = 'memory'
+            elif token not in connected and now - self.last_access[token] >= config.session_ttl_seconds:
+                reason = 'ttl'
+            else:
+                continue
+            total -= sum(sizes.pop(token).values())
+            self._evict(token, reason)
+            evicted.append(token)
+        if config.session_memory_bytes and total > config.session_memory_bytes:
+            print(f"[会话回收] 估算占用 {total / 1024 / 1024:.0f}MB 仍超过上限，剩余会话均在使用中")
+        SESSIONS.set(len(states))
+        STATE_BYTES.clear()
+        by_class = {}
+        for size in sizes.values():
+            for name, value in size.items():
+                by_class[name] = by_class.get(name, 0) + value
+        for name, value in by_class.items():
+            STATE_BYTES.set(value, state=name)
+        return evicted
+
+    def _locked(self, token: str) -> bool:
+        lock = self.manager._states_locks.get(token)
+        return lock is not None and lock.locked()
+
+
+async def reap_sessions():
+    """应用生命周期任务：使用内存状态管理器时定期回收空闲会话"""
+    from reflex.istate.manager.memory import StateManagerMemory
+    from reflex.utils.prerequisites import get_app
+
+    manager = get_app().app.state_manager
+    if not isinstance(manager, StateManagerMemory):
+        # redis / 磁盘状态管理器自带过期机制
+        return
+    reaper = SessionReaper(manager)
+    reaper.install()
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        evicted = reaper.sweep()
+        if evicted:
+            print(f"[会话回收] 回收 {len(evicted)} 个会话，剩余 {len(manager.states)} 个")
@@ -0,0 +1,251 @@
+# 生成过程的分段追踪：排队、上传编码、翻译、上游请求、轮询、截图、状态推送等阶段各记录一个 span，
+# ID 与 OpenTelemetry（W3C traceparent）兼容，导出到本地 JSONL 文件或 OTLP/HTTP 收集端；失败提示中附带追踪ID便于排查
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import secrets
+import time
+import traceback
+from dataclasses import dataclass, field
+
+import aiohttp
+import reflex as rx
+
+from image_gen_page.tool.common_tool import get_data_dir
+from image_gen_page.tool.config import get_config
+
+SERVICE_NAME = 'image_gen_page'
+MAX_BUFFERED_SPANS = 10000
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str = ''
+    start_ns: int = 0
+    end_ns: int = 0
+    attributes: dict = field(default_factory=dict)
+    error: str = ''
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_json(self) -> dict:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_span_id': self.parent_id,
+            'name': self.name,
+            'start_time_unix_nano': self.start_ns,
+            'end_time_unix_nano': self.end_ns,
+            'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'status': 'ERROR' if self.error else 'OK',
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+_current: contextvars.ContextVar[Span | None] = contextvars.ContextVar('trace_span', default=None)
+_buffer: list[Span] = []
+
+
+def current_span() -> Span | None:
+    return _current.get()
+
+
+def trace_id() -> str:
+    current = _current.get()
+    return current.trace_id if current else ''
+
+
+def _parse_traceparent(value: str) -> tuple[str, str] | None:
+    parts = value.split('-')
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+        return parts[1], parts[2]
+    return None
+
+
+def _start(name: str, parent: Span | str | None, attributes: dict) -> Span:
+    if isinstance(parent, str):
+        ids = _parse_traceparent(parent)
+        trace, parent_id = ids if ids else (secrets.token_hex(16), '')
+    elif parent is not None:
+        trace, parent_id = parent.trace_id, parent.span_id
+    else:
+        trace, parent_id = secrets.token_hex(16), ''
+    return Span(name, trace, secrets.token_hex(8), parent_id, time.time_ns(), attributes=attributes)
+
+
+@contextlib.contextmanager
+def span(name: str, parent: Span | str | None = None, **attributes):
+    """记录一个阶段：with span('screenshot', provider='screenshot') as current: ...；
+    未指定 parent 时挂在当前 span 下，没有当前 span 时开始新的追踪；parent 也可以是 traceparent 字符串"""
+    current = _start(name, parent if parent is not None else _current.get(), attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except (asyncio.CancelledError, GeneratorExit):
+        current.set(cancelled=True)
+        raise
+    except Exception as e:
+        current.error = f"{type(e).__name__}: {e}"[:500]
+        raise
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # 异步生成器在其他上下文中被关闭时无法还原，忽略
+            pass
+        current.end_ns = time.time_ns()
+        _export(current)
+
+
+def record_span(name: str, start_ns: int, end_ns: int, parent: Span | None, error: str = '', **attributes) -> Span:
+    """补记一个已经结束的阶段（如排队等待、上游请求），parent 为阶段开始时的当前 span"""
+    recorded = _start(name, parent, attributes)
+    recorded.start_ns, recorded.end_ns, recorded.error = start_ns, end_ns, error
+    _export(recorded)
+    return recorded
+
+
+def with_trace_id(message: str) -> str:
+    current = trace_id()
+    return f"{message}\n追踪ID：{current}" if current else message
+
+
+def error_alert(message: str):
+    """失败提示，附带当前追踪ID"""
+    return rx.window_alert(with_trace_id(message))
+
+
+# ---------- 导出 ----------
+
+def _export(finished: Span):
+    if get_config().trace_export not in ('jsonl', 'otlp'):
+        return
+    _buffer.append(finished)
+    if len(_buffer) > MAX_BUFFERED_SPANS:
+        # 导出跟不上时丢弃最旧的数据
+        del _buffer[:len(_buffer) - MAX_BUFFERED_SPANS]
+
+
+def _trace_file() -> str:
+    return get_config().trace_file or str(get_data_dir() / 'traces.jsonl')
+
+
+def _write_jsonl(spans: list[Span]):
+    path = _trace_file()
+    max_bytes = get_config().trace_file_max_bytes
+    try:
+        if os.path.getsize(path) > max_bytes:
+            # 超过上限时轮转，只保留上一份
+            os.replace(path, path + '.1')
+    except OSError:
+        pass
+    with open(path, 'a', encoding='utf-8') as file:
+        for item in spans:
+            file.write(json.dumps(item.to_json(), ensure_ascii=False) + '\n')
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_payload(spans: list[Span]) -> dict:
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+        'scopeSpans': [{
+            'scope': {'name': SERVICE_NAME},
+            'spans': [{
+                'traceId': item.trace_id,
+                'spanId': item.span_id,
+                'parentSpanId': item.parent_id,
+                'name': item.name,
+                'kind': 1,
+                'startTimeUnixNano': str(item.start_ns),
+                'endTimeUnixNano': str(item.end_ns),
+                'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in item.attributes.items()],
+                'status': {'code': 2, 'message': item.error} if item.error else {'code': 1},
+            } for item in spans],
+        }],
+    }]}
+
+
+async def flush():
+    if not _buffer:
+        return
+    spans = _buffer[:]
+    del _buffer[:]
+    config = get_config()
+    if config.trace_export == 'jsonl':
+        await asyncio.to_thread(_write_jsonl, spans)
+    elif config.trace_export == 'otlp':
+        # 导出请求本身不经过 client_session，避免产生新的 span
+        async with aiohttp.ClientSession() as session:
+            async with session.post(config.trace_otlp_url, json=_otlp_payload(spans),
+                                    timeout=aiohttp.ClientTimeout(total=10)) as response:
+                if response.status >= 300:
+                    raise Exception(f"{response.status}-{await response.text()}")
+
+
+async def export_spans(interval: float = 2.0):
+    """应用生命周期任务：定期导出已结束的 span"""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await flush()
+            except Exception:
+                traceback.print_exc()
+    finally:
+        with contextlib.suppress(Exception):
+            await flush()
+
+
+# ---------- 上游请求 ----------
+
+async def _on_request_start(session, context, params):
+    context.trace_parent = _current.get()
+    context.trace_started_ns = time.time_ns()
+    # 向上游传递 traceparent，支持追踪的服务商可关联到同一追踪
+    if context.trace_parent is not None and 'traceparent' not in params.headers:
+        params.headers['traceparent'] = context.trace_parent.traceparent
+
+
+async def _on_request_end(session, context, params):
+    # 记录到收到响应头为止（即首字节时间），流式响应体的读取由调用方的 span 覆盖
+    record_span(f"HTTP {params.method}", context.trace_started_ns, time.time_ns(), context.trace_parent,
+                **{'http.url': str(params.url.with_query(None)), 'http.status_code': params.response.status})
+
+
+async def _on_request_exception(session, context, params):
+    record_span(f"HTTP {params.method}", context.trace_started_ns, time.time_ns(), context.trace_parent,
+                error=f"{type(params.exception).__name__}: {params.exception}"[:500],
+                **{'http.url': str(params.url.with_query(None))})
+
+
+_trace_config: aiohttp.TraceConfig | None = None
+
+
+def http_trace_config() -> aiohttp.TraceConfig:
+    global _trace_config
+    if _trace_config is None:
+        _trace_config = aiohttp.TraceConfig()
+        _trace_config.on_request_start.append(_on_request_start)
+        _trace_config.on_request_end.append(_on_request_end)
+        _trace_config.on_request_exception.append(_on_request_exception)
+    return _trace_config
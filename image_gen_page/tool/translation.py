@@ -0,0 +1,200 @@
+# 提示词翻译服务：翻译调用不阻塞事件循环，结果缓存在内存（LRU）与磁盘（SQLite）中
+# 已是英文的提示词直接跳过；翻译引擎可选 google（deep_translator）或 OpenAI 兼容的聊天接口
+import asyncio
+import hashlib
+import re
+import sqlite3
+import time
+import traceback
+from collections import OrderedDict
+
+import aiohttp
+from deep_translator import GoogleTranslator
+
+from image_gen_page.tool.common_tool import get_data_dir
+from image_gen_page.tool.config import get_config
+from image_gen_page.tool.metrics import cache_result, client_session
+from image_gen_page.tool.tracing import current_span, span
+
+# 中日韩文字（汉字、假名、谚文）
+_CJK = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]')
+
+
+def needs_translation(text: str) -> bool:
+    """包含中日韩文字时才需要翻译"""
+    return bool(_CJK.search(text))
+
+
+class GoogleEngine:
+    name = 'google'
+
+    @staticmethod
+    def _translate(text: str, source: str, target: str) -> str:
+        # GoogleTranslator.translate 把文本写入实例属性后再发请求，实例不能在线程间共享，每次调用单独创建
+        proxy_url = get_config().translate_proxy
+        proxies = {'http': proxy_url, 'https': proxy_url} if proxy_url else None
+        return GoogleTranslator(source=source, target=target, proxies=proxies).translate(text)
+
+    async def translate(self, text: str, source: str, target: str) -> str:
+        # deep_translator 为同步 HTTP 调用，放到线程中执行
+        return await asyncio.to_thread(self._translate, text, source, target)
+
+
+class OpenAIEngine:
+    name = 'openai'
+
+    async def translate(self, text: str, source: str, target: str) -> str:
+        config = get_config()
+        async with client_session() as session:
+            async with session.post(
+                    config.translate.base_url + '/chat/completions',
+                    json={
+                        'model': config.translate_model,
+                        'messages': [
+                            {'role': 'system',
+                             'content': f"Translate the user's image prompt from {source} to {target}. "
+                                        "Keep the meaning and details, output only the translation."},
+                            {'role': 'user', 'content': text},
+                        ],
+                        'temperature': 0,
+                    },
+                    headers={
+                        'Content-Type': 'application/json',
+                        'Authorization': 'Bearer ' + config.translate.api_key
+                    },
+                    timeout=aiohttp.ClientTimeout(total=60),
+            ) as response:
+                if response.status != 200:
+                    raise Exception(f"{response.status}-{await response.text()}")
+                data = await response.json()
+                return data['choices'][0]['message']['content'].strip()
+
+
+ENGINES = {engine.name: engine for engine in (GoogleEngine, OpenAIEngine)}
+
+
+class TranslationService:
+    """带两级缓存的翻译服务，相同文本的并发请求共享一次翻译"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._memory: OrderedDict[str, str] = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._engines = {}
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS translations (
+                    key TEXT PRIMARY KEY,
+                    result TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS translations_created_at ON translations (created_at)")
+            # 本进程估计的记录数，超出上限时淘汰
+            self._count = conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def _engine(self):
+        name = get_config().translate_engine
+        if name not in self._engines:
+            self._engines[name] = ENGINES.get(name, GoogleEngine)()
+        return self._engines[name]
+
+    def _remember(self, key: str, result: str):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > get_config().translate_cache_size:
+            self._memory.popitem(last=False)
+
+    def _load(self, key: str) -> str | None:
+        with self._connect() as conn:
+            row = conn.execute("SELECT result FROM translations WHERE key = ?", (key,)).fetchone()
+            if row:
+                # created_at 同时作为最近访问时间，淘汰时按它从旧到新删除
+                conn.execute("UPDATE translations SET created_at = ? WHERE key = ?", (time.time(), key))
+        return row[0] if row else None
+
+    def _store(self, key: str, result: str):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO translations (key, result, created_at) VALUES (?, ?, ?)",
+                         (key, result, time.time()))
+            self._count += 1
+            max_entries = get_config().translate_disk_cache_size
+            if self._count > max_entries:
+                self._evict(conn, max_entries)
+
+    def _evict(self, conn: sqlite3.Connection, max_entries: int):
+        """按最近访问时间从旧到新删除，直到记录数降到上限的 90%"""
+        self._count = conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        excess = self._count - int(max_entries * 0.9)
+        if excess > 0:
+            conn.execute("DELETE FROM translations WHERE key IN "
+                         "(SELECT key FROM translations ORDER BY created_at LIMIT ?)", (excess,))
+            self._count -= excess
+
+    async def translate(self, text: str, source: str = 'zh-CN', target: str = 'en') -> str:
+        text = text.strip()
+        if not text or (target == 'en' and not needs_translation(text)):
+            return text
+        engine = self._engine()
+        key = hashlib.sha256(f"{engine.name}\n{source}\n{target}\n{text}".encode()).hexdigest()
+        cache_result('translation_memory', key in self._memory)
+        current = current_span()
+        if current is not None:
+            current.set(engine=engine.name)
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            if current is not None:
+                current.set(cache='memory')
+            return self._memory[key]
+        if key in self._inflight:
+            if current is not None:
+                current.set(cache='inflight')
+            return await asyncio.shield(self._inflight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await asyncio.to_thread(self._load, key)
+            cache_result('translation_disk', result is not None)
+            if current is not None:
+                current.set(cache='disk' if result is not None else 'miss')
+            if result is None:
+                result = await engine.translate(text, source, target)
+                await asyncio.to_thread(self._store, key, result)
+            self._remember(key, result)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待方时避免出现未读取的异常警告
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+
+_service: TranslationService | None = None
+
+
+def get_translation_service() -> TranslationService:
+    global _service
+    if _service is None:
+        _service = TranslationService(str(get_data_dir() / 'translations.sqlite3'))
+    return _service
+
+
+async def translate(text: str, source: str = 'zh-CN', target: str = 'en') -> str:
+    """翻译提示词，失败时返回原文，避免因翻译服务不可用导致生成失败"""
+    with span('translate', source=source, target=target):
+        try:
+            return await get_translation_service().translate(text, source, target)
+        except Exception:
+            traceback.print_exc()
+            return text
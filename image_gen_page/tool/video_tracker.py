@@ -0,0 +1,129 @@
+# 视频生成任务跟踪：按退避间隔查询 OpenAI 兼容的 /videos/{task_id} 接口，产出进度与预计剩余时间
+# 远端任务ID保存在任务断点中，worker 重启后从同一个任务继续跟踪，一次提交只产生一个视频
+import asyncio
+import math
+import time
+from dataclasses import dataclass
+
+import aiohttp
+
+from image_gen_page.tool.tracing import span
+
+RUNNING_STATUSES = ('queued', 'pending', 'in_progress', 'processing', 'running', 'submitted')
+DONE_STATUSES = ('completed', 'succeeded', 'success', 'done')
+FAILED_STATUSES = ('failed', 'error', 'cancelled', 'canceled', 'expired')
+
+
+@dataclass
+class VideoStatus:
+    status: str  # running / completed
+    progress: float = 0  # 0-100
+    eta: float | None = None  # 预计剩余秒数，无法估算时为 None
+    url: str = ''
+
+    def message(self) -> str:
+        text = f"视频生成中 {int(self.progress)}%"
+        if self.eta is not None:
+            text += f"，预计剩余 {math.ceil(self.eta)} 秒"
+        return text
+
+
+def extract_video_url(result: dict) -> str:
+    """尝试从不同字段获取视频URL"""
+    if result.get('url'):
+        return result['url']
+    if result.get('video_url'):
+        return result['video_url']
+    data = result.get('data') or []
+    if isinstance(data, list) and data and data[0].get('url'):
+        return data[0]['url']
+    return ''
+
+
+def _parse_progress(value) -> float:
+    try:
+        return min(max(float(str(value).rstrip('%')), 0), 100)
+    except (TypeError, ValueError):
+        return 0
+
+
+async def track_video_task(session: aiohttp.ClientSession, task_url: str, headers: dict, timeout: float = 1800,
+                           min_interval: float = 2, max_interval: float = 15, push: asyncio.Future | None = None):
+    """跟踪视频任务直到完成：每次查询产出 VideoStatus，最后一次的 status 为 completed 且带视频URL；失败或超时抛出异常。
+    push 为完成回调的 future，回调到达时立即使用回调数据，轮询只作兜底并使用最长间隔"""
+    with span('video.poll', pushed=push is not None) as current:
+        if push is not None:
+            min_interval = max_interval
+        started_at = time.monotonic()
+        interval = min_interval
+        # 第一次观察到的进度，用于根据进度增长速度估算剩余时间
+        first_seen: tuple[float, float] | None = None
+        last_progress = -1.0
+        errors = 0
+        while True:
+            if time.monotonic() - started_at > timeout:
+                raise Exception("等待视频生成超时")
+            if push is not None and push.done() and not push.cancelled():
+                result = push.result()
+                push = None
+            else:
+                current.set(polls=current.attributes.get('polls', 0) + 1)
+                async with session.get(task_url, headers=headers) as response:
+                    if response.status != 200:
+                        error_text = await response.text()
+                        # 服务端临时错误时退避重试，4xx 直接失败
+                        if response.status < 500 or errors >= 5:
+                            raise Exception(f"获取视频失败：{response.status}-{error_text}")
+                        errors += 1
+                        await _sleep(max_interval, push)
+                        continue
+                    result = await response.json()
+                errors = 0
+
+            status = str(result.get('status', '')).lower()
+            url = extract_video_url(result)
+            if status in FAILED_STATUSES:
+                error = result.get('error') or result.get('message') or status
+                raise Exception(f"视频生成失败：{error}")
+            if status in DONE_STATUSES or (url and status not in RUNNING_STATUSES):
+                if not url:
+                    raise Exception(f"视频生成完成，但未找到视频URL：{result}")
+                yield VideoStatus('completed', 100, 0, url)
+                return
+
+            now = time.monotonic()
+            progress = _parse_progress(result.get('progress'))
+            eta = None
+            if first_seen is None:
+                first_seen = (now, progress)
+            elif progress > first_seen[1]:
+                rate = (progress - first_seen[1]) / (now - first_seen[0])
+                eta = (100 - progress) / rate
+            yield VideoStatus('running', progress, eta)
+
+            # 进度有变化时保持较短间隔，长时间无变化则逐步拉长；预计快完成时缩短间隔
+            if progress > last_progress:
+                interval = min_interval
+            else:
+                interval = min(interval * 1.5, max_interval)
+            last_progress = progress
+            if eta is not None:
+                interval = min(interval, max(eta / 2, min_interval))
+            await _sleep(interval, push)
+
+
+async def _sleep(seconds: float, push: asyncio.Future | None):
+    """等待下一次查询，回调到达时提前结束"""
+    if push is None or push.cancelled():
+        await asyncio.sleep(seconds)
+    elif not push.done():
+        await asyncio.wait([push], timeout=seconds)
+
+
+async def delete_video_task(session: aiohttp.ClientSession, task_url: str, headers: dict):
+    """尽力删除远端视频任务，接口不支持时忽略"""
+    try:
+        async with session.delete(task_url, headers=headers) as response:
+            return response.status < 400
+    except aiohttp.ClientError:
+        return False
@@ -0,0 +1,79 @@
+# 异步任务完成回调（webhook）：服务商在任务完成时主动推送结果，省去轮询等待
+# 回调地址带 HMAC 签名，接收后按（类型, 任务ID）交给本进程内等待的任务；轮询作为兜底继续运行
+import asyncio
+import contextlib
+import hashlib
+import hmac
+import json
+
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from image_gen_page.tool.config import get_config
+
+# (类型, 任务ID) -> 等待回调结果的 future
+_waiters: dict[tuple[str, str], asyncio.Future] = {}
+
+
+def webhook_enabled() -> bool:
+    config = get_config()
+    return bool(config.webhook_base_url and config.webhook_secret)
+
+
+def sign(kind: str, key: str) -> str:
+    return hmac.new(get_config().webhook_secret.encode(), f"{kind}:{key}".encode(), hashlib.sha256).hexdigest()
+
+
+def webhook_url(kind: str, key: str) -> str:
+    """生成回调地址，未配置 WEBHOOK_BASE_URL / WEBHOOK_SECRET 时返回空字符串"""
+    if not webhook_enabled():
+        return ''
+    return f"{get_config().webhook_base_url}/webhook/{kind}/{key}?token={sign(kind, key)}"
+
+
+@contextlib.contextmanager
+def expect(kind: str, key: str, enabled: bool = True):
+    """等待某个任务的回调：with expect('fal', job.id) as push: ...；未启用回调（或 enabled=False）时 push 为 None"""
+    if not enabled or not webhook_enabled():
+        yield None
+        return
+    future = asyncio.get_running_loop().create_future()
+    _waiters[(kind, key)] = future
+    try:
+        yield future
+    finally:
+        if _waiters.get((kind, key)) is future:
+            del _waiters[(kind, key)]
+        if not future.done():
+            future.cancel()
+
+
+async def first_result(push: asyncio.Future | None, poll: asyncio.Future):
+    """回调与轮询谁先拿到结果用谁，另一方随即取消"""
+    if push is None:
+        return await poll
+    try:
+        done, _ = await asyncio.wait([push, poll], return_when=asyncio.FIRST_COMPLETED)
+        if push in done and not push.cancelled():
+            return push.result()
+        return poll.result()
+    finally:
+        poll.cancel()
+
+
+async def receive(request: Request):
+    """回调接收路由：POST /webhook/{kind}/{key}?token=签名"""
+    kind = request.path_params['kind']
+    key = request.path_params['key']
+    if not webhook_enabled() or not hmac.compare_digest(request.query_params.get('token', ''), sign(kind, key)):
+        return JSONResponse({'error': 'invalid token'}, status_code=403)
+    try:
+        payload = json.loads(await request.body())
+    except ValueError:
+        return JSONResponse({'error': 'invalid json'}, status_code=400)
+    future = _waiters.get((kind, key))
+    if future is None or future.done():
+        # 等待方不在本进程（或已通过轮询拿到结果），由轮询兜底
+        return JSONResponse({'ok': True, 'delivered': False}, status_code=202)
+    future.set_result(payload)
+    return JSONResponse({'ok': True, 'delivered': True})
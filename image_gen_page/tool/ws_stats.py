@@ -0,0 +1,224 @@
+# websocket 流量统计：按状态类与事件处理函数统计前端发来的事件数、下发的状态增量大小，按变量统计增量体积，
+# 并记录流量最大的会话；定期打印报告，明细见 /metrics 与 /debug/ws。通过 WS_STATS=1 开启
+import asyncio
+import contextvars
+import functools
+import json
+import time
+from dataclasses import asdict, dataclass, field
+
+import reflex as rx
+from reflex.utils.format import json_dumps
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from image_gen_page.tool.config import get_config
+from image_gen_page.tool.debug import debug_route, int_param
+from image_gen_page.tool.metrics import WS_DELTA_BYTES, WS_DELTAS, WS_EVENT_BYTES, WS_EVENTS, WS_VAR_BYTES
+
+VAR_SUFFIX = '_rx_state_'  # 增量中变量名的后缀
+MAX_SESSIONS = 1000  # 最多保留的会话数，超出时丢弃最久未活动的会话
+NO_EVENT = '-'  # 不在前端事件处理中产生的增量（如任务队列 worker 更新状态）
+
+# 当前正在处理的前端事件（状态类, 处理函数）；后台任务创建时继承
+_current_event: contextvars.ContextVar[tuple[str, str]] = contextvars.ContextVar('ws_current_event',
+                                                                                 default=(NO_EVENT, NO_EVENT))
+
+
+@dataclass
+class Traffic:
+    events: int = 0
+    event_bytes: int = 0
+    deltas: int = 0
+    delta_bytes: int = 0
+
+
+@dataclass
+class SessionTraffic(Traffic):
+    page: str = ''
+    last_seen: float = field(default_factory=time.time)
+
+
+@functools.lru_cache(maxsize=None)
+def state_name(full_name: str) -> str:
+    """状态的完整路径名转为类名，如 reflex___state____state.image_gen_page___pages___jimeng____jimeng_state -> JimengState"""
+    try:
+        return rx.State.get_class_substate(full_name).__name__
+    except (ValueError, AttributeError):
+        return full_name.rpartition('.')[2]
+
+
+def _size(value) -> int:
+    return len(json_dumps(value).encode())
+
+
+class WsStats:
+    def __init__(self):
+        self.handlers: dict[tuple[str, str], Traffic] = {}
+        self.vars: dict[tuple[str, str], int] = {}
+        self.sessions: dict[str, SessionTraffic] = {}  # 按最近活动时间排序
+        self.started_at = time.time()
+        self._reported: tuple[dict[tuple[str, str], Traffic], dict[tuple[str, str], int]] = ({}, {})
+
+    def _session(self, token: str) -> SessionTraffic:
+        session = self.sessions.pop(token, None) or SessionTraffic()
+        session.last_seen = time.time()
+        self.sessions[token] = session
+        if len(self.sessions) > MAX_SESSIONS:
+            del self.sessions[next(iter(self.sessions))]
+        return session
+
+    def _handler(self, state: str, handler: str) -> Traffic:
+        traffic = self.handlers.get((state, handler))
+        if traffic is None:
+            traffic = self.handlers[state, handler] = Traffic()
+        return traffic
+
+    def record_event(self, token: str, data) -> tuple[str, str]:
+        """记录一次前端事件，返回（状态类, 处理函数）"""
+        if not isinstance(data, dict):
+            return NO_EVENT, NO_EVENT
+        full_name, _, handler = str(data.get('name', '')).rpartition('.')
+        state = state_name(full_name)
+        size = len(json.dumps(data, ensure_ascii=False, default=str).encode())
+        traffic = self._handler(state, handler)
+        traffic.events += 1
+        traffic.event_bytes += size
+        WS_EVENTS.inc(state=state, handler=handler)
+        WS_EVENT_BYTES.inc(size, state=state, handler=handler)
+        session = self._session(token)
+        session.events += 1
+        session.event_bytes += size
+        session.page = (data.get('router_data') or {}).get('pathname') or session.page
+        return state, handler
+
+    def record_update(self, token: str, delta: dict):
+        """记录一次下发的状态增量，增量按其所属状态类与触发它的事件处理函数归类"""
+        _, handler = _current_event.get()
+        total = 0
+        for full_name, values in delta.items():
+            state = state_name(full_name)
+            size = 0
+            for var, value in values.items():
+                var_size = _size(value)
+                size += var_size
+                var = var.removesuffix(VAR_SUFFIX)
+                self.vars[state, var] = self.vars.get((state, var), 0) + var_size
+                WS_VAR_BYTES.inc(var_size, state=state, var=var)
+            traffic = self._handler(state, handler)
+            traffic.deltas += 1
+            traffic.delta_bytes += size
+            WS_DELTAS.inc(state=state, handler=handler)
+            WS_DELTA_BYTES.inc(size, state=state, handler=handler)
+            total += size
+        session = self._session(token)
+        session.deltas += 1
+        session.delta_bytes += total
+
+    def top_handlers(self, limit: int = 20) -> list[tuple[tuple[str, str], Traffic]]:
+        return sorted(self.handlers.items(), key=lambda item: -(item[1].delta_bytes + item[1].event_bytes))[:limit]
+
+    def top_vars(self, limit: int = 20) -> list[tuple[tuple[str, str], int]]:
+        return sorted(self.vars.items(), key=lambda item: -item[1])[:limit]
+
+    def top_sessions(self, limit: int = 20) -> list[tuple[str, SessionTraffic]]:
+        return sorted(self.sessions.items(), key=lambda item: -(item[1].delta_bytes + item[1].event_bytes))[:limit]
+
+    def report(self, limit: int = 10) -> str:
+        """上次报告以来的流量：各事件处理函数与各变量，以及累计流量最大的会话"""
+        last_handlers, last_vars = self._reported
+        handlers = {}
+        for key, traffic in self.handlers.items():
+            last = last_handlers.get(key, Traffic())
+            window = Traffic(traffic.events - last.events, traffic.event_bytes - last.event_bytes,
+                             traffic.deltas - last.deltas, traffic.delta_bytes - last.delta_bytes)
+            if window.events or window.deltas:
+                handlers[key] = window
+        variables = {key: size - last_vars.get(key, 0) for key, size in self.vars.items()
+                     if size > last_vars.get(key, 0)}
+        self._reported = ({key: Traffic(**asdict(traffic)) for key, traffic in self.handlers.items()}, dict(self.vars))
+        if not handlers:
+            return ''
+        lines = ['[websocket] 事件处理函数（上行事件数/大小，下行增量数/大小）：']
+        for (state, handler), traffic in sorted(handlers.items(),
+                                                key=lambda item: -(item[1].delta_bytes + item[1].event_bytes))[:limit]:
+            lines.append(f"  {state}.{handler}: {traffic.events} / {_kb(traffic.event_bytes)}，"
+                         f"{traffic.deltas} / {_kb(traffic.delta_bytes)}")
+        lines.append('[websocket] 变量（下行大小）：')
+        for (state, var), size in sorted(variables.items(), key=lambda item: -item[1])[:limit]:
+            lines.append(f"  {state}.{var}: {_kb(size)}")
+        lines.append('[websocket] 累计流量最大的会话：')
+        for token, session in self.top_sessions(5):
+            lines.append(f"  {token[:8]} {session.page}: 上行 {_kb(session.event_bytes)}，下行 {_kb(session.delta_bytes)}")
+        return '\n'.join(lines)
+
+
+def _kb(size: int) -> str:
+    return f"{size / 1024:.1f}KB"
+
+
+_stats: WsStats | None = None
+
+
+def get_ws_stats() -> WsStats:
+    global _stats
+    if _stats is None:
+        _stats = WsStats()
+    return _stats
+
+
+def instrument(namespace):
+    """替换 reflex websocket 命名空间实例上的事件接收与增量下发方法，统计经过的流量"""
+    stats = get_ws_stats()
+    on_event, emit_update = namespace.on_event, namespace.emit_update
+
+    async def traced_on_event(sid: str, data):
+        current = stats.record_event(namespace.sid_to_token.get(sid, ''), data)
+        reset = _current_event.set(current)
+        try:
+            return await on_event(sid, data)
+        finally:
+            _current_event.reset(reset)
+
+    async def traced_emit_update(update, token: str):
+        # 后台任务推送时 token 可能带有 "_状态名" 后缀
+        stats.record_update(token.partition('_')[0], update.delta)
+        return await emit_update(update=update, token=token)
+
+    namespace.on_event = traced_on_event
+    namespace.emit_update = traced_emit_update
+
+
+async def report_ws_stats():
+    """应用生命周期任务：WS_STATS 开启时统计 websocket 流量并定期打印报告"""
+    if not get_config().ws_stats:
+        return
+    from reflex.utils.prerequisites import get_app
+    namespace = get_app().app.event_namespace
+    if namespace is None:
+        return
+    instrument(namespace)
+    stats = get_ws_stats()
+    while True:
+        await asyncio.sleep(get_config().ws_stats_report_seconds)
+        report = stats.report()
+        if report:
+            print(report)
+
+
+@debug_route
+async def endpoint(request: Request):
+    """流量最大的会话与事件处理函数：GET /debug/ws?limit=20"""
+    try:
+        limit = int_param(request, 'limit', 20)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    stats = get_ws_stats()
+    return JSONResponse({
+        'enabled': get_config().ws_stats,
+        'since': stats.started_at,
+        'sessions': [{'token': token, **asdict(session)} for token, session in stats.top_sessions(limit)],
+        'handlers': [{'state': state, 'handler': handler, **asdict(traffic)}
+                     for (state, handler), traffic in stats.top_handlers(limit)],
+        'vars': [{'state': state, 'var': var, 'bytes': size} for (state, var), size in stats.top_vars(limit)],
+    })